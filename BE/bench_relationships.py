@@ -0,0 +1,170 @@
+"""
+Benchmark: bảng relationships cũ (2 dòng/cặp, type chuỗi tiếng Việt, lọc type IN (...))
+so với person_links (1 dòng/cặp, kind số nhỏ, index (người, kind)).
+
+Sinh dữ liệu giả, ghi theo cả 2 cách, chạy migrate rồi so số dòng, dung lượng ước tính
+và thời gian tra vợ/chồng, anh chị em của nhiều người ngẫu nhiên.
+
+Chạy: python bench_relationships.py            (SQLite in-memory)
+      BENCH_DB_URL=mysql+pymysql://... python bench_relationships.py   (database trống dùng để thử)
+"""
+import sys
+sys.path.append('.')
+
+import os
+import random
+import time
+from datetime import date
+
+from sqlalchemy import create_engine, Index
+from sqlalchemy.orm import sessionmaker
+
+from db.mysql_connection import Base
+from models import Family, Person, Relationship, PersonLink
+from person_links import LINK_SPOUSE, LINK_SIBLING, linked_ids, linked_pairs, describe_relation, sibling_label, child_label
+from relationship_sync import regenerate_relationships
+from migrate_db import migrate_spouse_links
+
+LEGACY_SIBLING_TYPES = [sibling_label(g, older, full) for g in ('male', 'female') for older in (True, False) for full in (True, False)]
+
+
+def make_people(n):
+    """Cây giả: mỗi cặp vợ chồng 0-5 con, dâu/rể không có cha mẹ."""
+    people = [{"id": 1, "gender": "male", "father_id": None, "mother_id": None}]
+    couples = []
+    next_id = 2
+    queue = [1]
+    while queue and next_id <= n:
+        pid = queue.pop(0)
+        spouse_id = next_id
+        next_id += 1
+        people.append({"id": spouse_id, "gender": "female" if people[pid - 1]["gender"] == "male" else "male",
+                       "father_id": None, "mother_id": None})
+        couples.append((pid, spouse_id))
+        father, mother = (pid, spouse_id) if people[pid - 1]["gender"] == "male" else (spouse_id, pid)
+        for _ in range(random.randint(0, 5)):
+            if next_id > n:
+                break
+            people.append({"id": next_id, "gender": random.choice(["male", "female"]),
+                           "father_id": father, "mother_id": mother})
+            queue.append(next_id)
+            next_id += 1
+    for p in people:
+        p["date_of_birth"] = date(1900 + random.randrange(120), 1 + random.randrange(12), 1 + random.randrange(28))
+    return people, couples
+
+
+def legacy_rows(people, couples):
+    """Các dòng relationships kiểu cũ (create_member / migrate_db trước đây)."""
+    by_id = {p["id"]: p for p in people}
+    rows = []
+    for a, b in couples:
+        rows.append((a, b, "chồng" if by_id[a]["gender"] == "male" else "vợ"))
+        rows.append((b, a, "chồng" if by_id[b]["gender"] == "male" else "vợ"))
+    groups = {}
+    for p in people:
+        if p["father_id"]:
+            rows.append((p["father_id"], p["id"], "bố"))
+            rows.append((p["id"], p["father_id"], child_label(p["gender"])))
+        if p["mother_id"]:
+            rows.append((p["mother_id"], p["id"], "mẹ"))
+            rows.append((p["id"], p["mother_id"], child_label(p["gender"])))
+        groups.setdefault((p["father_id"], p["mother_id"]), []).append(p)
+    for (father_id, mother_id), members in groups.items():
+        if not father_id:
+            continue
+        for a in members:
+            for b in members:
+                if a is not b:
+                    older = (a["date_of_birth"], a["id"]) < (b["date_of_birth"], b["id"])
+                    rows.append((a["id"], b["id"], sibling_label(a["gender"], older, True)))
+    return rows
+
+
+def bench(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    engine = create_engine(os.getenv("BENCH_DB_URL", "sqlite://"))
+    Base.metadata.create_all(engine)
+    # Index như db.sql cho bảng cũ
+    for index in (Index('bench_idx_person1', Relationship.person1_id), Index('bench_idx_pair', Relationship.person1_id, Relationship.person2_id)):
+        index.create(engine, checkfirst=True)
+    db = sessionmaker(bind=engine)()
+
+    people, couples = make_people(n)
+    family = Family(name="Bench")
+    db.add(family)
+    db.flush()
+    for p in people:
+        p["family_id"] = family.id
+    db.bulk_insert_mappings(Person, [dict(p, first_name=f"P{p['id']}") for p in people])
+    legacy = legacy_rows(people, couples)
+    db.bulk_insert_mappings(Relationship, [{"person1_id": a, "person2_id": b, "type": t} for a, b, t in legacy])
+    db.commit()
+
+    start = time.perf_counter()
+    migrate_spouse_links(db)
+    regenerate_relationships(db, family.id)
+    db.commit()
+    migrate_time = time.perf_counter() - start
+
+    links = db.query(PersonLink).count()
+    legacy_bytes = sum(4 * 3 + len(t.encode()) for _, _, t in legacy)  # id, person1, person2 + type
+    link_bytes = links * (4 + 2 + 4)
+    print(f"{len(people):,} người, migrate {migrate_time:.2f}s")
+    print(f"relationships: {len(legacy):>10,} dòng  ~{legacy_bytes / 1e6:.1f} MB dữ liệu (chưa tính index)")
+    print(f"person_links:  {links:>10,} dòng  ~{link_bytes / 1e6:.1f} MB dữ liệu (chưa tính index)")
+
+    sample = random.sample([p["id"] for p in people], 2000)
+
+    def legacy_spouses():
+        for pid in sample:
+            db.query(Relationship.person2_id).filter(Relationship.person1_id == pid, Relationship.type.in_(['vợ', 'chồng'])).all()
+
+    def link_spouses():
+        for pid in sample:
+            linked_ids(db, pid, LINK_SPOUSE)
+
+    def legacy_siblings():
+        for pid in sample:
+            db.query(Relationship.person2_id, Relationship.type).filter(
+                Relationship.person1_id == pid, Relationship.type.in_(LEGACY_SIBLING_TYPES)
+            ).all()
+
+    by_id = {p.id: p for p in db.query(Person.id, Person.gender, Person.date_of_birth, Person.father_id, Person.mother_id)}
+
+    def link_siblings():
+        # Gồm cả tính nhãn khi đọc (anh ruột / em gái ...)
+        for pid in sample:
+            [describe_relation(by_id[other], by_id[pid]) for other in linked_ids(db, pid, LINK_SIBLING)]
+
+    batch = random.sample([p["id"] for p in people], min(20_000, len(people)))
+
+    def legacy_batch_spouses():
+        db.query(Relationship.person1_id, Relationship.person2_id).filter(
+            Relationship.person1_id.in_(batch), Relationship.type.in_(['vợ', 'chồng'])
+        ).all()
+
+    def legacy_batch_siblings():
+        db.query(Relationship.person1_id, Relationship.person2_id, Relationship.type).filter(
+            Relationship.person1_id.in_(batch), Relationship.type.in_(LEGACY_SIBLING_TYPES)
+        ).all()
+
+    print(f"{'':<30}{'cũ (ms)':>10}{'mới (ms)':>10}")
+    for label, old_fn, new_fn in (
+        (f"vợ/chồng, {len(sample)} lần", legacy_spouses, link_spouses),
+        (f"anh chị em, {len(sample)} lần", legacy_siblings, link_siblings),
+        (f"vợ/chồng, 1 lô {len(batch)}", legacy_batch_spouses, lambda: linked_pairs(db, batch, LINK_SPOUSE)),
+        (f"anh chị em, 1 lô {len(batch)}", legacy_batch_siblings, lambda: linked_pairs(db, batch, LINK_SIBLING)),
+    ):
+        old_t, new_t = bench(old_fn), bench(new_fn)
+        print(f"{label:<30}{old_t * 1000:>10.1f}{new_t * 1000:>10.1f}   x{old_t / new_t:.1f}")
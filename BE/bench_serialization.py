@@ -0,0 +1,85 @@
+"""
+Micro-benchmark: so sánh đường serialize cũ (TreeNode/TreeEdge pydantic + response_model)
+với fast path (dict thuần + FastJSONResponse) cho API cây gia phả.
+
+Chạy: python bench_serialization.py
+"""
+import sys
+sys.path.append('.')
+
+import random
+import time
+from datetime import date
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from fast_json import FastJSONResponse, orjson
+from routers.members import build_tree_payload
+from schemas import TreeNode, TreeEdge, TreeResponse
+
+BASE_URL = "http://localhost:8000"
+
+
+def make_family(n):
+    """Sinh dữ liệu giả giống output của get_family_graph (node đã có avatar/ngày sinh/vợ chồng)."""
+    nodes, edges = [], []
+    for i in range(1, n + 1):
+        father_id = random.randint(1, i - 1) if i > 1 else None
+        gender = 'male' if i % 2 else 'female'
+        dob = date(1900 + i % 120, 1 + i % 12, 1 + i % 28)
+        nodes.append({"id": i, "name": f"Nguyễn Văn {i}", "gender": gender,
+                      "birth_year": dob.year, "birth_date": dob.isoformat(), "death_date": None,
+                      "avatar_url": f"/static/uploads/{i}.jpg", "role": "member",
+                      "father_id": father_id, "mother_id": None,
+                      "spouses": [i - 1] if i % 3 == 0 else []})
+        if father_id:
+            edges.append({"from_id": father_id, "to_id": i, "type": "FATHER_OF"})
+    return nodes, edges
+
+
+def pydantic_path(nodes, edges):
+    """Đường cũ: dựng model cho từng node/edge, FastAPI validate lại rồi jsonable_encoder + json.dumps."""
+    tree_nodes = []
+    for n in nodes:
+        dob = date.fromisoformat(n['birth_date']) if n['birth_date'] else None
+        tree_nodes.append(TreeNode(
+            id=n['id'], name=n['name'], gender=n['gender'] or 'male',
+            birth_year=str(dob.year) if dob else '?',
+            dob=dob.strftime("%d/%m/%Y") if dob else None,
+            avatar_url=f"{BASE_URL}{n['avatar_url']}" if n['avatar_url'] else None,
+            father_id=n['father_id'], mother_id=n['mother_id'],
+            spouses=n['spouses'],
+        ))
+    tree_edges = [TreeEdge(from_id=e['from_id'], to_id=e['to_id'], type=e['type']) for e in edges]
+    resp = TreeResponse(nodes=tree_nodes, edges=tree_edges)
+    # Mô phỏng serialize_response của FastAPI: validate theo response_model rồi encode
+    validated = TreeResponse.model_validate(resp.model_dump())
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def fast_path(nodes, edges):
+    payload = build_tree_payload(nodes, edges, BASE_URL)
+    return FastJSONResponse(payload).body
+
+
+def bench(fn, args, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    print(f"Encoder: {'orjson' if orjson else 'json (orjson chưa cài)'}")
+    for n in (1_000, 10_000):
+        args = make_family(n)
+        repeat = 10 if n <= 1_000 else 3
+        t_old = bench(pydantic_path, args, repeat)
+        t_new = bench(fast_path, args, repeat)
+        size = len(fast_path(*args))
+        print(f"{n:>6} nodes | pydantic: {t_old * 1000:8.1f} ms | fast: {t_new * 1000:8.1f} ms "
+              f"| x{t_old / t_new:5.1f} | payload {size / 1024:.0f} KiB")
@@ -0,0 +1,100 @@
+"""
+Micro-benchmark: chi phí middleware session trên mỗi request.
+
+So sánh:
+  - không middleware (nền)
+  - middleware cũ (BaseHTTPMiddleware, verify + ký lại + Set-Cookie ở MỌI request có cookie)
+  - SessionRenewalMiddleware mới với token còn trẻ (thường gặp) và token đã quá SESSION_RENEW_AFTER
+
+Gọi thẳng app ASGI (không qua HTTP/TestClient) để chỉ đo phần middleware + routing.
+
+Chạy: python bench_session_middleware.py [số request]
+"""
+import sys
+sys.path.append('.')
+
+import asyncio
+import time
+
+from fastapi import FastAPI, Request
+from itsdangerous import URLSafeTimedSerializer, TimestampSigner, BadSignature, SignatureExpired
+
+from routers.auth import (
+    SECRET_KEY, SESSION_EXPIRE_SECONDS, SESSION_RENEW_AFTER, SessionRenewalMiddleware, serializer,
+)
+
+
+class AgedSigner(TimestampSigner):
+    # Ký như token đã phát hành từ SESSION_RENEW_AFTER + 60 giây trước
+    def get_timestamp(self):
+        return int(time.time()) - SESSION_RENEW_AFTER - 60
+
+
+def make_app(mode):
+    app = FastAPI()
+
+    @app.get("/ping")
+    def ping():
+        return {"ok": True}
+
+    if mode == "old":
+        @app.middleware("http")
+        async def refresh_session_if_valid(request: Request, call_next):
+            response = await call_next(request)
+            token = request.cookies.get("user_session")
+            if token:
+                try:
+                    data = serializer.loads(token, max_age=SESSION_EXPIRE_SECONDS)
+                    new_token = serializer.dumps({"user_id": data["user_id"], "role": data["role"]})
+                    response.set_cookie(key="user_session", value=new_token, httponly=True,
+                                        max_age=SESSION_EXPIRE_SECONDS, samesite="lax", secure=False, path="/")
+                except (BadSignature, SignatureExpired):
+                    pass
+            return response
+    elif mode == "new":
+        app.add_middleware(SessionRenewalMiddleware)
+    return app
+
+
+async def run(app, token, n):
+    headers = [(b"host", b"bench"), (b"cookie", f"theme=dark; user_session={token}".encode())]
+    set_cookies = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal set_cookies
+        if message["type"] == "http.response.start":
+            set_cookies += sum(1 for k, _ in message["headers"] if k == b"set-cookie")
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": "/ping", "raw_path": b"/ping", "root_path": "", "query_string": b"",
+             "headers": headers, "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+    for _ in range(200):  # warmup
+        await app(dict(scope), receive, send)
+    set_cookies = 0
+    start = time.perf_counter()
+    for _ in range(n):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / n, set_cookies
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    fresh = serializer.dumps({"user_id": 1, "role": "admin"})
+    aged = URLSafeTimedSerializer(SECRET_KEY, signer=AgedSigner).dumps({"user_id": 1, "role": "admin"})
+
+    cases = (
+        ("không middleware", "none", fresh),
+        ("cũ, token mới", "old", fresh),
+        ("mới, token mới", "new", fresh),
+        ("mới, token quá nửa đời", "new", aged),
+    )
+    baseline = None
+    print(f"{n} request / trường hợp")
+    print(f"{'':<26}{'µs/req':>10}{'overhead':>10}{'Set-Cookie':>12}")
+    for label, mode, token in cases:
+        per_req, cookies = asyncio.run(run(make_app(mode), token, n))
+        baseline = per_req if baseline is None else baseline
+        print(f"{label:<26}{per_req * 1e6:>10.1f}{(per_req - baseline) * 1e6:>10.1f}{cookies:>12}")
@@ -0,0 +1,137 @@
+"""
+Chỉ mục tìm kiếm tin nhắn chat (không dấu, theo từ), cùng cách làm với search_index.py.
+
+Mỗi tin nhắn được bỏ dấu + tách token (search_index.tokenize), mỗi token khác nhau 1 dòng trong
+message_search_tokens kèm family_id, created_at. Index (family_id, token, created_at, message_id)
+đã xếp sẵn theo thời gian nên 1 truy vấn "tết ông bà" chỉ đọc ngược khoảng ("tet") của family
+tới khi đủ `limit` kết quả, các từ còn lại kiểm tra qua khóa chính (message_id, token):
+không quét messages, không sort, không phụ thuộc số tin của cả gia phả.
+
+Khớp theo NGUYÊN TỪ (không theo tiền tố như tìm thành viên): khoảng tiền tố của 1 từ ngắn
+không còn theo thứ tự thời gian, phải gom + sort toàn bộ tin khớp mới phân trang được.
+Kết quả xếp mới nhất trước (không theo độ liên quan) để phân trang theo mốc (before_id).
+
+index_messages() được gọi trong cùng transaction ghi tin (chat_writer.insert_messages).
+"""
+import re
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session, aliased
+
+from models import Message, MessageSearchToken
+from search_index import fold, tokenize, MAX_TOKEN_LENGTH, MAX_QUERY_TERMS
+
+MAX_MESSAGE_TOKENS = 500   # Tin quá dài: chỉ index 500 từ khác nhau đầu tiên
+REBUILD_BATCH_SIZE = 5000
+SNIPPET_CHARS = 160
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def message_tokens(content: Optional[str]) -> List[str]:
+    return list(dict.fromkeys(tokenize(content)))[:MAX_MESSAGE_TOKENS]
+
+
+def index_messages(db: Session, messages: Iterable[dict]):
+    """Thêm token cho các tin vừa ghi (dict có id, family_id, content, created_at; đã flush, chưa commit)."""
+    rows = [
+        {"message_id": m["id"], "token": token, "family_id": m["family_id"], "created_at": m["created_at"]}
+        for m in messages
+        if (m.get("message_type") or "text") == "text"
+        for token in message_tokens(m["content"])
+    ]
+    if rows:
+        db.bulk_insert_mappings(MessageSearchToken, rows)
+
+
+def rebuild_chat_search_index(db: Session, family_id: Optional[int] = None) -> int:
+    """Dựng lại chỉ mục (cả hệ thống hoặc 1 family) theo từng lô, có commit. Trả về số tin đã index."""
+    columns = (Message.id, Message.family_id, Message.content, Message.created_at, Message.message_type)
+    count, last_id = 0, 0
+    while True:
+        query = db.query(*columns).filter(Message.id > last_id)
+        if family_id is not None:
+            query = query.filter(Message.family_id == family_id)
+        batch = [row._asdict() for row in query.order_by(Message.id).limit(REBUILD_BATCH_SIZE).all()]
+        if not batch:
+            break
+        db.query(MessageSearchToken).filter(
+            MessageSearchToken.message_id.in_([m["id"] for m in batch])
+        ).delete(synchronize_session=False)
+        index_messages(db, batch)
+        db.commit()
+        count += len(batch)
+        last_id = batch[-1]["id"]
+    return count
+
+
+def query_terms(query: str) -> List[str]:
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+def search_statement(family_id: int, terms: List[str], limit: int,
+                     date_from: Optional[date] = None, date_to: Optional[date] = None, before=None):
+    """
+    id các tin chứa đủ mọi từ, mới nhất trước. before = (created_at, id) của tin cuối trang trước.
+    date_from / date_to tính cả ngày (theo giờ lưu trong DB).
+    """
+    # Từ dài nhất thường hiếm nhất -> quét khoảng của nó, các từ khác join theo khóa chính
+    ordered = sorted(terms, key=len, reverse=True)
+    first = aliased(MessageSearchToken)
+    statement = select(first.message_id).where(first.family_id == family_id, first.token == ordered[0])
+    for term in ordered[1:]:
+        other = aliased(MessageSearchToken)
+        statement = statement.join(other, and_(other.message_id == first.message_id, other.token == term))
+    if date_from is not None:
+        statement = statement.where(first.created_at >= datetime.combine(date_from, time.min))
+    if date_to is not None:
+        statement = statement.where(first.created_at < datetime.combine(date_to + timedelta(days=1), time.min))
+    if before is not None:
+        created_at, message_id = before
+        statement = statement.where(or_(
+            first.created_at < created_at,
+            and_(first.created_at == created_at, first.message_id < message_id),
+        ))
+    return statement.order_by(first.created_at.desc(), first.message_id.desc()).limit(limit)
+
+
+def _fold_with_positions(text: str) -> Tuple[str, List[int]]:
+    """fold() từng ký tự, kèm vị trí ký tự gốc của mỗi ký tự đã fold (để tô sáng trên nội dung có dấu)."""
+    folded, positions = [], []
+    for i, ch in enumerate(text):
+        for f in fold(ch):
+            folded.append(f)
+            positions.append(i)
+    return "".join(folded), positions
+
+
+def highlight(content: str, terms: Iterable[str], width: int = SNIPPET_CHARS) -> Dict:
+    """
+    Đoạn trích quanh từ khớp đầu tiên + vị trí các từ khớp trong đoạn đó:
+    {"snippet": "...chúc Tết ông bà...", "highlights": [[start, end], ...]} (end không tính).
+    """
+    terms = set(terms)
+    folded, positions = _fold_with_positions(content)
+    spans = [
+        (positions[m.start()], positions[m.end() - 1] + 1)
+        for m in _TOKEN_RE.finditer(folded)
+        if m.group()[:MAX_TOKEN_LENGTH] in terms
+    ]
+    if len(content) <= width:
+        return {"snippet": content, "highlights": [list(span) for span in spans]}
+
+    # Cắt cửa sổ `width` ký tự, từ khớp đầu tiên nằm ở khoảng 1/3 đầu, lùi về đầu từ
+    center = spans[0][0] if spans else 0
+    start = max(0, min(center - width // 3, len(content) - width))
+    while start > 0 and not content[start - 1].isspace() and center - start < width // 2:
+        start -= 1
+    end = min(len(content), start + width)
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(content) else ""
+    offset = len(prefix) - start
+    return {
+        "snippet": prefix + content[start:end] + suffix,
+        "highlights": [[s + offset, e + offset] for s, e in spans if s >= start and e <= end],
+    }
@@ -0,0 +1,114 @@
+"""
+Ghi tin nhắn chat theo lô (group commit), không chặn event loop.
+
+websocket_endpoint trước đây db.add/commit/refresh ngay trong vòng nhận tin (async) -> mỗi tin chặn
+event loop của cả worker suốt 1 round trip + commit MySQL. Ở đây vòng nhận chỉ gọi submit() (không chờ);
+1 task gom các tin đến trong CHAT_BATCH_DELAY giây (tối đa CHAT_BATCH_SIZE tin) rồi ghi cả lô trong
+1 transaction trên luồng riêng, mỗi lô 1 session ngắn. Future của từng tin trả về dict tin đã có id.
+
+Chỉ 1 luồng ghi nên các lô commit đúng thứ tự nhận. Lô lỗi (VD 1 tin hỏng) được ghi lại từng tin
+nên chỉ tin hỏng bị từ chối, các tin hợp lệ cùng lô vẫn được lưu.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional
+
+from db.mysql_connection import SessionLocal
+from models import Message
+from chat_search import index_messages
+from read_state import count_new_messages
+
+CHAT_BATCH_SIZE = 200
+CHAT_BATCH_DELAY = 0.005  # giây
+
+
+def insert_messages(rows: List[dict]) -> List[dict]:
+    """Ghi 1 lô tin nhắn trong 1 transaction, trả về các dict kèm id."""
+    db = SessionLocal()
+    try:
+        messages = [Message(**row) for row in rows]
+        db.add_all(messages)
+        db.flush()
+        saved = [dict(row, id=msg.id) for row, msg in zip(rows, messages)]
+        index_messages(db, saved)  # chỉ mục tìm kiếm chat, cùng transaction với lô tin
+        count_new_messages(db, saved)  # cộng số tin chưa đọc của các thành viên
+        db.commit()
+        return saved
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class MessageWriter:
+    def __init__(self, batch_size: int = CHAT_BATCH_SIZE, delay: float = CHAT_BATCH_DELAY):
+        self.batch_size = batch_size
+        self.delay = delay
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-writer")
+        self.batches = 0
+        self.written = 0
+        self.retried = 0  # số lô lỗi phải ghi lại từng tin
+
+    def submit(self, family_id: int, sender_id: int, content: str, message_type: str = "text") -> asyncio.Future:
+        """Xếp tin vào lô kế tiếp; await future để lấy tin đã lưu (có id)."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        row = {
+            "family_id": family_id,
+            "sender_id": sender_id,
+            "content": content,
+            "message_type": message_type,
+            "created_at": datetime.utcnow(),  # thời điểm nhận, không phải lúc lô được ghi
+        }
+        self.queue.put_nowait((row, future))
+        return future
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            # Chờ thêm 1 chút để gom các tin đến cùng lúc vào 1 commit
+            await asyncio.sleep(self.delay)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _write(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            saved = await loop.run_in_executor(self.executor, insert_messages, [row for row, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Chat writer error: {e}")
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # 1 tin hỏng làm rollback cả lô (của mọi family): ghi lại từng tin, chỉ tin hỏng bị lỗi
+            print(f"Chat writer error ({len(batch)} messages), retrying one by one: {e}")
+            self.retried += 1
+            for item in batch:
+                await self._write([item])
+            return
+        self.batches += 1
+        self.written += len(saved)
+        for (_, future), row in zip(batch, saved):
+            if not future.done():
+                future.set_result(row)
+
+    async def close(self):
+        """Ghi nốt các tin còn trong hàng đợi (gọi khi tắt server)."""
+        if self.task is not None and not self.task.done():
+            await self.queue.join()
+            self.task.cancel()
+        self.executor.shutdown(wait=True)
+
+
+chat_writer = MessageWriter()
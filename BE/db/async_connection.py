@@ -0,0 +1,46 @@
+"""
+Kết nối MySQL bất đồng bộ (SQLAlchemy AsyncSession) cho các endpoint async.
+
+Chỉ import khi bật ASYNC_DB (xem db/mysql_connection.py): cần greenlet và driver async
+(aiomysql cho MySQL, aiosqlite cho SQLite). URL lấy từ MYSQL_ASYNC_URL, không có thì đổi driver
+của MYSQL_URL (mysql+pymysql:// -> mysql+aiomysql://).
+
+Các helper sync sẵn có (verify_family_access, get_changes_since, load_user...) chạy trên cùng
+kết nối qua `await db.run_sync(fn, *args)` thay vì viết lại bản async.
+"""
+import os
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from db.mysql_connection import SQLALCHEMY_DATABASE_URL
+
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+ASYNC_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "20"))
+ASYNC_MAX_OVERFLOW = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", "20"))
+
+
+def async_database_url(url: str) -> str:
+    if os.getenv("MYSQL_ASYNC_URL"):
+        return os.getenv("MYSQL_ASYNC_URL")
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+ASYNC_DATABASE_URL = async_database_url(SQLALCHEMY_DATABASE_URL)
+
+engine_options = {"pool_pre_ping": True, "pool_recycle": 3600}
+if ASYNC_DATABASE_URL.startswith("mysql"):
+    # Không còn bị giới hạn bởi threadpool -> pool kết nối là giới hạn đồng thời thực sự
+    engine_options.update(pool_size=ASYNC_POOL_SIZE, max_overflow=ASYNC_MAX_OVERFLOW)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
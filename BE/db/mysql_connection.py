@@ -20,3 +20,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# ASYNC_DB=1: các endpoint nóng chạy bản async (routers/async_api.py, db/async_connection.py)
+# trên AsyncSession + driver Neo4j async. Mặc định tắt: cần cài thêm greenlet + aiomysql.
+USE_ASYNC_DB = os.getenv("ASYNC_DB", "0") == "1"
@@ -1,4 +1,4 @@
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, AsyncGraphDatabase
 from dotenv import load_dotenv
 import os
 
@@ -32,15 +32,70 @@ class Neo4jConnection:
         with self.driver.session() as session:
             session.run(query, parameters or {})
 
+    def execute_batch(self, statements):
+        """Chạy nhiều query ghi [(query, params), ...] trong 1 transaction (lỗi thì không ghi gì)."""
+        with self.driver.session() as session:
+            with session.begin_transaction() as tx:
+                for query, parameters in statements:
+                    tx.run(query, parameters or {})
+                tx.commit()
+
 # --- Các hàm tiện ích đặc thù cho gia phả ---
 neo4j_conn = Neo4jConnection()
 
-def add_person_to_graph(id, full_name, gender, family_id, father_id=None, mother_id=None):
-    """Thêm hoặc cập nhật một node Person vào Neo4j."""
-    neo4j_conn.execute("""
-        MERGE (p:Person {id: $id})
-        SET p.name = $full_name, p.gender = $gender, p.family_id = $family_id
-    """, {"id": id, "full_name": full_name, "gender": gender, "family_id": family_id})
+def _iso_date(value):
+    """date/datetime/'YYYY-MM-DD' -> 'YYYY-MM-DD' (Neo4j lưu dạng chuỗi)."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        return value[:10]
+    return value.strftime("%Y-%m-%d")
+
+
+PERSON_NODE_QUERY = """
+    MERGE (p:Person {id: $id})
+    SET p.name = $full_name, p.gender = $gender, p.family_id = $family_id,
+        p.birth_date = $birth_date, p.birth_year = $birth_year,
+        p.death_date = $death_date, p.avatar_url = $avatar_url, p.role = $role
+"""
+
+
+def _person_node_params(id, full_name, gender, family_id, date_of_birth=None, date_of_death=None,
+                        avatar_url=None, role=None):
+    birth_date = _iso_date(date_of_birth)
+    return {
+        "id": id, "full_name": full_name, "gender": gender, "family_id": family_id,
+        "birth_date": birth_date,
+        "birth_year": int(birth_date[:4]) if birth_date else None,
+        "death_date": _iso_date(date_of_death),
+        "avatar_url": avatar_url,
+        "role": role or "member",
+    }
+
+
+def _person_params(person):
+    return _person_node_params(
+        id=person.id,
+        full_name=f"{person.last_name or ''} {person.first_name}".strip(),
+        gender=person.gender,
+        family_id=person.family_id,
+        date_of_birth=person.date_of_birth,
+        date_of_death=person.date_of_death,
+        avatar_url=person.avatar_url,
+        role=person.role,
+    )
+
+
+def add_person_to_graph(id, full_name, gender, family_id, father_id=None, mother_id=None,
+                        date_of_birth=None, date_of_death=None, avatar_url=None, role=None):
+    """
+    Thêm hoặc cập nhật một node Person vào Neo4j.
+    Node giữ luôn các thuộc tính hiển thị (ngày sinh/mất, năm sinh, avatar, role)
+    để API cây gia phả chỉ cần 1 query Neo4j, không phải quay lại MySQL.
+    """
+    neo4j_conn.execute(PERSON_NODE_QUERY, _person_node_params(
+        id, full_name, gender, family_id, date_of_birth, date_of_death, avatar_url, role
+    ))
 
     # Nếu có cha/mẹ ngay lúc này, tạo luôn. 
     # Nhưng trong import sẽ dùng hàm riêng để tránh lỗi node chưa tồn tại.
@@ -50,6 +105,35 @@ def add_person_to_graph(id, full_name, gender, family_id, father_id=None, mother
     if mother_id:
         create_relationship_in_graph(mother_id, id, "MOTHER_OF")
 
+def sync_person_node(person, with_parents=False):
+    """Đồng bộ node từ một Person (ORM object) - dùng chung cho mọi đường ghi."""
+    full_name = f"{person.last_name or ''} {person.first_name}".strip()
+    add_person_to_graph(
+        id=person.id,
+        full_name=full_name,
+        gender=person.gender,
+        family_id=person.family_id,
+        father_id=person.father_id if with_parents else None,
+        mother_id=person.mother_id if with_parents else None,
+        date_of_birth=person.date_of_birth,
+        date_of_death=person.date_of_death,
+        avatar_url=person.avatar_url,
+        role=person.role,
+    )
+
+
+def set_parents_in_graph(child_id, father_id=None, mother_id=None):
+    """Thay toàn bộ cạnh FATHER_OF/MOTHER_OF đi vào child theo father_id/mother_id hiện tại."""
+    neo4j_conn.execute("""
+        MATCH (:Person)-[r:FATHER_OF|MOTHER_OF]->(c:Person {id: $child_id})
+        DELETE r
+    """, {"child_id": child_id})
+    if father_id:
+        create_relationship_in_graph(father_id, child_id, "FATHER_OF")
+    if mother_id:
+        create_relationship_in_graph(mother_id, child_id, "MOTHER_OF")
+
+
 def create_relationship_in_graph(parent_id, child_id, type="PARENT_OF"):
     """
     Tạo quan hệ giữa Cha/Mẹ và Con. 
@@ -62,6 +146,82 @@ def create_relationship_in_graph(parent_id, child_id, type="PARENT_OF"):
         MERGE (parent)-[:{type}]->(child)
     """, {"parent_id": parent_id, "child_id": child_id})
 
+# Các loại cạnh giữa 2 Person trong graph
+GRAPH_REL_TYPES = ("FATHER_OF", "MOTHER_OF", "SPOUSE", "SIBLING", "PARENT_OF")
+
+
+def _merge_person_statements(keep, duplicate_id):
+    """Các query chuyển mọi cạnh của duplicate sang keep, xóa duplicate, đặt lại thuộc tính + cạnh cha/mẹ của keep."""
+    params = {"keep": keep.id, "dup": duplicate_id}
+    statements = [(PERSON_NODE_QUERY, _person_params(keep))]
+    for rel in GRAPH_REL_TYPES:
+        statements.append((f"""
+            MATCH (d:Person {{id: $dup}})-[:{rel}]->(x:Person), (k:Person {{id: $keep}})
+            WHERE x.id <> $keep
+            MERGE (k)-[:{rel}]->(x)
+        """, params))
+        if rel in ("FATHER_OF", "MOTHER_OF"):
+            continue # Cha/mẹ của keep lấy theo MySQL ở dưới
+        statements.append((f"""
+            MATCH (x:Person)-[:{rel}]->(d:Person {{id: $dup}}), (k:Person {{id: $keep}})
+            WHERE x.id <> $keep
+            MERGE (x)-[:{rel}]->(k)
+        """, params))
+    statements.append(("MATCH (d:Person {id: $dup}) DETACH DELETE d", params))
+    statements.extend(_set_parents_statements(keep.id, keep.father_id, keep.mother_id))
+    return statements
+
+
+def _set_parents_statements(child_id, father_id, mother_id):
+    statements = [("""
+        MATCH (:Person)-[r:FATHER_OF|MOTHER_OF]->(c:Person {id: $child_id})
+        DELETE r
+    """, {"child_id": child_id})]
+    for parent_id, rel in ((father_id, "FATHER_OF"), (mother_id, "MOTHER_OF")):
+        if parent_id:
+            statements.append((f"""
+                MERGE (parent:Person {{id: $parent_id}})
+                WITH parent
+                MATCH (c:Person {{id: $child_id}})
+                MERGE (parent)-[:{rel}]->(c)
+            """, {"parent_id": parent_id, "child_id": child_id}))
+    return statements
+
+
+def merge_persons_in_graph(keep, duplicate_id):
+    """Gộp node duplicate_id vào keep (Person ORM đã merge ở MySQL) trong 1 transaction Neo4j."""
+    neo4j_conn.execute_batch(_merge_person_statements(keep, duplicate_id))
+
+
+GRAPH_BATCH_SIZE = 5000
+
+
+def graft_in_graph(family_id, moved_ids, merged=(), attached=None, demoted_ids=()):
+    """
+    Áp dụng thao tác ghép nhánh/gộp gia phả lên Neo4j trong 1 transaction:
+    merged: [(keep Person, duplicate_id)], moved_ids đổi family_id (UNWIND theo lô),
+    attached: Person gốc nhánh được gắn cha/mẹ mới, demoted_ids: admin cũ -> editor.
+    """
+    statements = []
+    for keep, duplicate_id in merged:
+        statements.extend(_merge_person_statements(keep, duplicate_id))
+    for start in range(0, len(moved_ids), GRAPH_BATCH_SIZE):
+        statements.append(("""
+            UNWIND $ids AS pid
+            MATCH (p:Person {id: pid})
+            SET p.family_id = $family_id
+        """, {"ids": list(moved_ids[start:start + GRAPH_BATCH_SIZE]), "family_id": family_id}))
+    if demoted_ids:
+        statements.append(("""
+            UNWIND $ids AS pid
+            MATCH (p:Person {id: pid})
+            SET p.role = 'editor'
+        """, {"ids": list(demoted_ids)}))
+    if attached is not None:
+        statements.extend(_set_parents_statements(attached.id, attached.father_id, attached.mother_id))
+    neo4j_conn.execute_batch(statements)
+
+
 def delete_person_from_graph(id):
     """Xóa node Person và các quan hệ liên quan khỏi Neo4j."""
     neo4j_conn.execute("""
@@ -69,68 +229,92 @@ def delete_person_from_graph(id):
         DETACH DELETE p
     """, {"id": id})
 
+SHORTEST_PATH_QUERY = """
+    MATCH (start:Person {id: $from_id}), (end:Person {id: $to_id})
+    MATCH p = shortestPath((start)-[:FATHER_OF|MOTHER_OF|SPOUSE*]-(end))
+    RETURN [n in nodes(p) | {id: n.id, name: n.name, gender: n.gender}] as nodes,
+           [r in relationships(p) | {start: startNode(r).id, end: endNode(r).id, type: type(r)}] as rels
+"""
+
+FAMILY_GRAPH_QUERY = """
+    MATCH (n:Person {family_id: $family_id})
+    OPTIONAL MATCH (father:Person)-[:FATHER_OF]->(n)
+    OPTIONAL MATCH (mother:Person)-[:MOTHER_OF]->(n)
+    RETURN n.id AS id, n.name AS name, n.gender AS gender,
+           n.birth_year AS birth_year, n.birth_date AS birth_date, n.death_date AS death_date,
+           n.avatar_url AS avatar_url, n.role AS role,
+           head(collect(DISTINCT father.id)) AS father_id,
+           head(collect(DISTINCT mother.id)) AS mother_id,
+           head(collect([(n)-[:SPOUSE]-(s:Person) | s.id])) AS spouses
+"""
+
+
 def find_shortest_path(from_id, to_id):
-    """Tìm đường đi ngắn nhất giữa 2 người, ưu tiên quan hệ cha/mẹ hơn vợ/chồng."""
-    # Try to find path using FATHER_OF/MOTHER_OF only first
-    query_direct = """
-        MATCH (start:Person {id: $from_id}), (end:Person {id: $to_id})
-        MATCH p = shortestPath((start)-[:FATHER_OF|MOTHER_OF|SPOUSE*]-(end))
-        RETURN [n in nodes(p) | {id: n.id, name: n.name, gender: n.gender}] as nodes,
-               [r in relationships(p) | {start: startNode(r).id, end: endNode(r).id, type: type(r)}] as rels
-    """
-    result = neo4j_conn.query(query_direct, {"from_id": from_id, "to_id": to_id})
-    
-    # If found direct path, return it
-    if result:
-        return result[0]
-    
-    # Otherwise, try including SPOUSE relationships
-    query_with_spouse = """
-        MATCH (start:Person {id: $from_id}), (end:Person {id: $to_id})
-        MATCH p = shortestPath((start)-[:FATHER_OF|MOTHER_OF|SPOUSE*]-(end))
-        RETURN [n in nodes(p) | {id: n.id, name: n.name, gender: n.gender}] as nodes,
-               [r in relationships(p) | {start: startNode(r).id, end: endNode(r).id, type: type(r)}] as rels
-    """
-    result = neo4j_conn.query(query_with_spouse, {"from_id": from_id, "to_id": to_id})
-    
+    """Tìm đường đi ngắn nhất giữa 2 người qua cha/mẹ/vợ chồng."""
+    # Trước đây chạy 2 lần cùng 1 query khi không tìm thấy -> chỉ chạy 1 lần
+    result = neo4j_conn.query(SHORTEST_PATH_QUERY, {"from_id": from_id, "to_id": to_id})
     if not result:
         return None
-        
     return result[0] # {'nodes': [...], 'rels': []}
 
 
+def _family_graph_payload(nodes):
+    edges = []
+    for n in nodes:
+        # Cạnh SPOUSE được tạo 2 chiều -> loại trùng, giữ thứ tự
+        n['spouses'] = list(dict.fromkeys(n.get('spouses') or []))
+        if n.get('father_id'):
+            edges.append({"from_id": n['father_id'], "to_id": n['id'], "type": "FATHER_OF"})
+        if n.get('mother_id'):
+            edges.append({"from_id": n['mother_id'], "to_id": n['id'], "type": "MOTHER_OF"})
+
+    return {"nodes": nodes, "edges": edges}
+
+
 def get_family_graph(family_id):
-    """Lấy toàn bộ cây gia phả của family_id từ Neo4j."""
-    query = """
-        MATCH (p:Person {family_id: $family_id})
-        OPTIONAL MATCH (p)-[r:PARENT_OF]->(child)
-        RETURN p as node, r as rel
     """
-    # Note: Query này trả về từng row (node + rel). Cần group lại ở Python.
-    # Tuy nhiên, để dễ format TreeResponse (nodes list, edges list), ta có thể collect luôn trong Cypher.
-    
-    query_collect = """
-        MATCH (n:Person {family_id: $family_id})
-        OPTIONAL MATCH (father:Person)-[:FATHER_OF]->(n)
-        OPTIONAL MATCH (mother:Person)-[:MOTHER_OF]->(n)
-        OPTIONAL MATCH (n)-[r]->(child)
-        WHERE type(r) IN ['FATHER_OF', 'MOTHER_OF']
-        RETURN collect(DISTINCT {
-                 id: n.id, 
-                 name: n.name, 
-                 gender: n.gender, 
-                 birth_year: "?",
-                 father_id: father.id,
-                 mother_id: mother.id
-               }) as nodes, 
-               collect(DISTINCT {from_id: startNode(r).id, to_id: endNode(r).id, type: type(r)}) as edges
+    Lấy toàn bộ cây gia phả của family_id từ Neo4j trong 1 query.
+    Node đã có sẵn ngày sinh, avatar, role và danh sách vợ/chồng (cạnh SPOUSE).
     """
-    result = neo4j_conn.query(query_collect, {"family_id": family_id})
-    if not result:
-        return {"nodes": [], "edges": []}
-        
-    data = result[0]
-    # Filter out null edges (from OPTIONAL MATCH where no relationship exists)
-    edges = [e for e in data['edges'] if e['from_id'] is not None]
-    
-    return {"nodes": data['nodes'], "edges": edges}
+    return _family_graph_payload(neo4j_conn.query(FAMILY_GRAPH_QUERY, {"family_id": family_id}))
+
+
+# --- Driver async (cho routers/async_api.py khi bật ASYNC_DB) ---
+
+class AsyncNeo4jConnection:
+    """Như Neo4jConnection nhưng dùng AsyncGraphDatabase; driver chỉ tạo ở lần query đầu tiên."""
+
+    def __init__(self):
+        self.driver = None
+
+    def _get_driver(self):
+        if self.driver is None:
+            self.driver = AsyncGraphDatabase.driver(
+                os.getenv("NEO4J_URI", "bolt://localhost:7687"),
+                auth=(os.getenv("NEO4J_USER", "neo4j"), os.getenv("NEO4J_PASSWORD", "password")),
+                connection_timeout=5.0,
+                max_connection_lifetime=200
+            )
+        return self.driver
+
+    async def close(self):
+        if self.driver:
+            await self.driver.close()
+            self.driver = None
+
+    async def query(self, query, parameters=None):
+        async with self._get_driver().session() as session:
+            result = await session.run(query, parameters or {})
+            return [record.data() async for record in result]
+
+
+async_neo4j_conn = AsyncNeo4jConnection()
+
+
+async def find_shortest_path_async(from_id, to_id):
+    result = await async_neo4j_conn.query(SHORTEST_PATH_QUERY, {"from_id": from_id, "to_id": to_id})
+    return result[0] if result else None
+
+
+async def get_family_graph_async(family_id):
+    return _family_graph_payload(await async_neo4j_conn.query(FAMILY_GRAPH_QUERY, {"family_id": family_id}))
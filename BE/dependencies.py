@@ -1,7 +1,7 @@
 from fastapi import Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from db.mysql_connection import get_db
-from models import User
+from user_cache import load_user
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
 # Should be in config
@@ -9,7 +9,8 @@ SECRET_KEY = "your-secret-key"
 SESSION_EXPIRE_SECONDS = 3600
 serializer = URLSafeTimedSerializer(SECRET_KEY)
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+def session_user_id(request: Request) -> int:
+    """user_id trong token (header Bearer hoặc cookie user_session); lỗi -> 401."""
     token = None
     
     # 1. Check Authorization Header (Prioritize)
@@ -26,11 +27,15 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
 
     try:
         data = serializer.loads(token, max_age=SESSION_EXPIRE_SECONDS)
-        user = db.query(User).filter(User.id == data["user_id"]).first()
-        if not user:
-            raise HTTPException(status_code=401, detail="Người dùng không tồn tại")
-        return user
+        return data["user_id"]
     except SignatureExpired:
         raise HTTPException(status_code=401, detail="Phiên đã hết hạn")
     except BadSignature:
         raise HTTPException(status_code=401, detail="Phiên không hợp lệ")
+
+def get_current_user(request: Request, db: Session = Depends(get_db)):
+    # Bản chụp user từ cache (TTL ngắn), không SELECT users mỗi request
+    user = load_user(db, session_user_id(request))
+    if not user:
+        raise HTTPException(status_code=401, detail="Người dùng không tồn tại")
+    return user
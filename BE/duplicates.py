@@ -0,0 +1,187 @@
+"""
+Phát hiện người bị nhập trùng trong 1 gia phả (gợi ý gộp).
+
+Không so sánh mọi cặp: mỗi người sinh ra vài khóa "blocking", chỉ so các cặp nằm chung 1 khối:
+- (họ, năm sinh, chữ cái đầu của tên)
+- (họ, tên) - bắt trường hợp thiếu ngày sinh
+- (cha, tên) / (mẹ, tên) - cùng cha/mẹ mà cùng tên thì rất có thể là 1 người nhập 2 lần
+Khối quá lớn (VD "nguyen" + không năm sinh) bị bỏ qua để giữ thời gian gần tuyến tính.
+
+Điểm của cặp = độ giống tên (đã bỏ dấu) + cộng/trừ theo ngày sinh, cha/mẹ trùng hay lệch.
+Tên gọi (chữ cuối) phải gần giống nhau, nếu không thì bỏ qua sớm (anh chị em cùng cha mẹ, cùng năm).
+
+merge_person_records() gộp 1 bản trùng vào bản giữ lại bằng các UPDATE theo tập (không duyệt từng con).
+"""
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+from models import Person
+from person_links import move_links
+from search_index import fold
+
+MAX_BLOCK_SIZE = 200    # Khối lớn hơn -> bỏ qua (tránh O(n^2) trong khối)
+MIN_SCORE = 0.7         # Ngưỡng để đưa vào gợi ý
+MIN_GIVEN_NAME_SIMILARITY = 0.8
+MAX_SUGGESTIONS = 500
+
+
+def _person_info(r) -> dict:
+    last = fold(r.last_name).split()
+    first = fold(r.first_name).split()
+    return {
+        "id": r.id,
+        "name": f"{r.last_name or ''} {r.first_name}".strip(),
+        "folded": " ".join(last + first),
+        "surname": last[0] if last else "",
+        "given": first[-1] if first else "",
+        "gender": r.gender,
+        "dob": r.date_of_birth,
+        "father_id": r.father_id,
+        "mother_id": r.mother_id,
+        "cccd": r.cccd,
+        "user_id": r.user_id,
+    }
+
+
+def blocking_keys(p: dict) -> List[tuple]:
+    keys = []
+    if p["dob"] and p["given"]:
+        keys.append(("year", p["surname"], p["dob"].year, p["given"][0]))
+    if p["given"]:
+        keys.append(("name", p["surname"], p["given"]))
+        if p["father_id"]:
+            keys.append(("father", p["father_id"], p["given"]))
+        if p["mother_id"]:
+            keys.append(("mother", p["mother_id"], p["given"]))
+    return keys
+
+
+def score_pair(a: dict, b: dict):
+    """Trả về (score, reasons) hoặc None nếu chắc chắn không phải cùng 1 người."""
+    if a["gender"] != b["gender"]:
+        return None
+    if a["cccd"] and b["cccd"] and a["cccd"] != b["cccd"]:
+        return None
+    if a["user_id"] and b["user_id"]:
+        return None # 2 tài khoản khác nhau
+    if a["id"] in (b["father_id"], b["mother_id"]) or b["id"] in (a["father_id"], a["mother_id"]):
+        return None
+
+    if a["given"] != b["given"] and SequenceMatcher(None, a["given"], b["given"]).ratio() < MIN_GIVEN_NAME_SIMILARITY:
+        return None
+
+    name_sim = SequenceMatcher(None, a["folded"], b["folded"]).ratio()
+    score = 0.7 * name_sim
+    reasons = [f"name {name_sim:.2f}"]
+
+    if a["dob"] and b["dob"]:
+        if a["dob"] == b["dob"]:
+            score += 0.3
+            reasons.append("same birth date")
+        elif a["dob"].year == b["dob"].year:
+            score += 0.15
+            reasons.append("same birth year")
+        elif abs(a["dob"].year - b["dob"].year) > 2:
+            score -= 0.4
+            reasons.append("different birth year")
+
+    for key, label in (("father_id", "father"), ("mother_id", "mother")):
+        if a[key] and b[key]:
+            if a[key] == b[key]:
+                score += 0.15
+                reasons.append(f"same {label}")
+            else:
+                score -= 0.4
+                reasons.append(f"different {label}")
+
+    return round(min(score, 1.0), 3), reasons
+
+
+def find_duplicates(rows, min_score: float = MIN_SCORE, max_results: int = MAX_SUGGESTIONS) -> List[dict]:
+    """rows: (id, first_name, last_name, gender, date_of_birth, father_id, mother_id, cccd, user_id)."""
+    people = [_person_info(r) for r in rows]
+    blocks: Dict[tuple, List[int]] = defaultdict(list)
+    for i, p in enumerate(people):
+        for key in blocking_keys(p):
+            blocks[key].append(i)
+
+    seen = set()
+    suggestions = []
+    for members in blocks.values():
+        if len(members) < 2 or len(members) > MAX_BLOCK_SIZE:
+            continue
+        for x in range(len(members)):
+            for y in range(x + 1, len(members)):
+                a, b = people[members[x]], people[members[y]]
+                pair = (min(a["id"], b["id"]), max(a["id"], b["id"]))
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                result = score_pair(a, b)
+                if result and result[0] >= min_score:
+                    suggestions.append({
+                        "person_a": {"id": a["id"], "name": a["name"]},
+                        "person_b": {"id": b["id"], "name": b["name"]},
+                        "score": result[0],
+                        "reasons": result[1],
+                    })
+
+    suggestions.sort(key=lambda s: (-s["score"], s["person_a"]["id"], s["person_b"]["id"]))
+    return suggestions[:max_results]
+
+
+def find_family_duplicates(db: Session, family_id: int) -> List[dict]:
+    rows = db.query(
+        Person.id, Person.first_name, Person.last_name, Person.gender, Person.date_of_birth,
+        Person.father_id, Person.mother_id, Person.cccd, Person.user_id
+    ).filter(Person.family_id == family_id).all()
+    return find_duplicates(rows)
+
+
+# Cột của bản trùng được chép sang bản giữ lại nếu bản giữ lại đang trống
+MERGE_FILL_COLUMNS = ("last_name", "date_of_birth", "date_of_death", "place_of_birth", "avatar_url", "biography")
+ROLE_RANK = {"member": 0, "editor": 1, "admin": 2}
+
+
+def merge_person_records(db: Session, keep: Person, duplicate: Person) -> List[tuple]:
+    """
+    Gộp duplicate vào keep trong MySQL (chưa commit, chưa xóa duplicate):
+    bổ sung thông tin còn thiếu, chuyển cha/mẹ, CCCD, tài khoản (user_id), con và liên kết vợ/chồng, anh chị em.
+    Trả về [(child_id, father_id_cũ, mother_id_cũ)] của các con đã được chuyển sang keep.
+    """
+    for col in MERGE_FILL_COLUMNS:
+        if not getattr(keep, col) and getattr(duplicate, col):
+            setattr(keep, col, getattr(duplicate, col))
+    if not keep.father_id and duplicate.father_id:
+        keep.father_id = duplicate.father_id
+    if not keep.mother_id and duplicate.mother_id:
+        keep.mother_id = duplicate.mother_id
+
+    # CCCD / tài khoản là unique -> gỡ khỏi duplicate trước
+    cccd, user_id = duplicate.cccd, duplicate.user_id
+    if (cccd and not keep.cccd) or (user_id and not keep.user_id):
+        duplicate.cccd = None
+        duplicate.user_id = None
+        db.flush()
+        if cccd and not keep.cccd:
+            keep.cccd = cccd
+        if user_id and not keep.user_id:
+            keep.user_id = user_id
+    if ROLE_RANK.get(duplicate.role, 0) > ROLE_RANK.get(keep.role, 0):
+        keep.role = duplicate.role
+
+    # Con của duplicate -> con của keep
+    children = db.query(Person.id, Person.father_id, Person.mother_id).filter(
+        (Person.father_id == duplicate.id) | (Person.mother_id == duplicate.id)
+    ).all()
+    db.query(Person).filter(Person.father_id == duplicate.id).update({Person.father_id: keep.id}, synchronize_session=False)
+    db.query(Person).filter(Person.mother_id == duplicate.id).update({Person.mother_id: keep.id}, synchronize_session=False)
+
+    # Vợ/chồng, anh chị em: chuyển liên kết sang keep (bỏ liên kết tự trỏ / đã có)
+    move_links(db, duplicate.id, keep.id)
+
+    db.flush()
+    return [(r.id, r.father_id, r.mother_id) for r in children]
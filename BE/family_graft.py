@@ -0,0 +1,173 @@
+"""
+Ghép 1 nhánh của gia phả nguồn sang gia phả đích, hoặc gộp toàn bộ 2 gia phả (họ thông gia).
+
+- Nhánh = người gốc + hậu duệ (lấy từ closure table) + vợ/chồng không có cha mẹ của họ.
+  Không chọn gốc = chuyển toàn bộ gia phả nguồn.
+- id_map {id_nguồn: id_đích}: người đã có sẵn ở cả 2 gia phả được gộp vào bản ở gia phả đích
+  (con, quan hệ, tài khoản chuyển sang bản đích) thay vì chuyển sang thành bản sao.
+- Gốc nhánh bị cắt khỏi cha/mẹ ở lại gia phả nguồn; attach_to_id gắn gốc vào 1 người ở gia phả đích.
+- family_id, role, token tìm kiếm được cập nhật bằng UPDATE theo lô id (không load ORM từng người),
+  sau đó chỉ mục đời + closure của cả 2 gia phả được dựng lại 1 lượt.
+"""
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import Person, PersonLineage, PersonSearchToken
+from person_links import LINK_SPOUSE, linked_pairs
+from lineage import rebuild_family_lineage, delete_person_closure, creates_cycle, find_parent_cycles
+from search_index import index_persons, remove_from_index
+from duplicates import merge_person_records
+from relationship_sync import sync_person_relationships
+from membership import recount_members
+from tree_delta import TreeChangeSet, save_changes
+
+GRAFT_BATCH_SIZE = 5000
+
+
+def _chunks(ids: List[int], size: int = GRAFT_BATCH_SIZE):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def collect_branch(db: Session, family_id: int, root_id: Optional[int]) -> List[int]:
+    """Id các người sẽ chuyển đi (toàn bộ family nếu root_id None)."""
+    if root_id is None:
+        return [pid for (pid,) in db.query(Person.id).filter(Person.family_id == family_id).all()]
+
+    branch = {root_id}
+    branch.update(
+        pid for (pid,) in db.query(PersonLineage.descendant_id)
+        .join(Person, Person.id == PersonLineage.descendant_id)
+        .filter(PersonLineage.ancestor_id == root_id, Person.family_id == family_id).all()
+    )
+    # Dâu/rể (không có cha mẹ) đi theo nhánh
+    ids = list(branch)
+    for chunk in _chunks(ids):
+        spouse_ids = list({other for _, other in linked_pairs(db, chunk, LINK_SPOUSE)} - branch)
+        for spouse_chunk in _chunks(spouse_ids):
+            branch.update(
+                pid for (pid,) in db.query(Person.id).filter(
+                    Person.id.in_(spouse_chunk),
+                    Person.family_id == family_id,
+                    Person.father_id.is_(None),
+                    Person.mother_id.is_(None),
+                ).all()
+            )
+    return list(branch)
+
+
+def graft_family(db: Session, source_family_id: int, target_family_id: int, root_id: Optional[int] = None,
+                 attach_to_id: Optional[int] = None, id_map: Optional[Dict[int, int]] = None) -> dict:
+    """
+    Chuyển nhánh/gia phả nguồn sang gia phả đích (chưa commit). Dữ liệu không hợp lệ -> ValueError.
+    Trả về thông tin để router đồng bộ Neo4j và đẩy delta.
+    """
+    if source_family_id == target_family_id:
+        raise ValueError("Gia phả nguồn và đích trùng nhau")
+    if root_id is not None:
+        root = db.query(Person).filter(Person.id == root_id, Person.family_id == source_family_id).first()
+        if not root:
+            raise ValueError("Người gốc của nhánh không thuộc gia phả nguồn")
+
+    moved = collect_branch(db, source_family_id, root_id)
+    id_map = id_map or {}
+    # Chỉ gộp người thuộc nhánh được chuyển, người ở lại gia phả nguồn không được đụng tới
+    outside = sorted(set(id_map) - set(moved))
+    if outside:
+        raise ValueError(f"Người {outside[0]} không thuộc nhánh được chuyển")
+
+    # --- 1. Gộp các người có sẵn ở cả 2 gia phả ---
+    merged = []
+    for source_id, target_id in id_map.items():
+        keep = db.query(Person).filter(Person.id == target_id, Person.family_id == target_family_id).first()
+        duplicate = db.query(Person).filter(Person.id == source_id, Person.family_id == source_family_id).first()
+        if not keep:
+            raise ValueError(f"Người {target_id} không thuộc gia phả đích")
+        if not duplicate:
+            raise ValueError(f"Người {source_id} không thuộc gia phả nguồn")
+        if keep.gender != duplicate.gender:
+            raise ValueError(f"Người {source_id} và {target_id} khác giới tính")
+        merge_person_records(db, keep, duplicate)
+        delete_person_closure(db, source_id)
+        remove_from_index(db, source_id)
+        db.delete(duplicate)
+        merged.append((keep, source_id))
+    db.flush()
+
+    moved = [pid for pid in moved if pid not in id_map]
+    moved_set = set(moved)
+
+    # --- 2. Chuyển family_id theo lô (set-based) ---
+    demoted = []
+    for chunk in _chunks(moved):
+        # Mỗi gia phả chỉ có 1 admin -> admin cũ của nhánh thành editor
+        demoted.extend(
+            pid for (pid,) in db.query(Person.id).filter(Person.id.in_(chunk), Person.role == 'admin').all()
+        )
+        db.query(Person).filter(Person.id.in_(chunk), Person.role == 'admin').update(
+            {Person.role: 'editor'}, synchronize_session=False
+        )
+        db.query(Person).filter(Person.id.in_(chunk)).update(
+            {Person.family_id: target_family_id}, synchronize_session=False
+        )
+        db.query(PersonSearchToken).filter(PersonSearchToken.person_id.in_(chunk)).update(
+            {PersonSearchToken.family_id: target_family_id}, synchronize_session=False
+        )
+    db.expire_all()
+
+    # --- 3. Cắt gốc nhánh khỏi cha/mẹ ở lại nguồn, gắn vào người ở gia phả đích ---
+    attached = None
+    if root_id is not None and root_id in moved_set:
+        root = db.get(Person, root_id)
+        staying = {
+            pid for (pid,) in db.query(Person.id).filter(
+                Person.id.in_([x for x in (root.father_id, root.mother_id) if x]),
+                Person.family_id != target_family_id
+            ).all()
+        }
+        if root.father_id in staying:
+            root.father_id = None
+        if root.mother_id in staying:
+            root.mother_id = None
+        if attach_to_id:
+            parent = db.query(Person).filter(Person.id == attach_to_id, Person.family_id == target_family_id).first()
+            if not parent:
+                raise ValueError("Người được gắn vào không thuộc gia phả đích")
+            if creates_cycle(db, root_id, parent.id):
+                raise ValueError("Gắn nhánh vào người này sẽ tạo vòng lặp cha/con")
+            if parent.gender == 'female':
+                root.mother_id = parent.id
+            else:
+                root.father_id = parent.id
+        attached = root
+        db.flush()
+        sync_person_relationships(db, [root_id]) # anh chị em theo cha/mẹ mới
+
+    cycles = find_parent_cycles(
+        db.query(Person.id, Person.father_id, Person.mother_id).filter(Person.family_id == target_family_id).all()
+    )
+    if cycles:
+        raise ValueError(f"Ghép nhánh tạo vòng lặp cha/con giữa các thành viên {cycles[0]}")
+
+    # --- 4. Chỉ mục + delta (client của cả 2 gia phả tải lại snapshot) ---
+    rebuild_family_lineage(db, target_family_id)
+    rebuild_family_lineage(db, source_family_id)
+    recount_members(db, target_family_id)
+    recount_members(db, source_family_id)
+    index_persons(db, [keep for keep, _ in merged])
+
+    changesets = []
+    for family_id in (source_family_id, target_family_id):
+        changeset = TreeChangeSet(family_id)
+        changeset.reset()
+        save_changes(db, changeset)
+        changesets.append(changeset)
+
+    return {
+        "moved_ids": moved,
+        "merged": merged,
+        "attached": attached,
+        "demoted_ids": demoted,
+        "changesets": changesets,
+    }
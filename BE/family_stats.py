@@ -0,0 +1,222 @@
+"""
+Thống kê gia phả / nhánh (số hậu duệ, còn sống, theo đời, dòng nam, tuổi thọ trung bình).
+
+Cả family được nạp 1 lần thành các mảng NumPy (index theo vị trí, cha/mẹ là index hoặc -1),
+rồi tính tổng hậu duệ cho MỌI người trong 1 lượt từ dưới lên: duyệt từng lớp (đời) từ sâu
+nhất lên, cộng dồn giá trị của con vào cha/mẹ bằng np.add.at. Kết quả được cache theo
+(family_id, tree_version) nên chỉ tính lại khi cây thay đổi.
+
+Lưu ý: nếu trong họ có con cháu lấy nhau (1 người đi tới hậu duệ qua 2 người con),
+số đếm theo nhánh con sẽ tính người đó 2 lần. Tổng của gốc được hỏi thì lấy chính xác
+từ closure table person_lineage.
+"""
+import threading
+from collections import OrderedDict, deque
+from typing import Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from models import Person, PersonLineage
+from tree_delta import get_tree_version
+
+DAYS_PER_YEAR = 365.2425
+STATS_CACHE_SIZE = 64   # Số family giữ trong cache
+MAX_BRANCHES = 100      # Số nhánh tối đa trả về
+
+
+class FamilyArrays:
+    """Dữ liệu 1 family dạng mảng + các tổng hậu duệ đã tính sẵn cho từng người."""
+
+    def __init__(self, rows):
+        n = len(rows)
+        self.n = n
+        self.ids = np.fromiter((r.id for r in rows), dtype=np.int64, count=n)
+        self.index = {pid: i for i, pid in enumerate(self.ids.tolist())}
+        self.names = [f"{r.last_name or ''} {r.first_name}".strip() for r in rows]
+        self.father = np.array([self.index.get(r.father_id, -1) for r in rows], dtype=np.int64)
+        self.mother = np.array([self.index.get(r.mother_id, -1) for r in rows], dtype=np.int64)
+        self.is_male = np.array([r.gender == 'male' for r in rows], dtype=bool)
+        self.generation = np.array([r.generation or 0 for r in rows], dtype=np.int64)
+
+        birth = np.array([r.date_of_birth for r in rows], dtype='datetime64[D]')
+        death = np.array([r.date_of_death for r in rows], dtype='datetime64[D]')
+        self.alive = np.isnat(death)
+        self.has_lifespan = ~np.isnat(birth) & ~np.isnat(death) & (death >= birth)
+        days = (death - birth).astype(np.float64)
+        self.lifespan = np.where(self.has_lifespan, days / DAYS_PER_YEAR, np.nan)
+
+        self._aggregate()
+
+    def _levels(self):
+        """Độ sâu topo (0 = không có cha/mẹ trong family); -1 nếu nằm trong chu trình."""
+        level = np.full(self.n, -1, dtype=np.int64)
+        children = [[] for _ in range(self.n)]
+        indegree = np.zeros(self.n, dtype=np.int64)
+        for parent_arr in (self.father, self.mother):
+            for child, parent in enumerate(parent_arr.tolist()):
+                if parent >= 0:
+                    children[parent].append(child)
+                    indegree[child] += 1
+        queue = deque(np.flatnonzero(indegree == 0).tolist())
+        for i in queue:
+            level[i] = 0
+        while queue:
+            i = queue.popleft()
+            for c in children[i]:
+                level[c] = max(level[c], level[i] + 1)
+                indegree[c] -= 1
+                if indegree[c] == 0:
+                    queue.append(c)
+        return level
+
+    def _aggregate(self):
+        n = self.n
+        self.descendants = np.zeros(n, dtype=np.int64)
+        self.living = np.zeros(n, dtype=np.int64)
+        self.male_line = np.zeros(n, dtype=np.int64)
+        self.lifespan_sum = np.zeros(n, dtype=np.float64)
+        self.lifespan_n = np.zeros(n, dtype=np.int64)
+
+        own_lifespan = np.where(self.has_lifespan, self.lifespan, 0.0)
+        level = self._levels()
+        for lvl in range(int(level.max(initial=0)), 0, -1):
+            at_level = level == lvl
+            for parent_arr in (self.father, self.mother):
+                m = at_level & (parent_arr >= 0)
+                targets = parent_arr[m]
+                np.add.at(self.descendants, targets, 1 + self.descendants[m])
+                np.add.at(self.living, targets, self.alive[m] + self.living[m])
+                np.add.at(self.lifespan_sum, targets, own_lifespan[m] + self.lifespan_sum[m])
+                np.add.at(self.lifespan_n, targets, self.has_lifespan[m] + self.lifespan_n[m])
+            # Dòng nam: chỉ đi theo cha
+            m = at_level & (self.father >= 0)
+            np.add.at(self.male_line, self.father[m], 1 + self.male_line[m])
+
+    def branch(self, i: int) -> dict:
+        """Thống kê nhánh của người ở vị trí i (số hậu duệ không tính chính họ)."""
+        total_n = self.lifespan_n[i] + self.has_lifespan[i]
+        total = self.lifespan_sum[i] + (self.lifespan[i] if self.has_lifespan[i] else 0.0)
+        return {
+            "person_id": int(self.ids[i]),
+            "name": self.names[i],
+            "descendants": int(self.descendants[i]),
+            "living_descendants": int(self.living[i]),
+            "male_line_descendants": int(self.male_line[i]),
+            "average_lifespan": round(float(total / total_n), 1) if total_n else None,
+        }
+
+    def founders(self):
+        """Thủy tổ các nhánh: không có cha/mẹ trong family và là cha (hoặc mẹ đơn thân) của ai đó."""
+        has_parent = (self.father >= 0) | (self.mother >= 0)
+        heads = np.zeros(self.n, dtype=bool)
+        heads[self.father[self.father >= 0]] = True
+        lone = (self.father < 0) & (self.mother >= 0)
+        heads[self.mother[lone]] = True
+        return np.flatnonzero(heads & ~has_parent)
+
+    def children_of(self, i: int):
+        return np.flatnonzero((self.father == i) | (self.mother == i))
+
+
+def _average(values, mask) -> Optional[float]:
+    return round(float(values[mask].mean()), 1) if mask.any() else None
+
+
+def _generation_counts(generations):
+    gens, counts = np.unique(generations[generations > 0], return_counts=True)
+    return [{"generation": int(g), "count": int(c)} for g, c in zip(gens, counts)]
+
+
+def _branch_list(arrays: FamilyArrays, idx):
+    branches = [arrays.branch(int(i)) for i in idx]
+    branches.sort(key=lambda b: -b["descendants"])
+    return branches[:MAX_BRANCHES]
+
+
+def _family_summary(arrays: FamilyArrays) -> dict:
+    return {
+        "root_id": None,
+        "total_members": arrays.n,
+        "living_members": int(arrays.alive.sum()),
+        "male_members": int(arrays.is_male.sum()),
+        "male_line_members": None,
+        "average_lifespan": _average(arrays.lifespan, arrays.has_lifespan),
+        "generations": _generation_counts(arrays.generation),
+        "branches": _branch_list(arrays, arrays.founders()),
+    }
+
+
+def _subtree_summary(db: Session, arrays: FamilyArrays, root_id: int) -> dict:
+    i = arrays.index[root_id]
+    # Tập hậu duệ chính xác lấy từ closure table (1 query có index)
+    desc_ids = [d for (d,) in db.query(PersonLineage.descendant_id).filter(PersonLineage.ancestor_id == root_id).all()]
+    mask = np.zeros(arrays.n, dtype=bool)
+    mask[i] = True
+    mask[[arrays.index[d] for d in desc_ids if d in arrays.index]] = True
+    return {
+        "root_id": root_id,
+        "total_members": int(mask.sum()),
+        "living_members": int((arrays.alive & mask).sum()),
+        "male_members": int((arrays.is_male & mask).sum()),
+        "male_line_members": int(arrays.male_line[i]) + 1,
+        "average_lifespan": _average(arrays.lifespan, mask & arrays.has_lifespan),
+        "generations": _generation_counts(arrays.generation[mask]),
+        "branches": _branch_list(arrays, arrays.children_of(i)),
+    }
+
+
+class _StatsCache:
+    """LRU nhỏ: family_id -> (version, FamilyArrays, {root_id: summary})."""
+
+    def __init__(self, size: int = STATS_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[int, tuple]" = OrderedDict()
+
+    def get(self, family_id: int, version: int):
+        with self.lock:
+            entry = self.entries.get(family_id)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(family_id)
+            return entry
+
+    def put(self, family_id: int, version: int, arrays: FamilyArrays):
+        entry = (version, arrays, {})
+        with self.lock:
+            self.entries[family_id] = entry
+            self.entries.move_to_end(family_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+
+stats_cache = _StatsCache()
+
+
+def load_family_arrays(db: Session, family_id: int) -> FamilyArrays:
+    rows = db.query(
+        Person.id, Person.first_name, Person.last_name, Person.gender, Person.father_id, Person.mother_id,
+        Person.date_of_birth, Person.date_of_death, Person.generation
+    ).filter(Person.family_id == family_id).all()
+    return FamilyArrays(rows)
+
+
+def get_family_statistics(db: Session, family_id: int, root_id: Optional[int] = None) -> Optional[dict]:
+    """
+    Thống kê cả family (root_id=None) hoặc nhánh từ root_id. Trả về None nếu root_id không thuộc family.
+    """
+    version = get_tree_version(db, family_id)
+    entry = stats_cache.get(family_id, version)
+    if entry is None:
+        entry = stats_cache.put(family_id, version, load_family_arrays(db, family_id))
+    _, arrays, summaries = entry
+
+    if root_id is not None and root_id not in arrays.index:
+        return None
+    summary = summaries.get(root_id)
+    if summary is None:
+        summary = _family_summary(arrays) if root_id is None else _subtree_summary(db, arrays, root_id)
+        summaries[root_id] = summary
+    return {"family_id": family_id, "version": version, **summary}
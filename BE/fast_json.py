@@ -0,0 +1,40 @@
+"""
+Fast JSON response cho các endpoint đọc nhiều (cây gia phả, danh sách thành viên, lịch sử chat).
+
+Thay vì dựng từng pydantic model (TreeNode, PersonRead, MessageRead...) rồi để FastAPI
+validate + serialize lại qua response_model, router trả về dict/list thuần và
+FastJSONResponse encode thẳng bằng orjson (nếu có cài), fallback về json chuẩn.
+
+Khi handler trả về một Response, FastAPI bỏ qua bước validate response_model,
+nhưng response_model vẫn được dùng để sinh OpenAPI schema -> tài liệu API không đổi.
+"""
+import json
+from datetime import date, datetime
+from typing import Any
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # orjson là optional, thiếu thì dùng json chuẩn
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Encode dict/list thuần sang JSON bytes (date/datetime -> ISO string)."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,320 @@
+"""
+Chỉ mục "Đời thứ N" cho gia phả.
+
+Mỗi Person lưu:
+- generation: thủy tổ (không có cha/mẹ) = 1, con = 1 + đời lớn nhất của cha/mẹ.
+  Người không có cha/mẹ nhưng có vợ/chồng đã có cha/mẹ (dâu/rể) lấy đời của vợ/chồng.
+- lineage_root_id: thủy tổ của dòng, đi theo cha trước rồi tới mẹ (dâu/rể theo vợ/chồng).
+
+refresh_lineage() cập nhật tăng dần khi liên kết cha/mẹ thay đổi: chỉ tính lại các người
+bị ảnh hưởng rồi lan xuống con cháu theo từng lớp bằng query có index (father_id/mother_id).
+rebuild_family_lineage() tính lại toàn bộ 1 family (sau import) trong 1 lượt topo.
+
+Closure table person_lineage (ancestor_id, descendant_id, depth) cho phép hỏi tổ tiên/hậu duệ
+bằng 1 query có index. refresh_closure() tính lại các dòng của người có cha/mẹ thay đổi
+và toàn bộ hậu duệ của họ; rebuild_family_lineage() dựng lại cả family.
+"""
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Person, PersonLineage, PersonLink
+from person_links import LINK_SPOUSE, spouse_ids_of
+
+# Chặn vòng lặp vô hạn nếu dữ liệu lỡ có chu trình cha/con
+MAX_PROPAGATION_LEVELS = 1000
+
+
+def _spouses_of(db: Session, person_ids) -> Dict[int, List[int]]:
+    if not person_ids:
+        return {}
+    return spouse_ids_of(db, person_ids)
+
+
+def _resolve(person_id, father_id, mother_id, info, spouse_ids):
+    """Tính (generation, lineage_root_id) từ thông tin đã biết của cha/mẹ hoặc vợ/chồng."""
+    parents = [pid for pid in (father_id, mother_id) if pid and pid in info]
+    if parents:
+        generation = 1 + max(info[pid][0] or 1 for pid in parents)
+        primary = father_id if father_id in info else mother_id
+        return generation, info[primary][1] or primary
+
+    # Dâu/rể: theo đời và dòng của vợ/chồng có cha/mẹ
+    for sid in spouse_ids:
+        if sid in info and info[sid][2]:
+            return info[sid][0], info[sid][1]
+    return 1, person_id
+
+
+def refresh_lineage(db: Session, person_ids: Iterable[int]):
+    """
+    Cập nhật generation/lineage_root_id cho person_ids và lan xuống con cháu (chưa commit).
+    Gọi sau khi father_id/mother_id (hoặc quan hệ vợ/chồng) thay đổi và đã flush.
+    """
+    frontier = {pid for pid in person_ids if pid}
+    levels = 0
+    while frontier and levels < MAX_PROPAGATION_LEVELS:
+        levels += 1
+        rows = db.query(Person.id, Person.father_id, Person.mother_id, Person.generation, Person.lineage_root_id)\
+            .filter(Person.id.in_(frontier)).all()
+
+        parentless = [r.id for r in rows if not r.father_id and not r.mother_id]
+        spouse_map = _spouses_of(db, parentless)
+
+        # Thông tin của cha/mẹ + vợ/chồng: id -> (generation, root, has_parents)
+        ref_ids = {pid for r in rows for pid in (r.father_id, r.mother_id) if pid}
+        ref_ids.update(sid for sids in spouse_map.values() for sid in sids)
+        info = {
+            r.id: (r.generation, r.lineage_root_id, bool(r.father_id or r.mother_id))
+            for r in db.query(Person.id, Person.generation, Person.lineage_root_id, Person.father_id, Person.mother_id)
+                .filter(Person.id.in_(ref_ids)).all()
+        } if ref_ids else {}
+
+        updates = []
+        for r in rows:
+            generation, root = _resolve(r.id, r.father_id, r.mother_id, info, spouse_map.get(r.id, []))
+            if (generation, root) != (r.generation, r.lineage_root_id):
+                updates.append({"id": r.id, "generation": generation, "lineage_root_id": root})
+
+        if not updates:
+            break
+        db.bulk_update_mappings(Person, updates)
+        db.flush()
+
+        # Lớp tiếp theo: con của người vừa đổi + dâu/rể (không cha mẹ) của họ
+        changed = [u["id"] for u in updates]
+        frontier = {
+            cid for (cid,) in db.query(Person.id).filter(
+                Person.father_id.in_(changed) | Person.mother_id.in_(changed)
+            ).all()
+        }
+        for sids in _spouses_of(db, changed).values():
+            frontier.update(sids)
+
+
+def compute_family_lineage(rows, spouse_pairs) -> Dict[int, Tuple[int, int]]:
+    """
+    Tính (generation, lineage_root_id) cho cả family trong 1 lượt topo (Kahn).
+    rows: (id, father_id, mother_id); spouse_pairs: (person_id, spouse_id).
+    """
+    by_id = {r[0]: r for r in rows}
+    spouses = defaultdict(list)
+    for p1, p2 in spouse_pairs:
+        if p1 in by_id and p2 in by_id:
+            spouses[p1].append(p2)
+
+    # Cạnh phụ thuộc: cha/mẹ -> con, vợ/chồng có cha mẹ -> dâu/rể không cha mẹ
+    deps = defaultdict(list)
+    indegree = {pid: 0 for pid in by_id}
+    for pid, father_id, mother_id in rows:
+        parents = [x for x in (father_id, mother_id) if x in by_id]
+        if not parents:
+            parents = [sid for sid in spouses[pid] if by_id[sid][1] in by_id or by_id[sid][2] in by_id]
+        for parent in parents:
+            deps[parent].append(pid)
+            indegree[pid] += 1
+
+    info = {}
+    queue = deque(pid for pid, d in indegree.items() if d == 0)
+    while queue:
+        pid = queue.popleft()
+        _, father_id, mother_id = by_id[pid]
+        generation, root = _resolve(pid, father_id, mother_id, info, spouses[pid])
+        info[pid] = (generation, root, bool(father_id in by_id or mother_id in by_id))
+        for nxt in deps[pid]:
+            indegree[nxt] -= 1
+            if indegree[nxt] == 0:
+                queue.append(nxt)
+
+    # Người nằm trong chu trình (dữ liệu lỗi) không được gán
+    return {pid: (v[0], v[1]) for pid, v in info.items()}
+
+
+def rebuild_family_lineage(db: Session, family_id: int) -> int:
+    """
+    Tính lại toàn bộ chỉ mục đời + closure table của family (chưa commit).
+    Trả về số người được cập nhật đời.
+    """
+    rows = db.query(Person.id, Person.father_id, Person.mother_id, Person.generation, Person.lineage_root_id)\
+        .filter(Person.family_id == family_id).all()
+    if not rows:
+        return 0
+    links = db.query(PersonLink.person1_id, PersonLink.person2_id)\
+        .join(Person, Person.id == PersonLink.person1_id)\
+        .filter(Person.family_id == family_id, PersonLink.kind == LINK_SPOUSE).all()
+    spouse_pairs = [(p1, p2) for p1, p2 in links] + [(p2, p1) for p1, p2 in links]
+
+    computed = compute_family_lineage([(r.id, r.father_id, r.mother_id) for r in rows], spouse_pairs)
+    updates = [
+        {"id": r.id, "generation": computed[r.id][0], "lineage_root_id": computed[r.id][1]}
+        for r in rows
+        if r.id in computed and computed[r.id] != (r.generation, r.lineage_root_id)
+    ]
+    if updates:
+        db.bulk_update_mappings(Person, updates)
+        db.flush()
+    rebuild_family_closure(db, family_id)
+    return len(updates)
+
+
+# ========== Closure table tổ tiên / hậu duệ ==========
+
+def _ancestor_maps(parent_rows, known: Dict[int, Dict[int, int]]) -> Dict[int, Dict[int, int]]:
+    """
+    Tính {person_id: {ancestor_id: depth}} theo thứ tự topo cho parent_rows (id, father_id, mother_id).
+    known: tổ tiên đã biết của các cha/mẹ nằm ngoài tập đang tính.
+    """
+    by_id = {r[0]: r for r in parent_rows}
+    children = defaultdict(list)
+    indegree = {pid: 0 for pid in by_id}
+    for pid, father_id, mother_id in parent_rows:
+        for parent in (father_id, mother_id):
+            if parent in by_id:
+                children[parent].append(pid)
+                indegree[pid] += 1
+
+    result: Dict[int, Dict[int, int]] = {}
+    queue = deque(pid for pid, d in indegree.items() if d == 0)
+    while queue:
+        pid = queue.popleft()
+        _, father_id, mother_id = by_id[pid]
+        ancestors: Dict[int, int] = {}
+        for parent in (father_id, mother_id):
+            if not parent or parent == pid:
+                continue
+            parent_ancestors = result.get(parent, known.get(parent, {}))
+            # Đường ngắn nhất nếu 2 nhánh cùng về 1 tổ tiên
+            if ancestors.get(parent, 2 ** 31) > 1:
+                ancestors[parent] = 1
+            for anc, depth in parent_ancestors.items():
+                if anc != pid and ancestors.get(anc, 2 ** 31) > depth + 1:
+                    ancestors[anc] = depth + 1
+        result[pid] = ancestors
+        for child in children[pid]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                queue.append(child)
+    return result
+
+
+def _write_closure(db: Session, ancestor_maps: Dict[int, Dict[int, int]]):
+    rows = [
+        {"ancestor_id": anc, "descendant_id": pid, "depth": depth}
+        for pid, ancestors in ancestor_maps.items()
+        for anc, depth in ancestors.items()
+    ]
+    if rows:
+        db.bulk_insert_mappings(PersonLineage, rows)
+
+
+def refresh_closure(db: Session, person_ids: Iterable[int]):
+    """
+    Cập nhật closure table khi father_id/mother_id của person_ids thay đổi (chưa commit).
+    Chỉ tính lại dòng của các người đó và hậu duệ của họ; tổ tiên ngoài tập này giữ nguyên.
+    """
+    seeds = {pid for pid in person_ids if pid}
+    if not seeds:
+        return
+    # Hậu duệ không đổi khi cha/mẹ của seed đổi -> lấy từ closure hiện tại
+    subtree = set(seeds)
+    subtree.update(d for (d,) in db.query(PersonLineage.descendant_id).filter(PersonLineage.ancestor_id.in_(seeds)).all())
+
+    parent_rows = [
+        (r.id, r.father_id, r.mother_id)
+        for r in db.query(Person.id, Person.father_id, Person.mother_id).filter(Person.id.in_(subtree)).all()
+    ]
+    outside_parents = {p for r in parent_rows for p in r[1:] if p and p not in subtree}
+    known = defaultdict(dict)
+    if outside_parents:
+        for anc, desc, depth in db.query(PersonLineage.ancestor_id, PersonLineage.descendant_id, PersonLineage.depth)\
+                .filter(PersonLineage.descendant_id.in_(outside_parents)).all():
+            known[desc][anc] = depth
+
+    db.query(PersonLineage).filter(PersonLineage.descendant_id.in_(subtree)).delete(synchronize_session=False)
+    _write_closure(db, _ancestor_maps(parent_rows, known))
+    db.flush()
+
+
+def delete_person_closure(db: Session, person_id: int):
+    """Xóa mọi dòng closure liên quan tới person_id (gọi trước khi xóa Person)."""
+    db.query(PersonLineage).filter(
+        (PersonLineage.ancestor_id == person_id) | (PersonLineage.descendant_id == person_id)
+    ).delete(synchronize_session=False)
+
+
+def rebuild_family_closure(db: Session, family_id: int):
+    """Dựng lại closure table cho toàn bộ family (chưa commit)."""
+    parent_rows = [
+        (r.id, r.father_id, r.mother_id)
+        for r in db.query(Person.id, Person.father_id, Person.mother_id).filter(Person.family_id == family_id).all()
+    ]
+    if not parent_rows:
+        return
+    ids = [r[0] for r in parent_rows]
+    outside_parents = {p for r in parent_rows for p in r[1:] if p} - set(ids)
+    known = defaultdict(dict)
+    if outside_parents:
+        for anc, desc, depth in db.query(PersonLineage.ancestor_id, PersonLineage.descendant_id, PersonLineage.depth)\
+                .filter(PersonLineage.descendant_id.in_(outside_parents)).all():
+            known[desc][anc] = depth
+    db.query(PersonLineage).filter(PersonLineage.descendant_id.in_(ids)).delete(synchronize_session=False)
+    _write_closure(db, _ancestor_maps(parent_rows, known))
+    db.flush()
+
+
+# ========== Chống vòng lặp cha/con ==========
+
+def is_ancestor_or_self(db: Session, ancestor_id: int, person_id: int) -> bool:
+    """1 lookup theo khóa chính của closure table."""
+    if ancestor_id == person_id:
+        return True
+    return db.query(PersonLineage.depth).filter(
+        PersonLineage.ancestor_id == ancestor_id,
+        PersonLineage.descendant_id == person_id
+    ).first() is not None
+
+
+def creates_cycle(db: Session, child_id: int, parent_id: int) -> bool:
+    """Gắn parent_id làm cha/mẹ của child_id có tạo vòng không (parent là chính child hoặc hậu duệ của child)."""
+    return bool(child_id and parent_id) and is_ancestor_or_self(db, child_id, parent_id)
+
+
+def find_parent_cycles(rows) -> List[List[int]]:
+    """
+    Tìm các vòng cha/con trong rows (id, father_id, mother_id).
+    Loại dần người không nằm trên/dưới vòng (Kahn), phần còn lại đi ngược lên cha/mẹ tới khi gặp lại chính mình.
+    """
+    by_id = {r[0]: r for r in rows}
+    children = defaultdict(list)
+    indegree = {pid: 0 for pid in by_id}
+    for pid, father_id, mother_id in rows:
+        for parent in (father_id, mother_id):
+            if parent in by_id:
+                children[parent].append(pid)
+                indegree[pid] += 1
+
+    queue = deque(pid for pid, d in indegree.items() if d == 0)
+    while queue:
+        pid = queue.popleft()
+        for child in children[pid]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                queue.append(child)
+
+    remaining = {pid for pid, d in indegree.items() if d > 0}
+    cycles, done = [], set()
+    for start in remaining:
+        if start in done:
+            continue
+        path, position = [], {}
+        pid = start
+        while pid not in done and pid not in position:
+            position[pid] = len(path)
+            path.append(pid)
+            _, father_id, mother_id = by_id[pid]
+            pid = father_id if father_id in remaining else mother_id
+        if pid in position:
+            cycles.append(path[position[pid]:])
+        done.update(path)
+    return cycles
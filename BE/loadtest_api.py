@@ -0,0 +1,142 @@
+"""
+Load test: requests/giây và độ trễ của các endpoint nóng ở chế độ sync và async (ASYNC_DB).
+
+Mỗi endpoint được gọi liên tục bởi --concurrency client đồng thời trong --duration giây.
+
+Chạy:
+  python loadtest_api.py --compare --username u --password p --family 1
+      tự bật uvicorn 2 lần (ASYNC_DB=0 rồi ASYNC_DB=1) trên --port, đo cả 2 rồi in bảng so sánh
+  python loadtest_api.py --url http://localhost:8000 --username u --password p --family 1
+      đo server đang chạy sẵn
+  thêm --path 12 34 để đo cả POST /members/path; --only members chat để chỉ đo một số endpoint
+
+Cần: pip install httpx uvicorn; MySQL/Neo4j như lúc chạy thật (dùng database thử, không dùng production).
+"""
+import sys
+sys.path.append('.')
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import time
+
+import httpx
+
+
+def endpoints(args):
+    items = [
+        ("members", "GET", f"/members/{args.family}", None),
+        ("tree", "GET", f"/members/{args.family}/tree", None),
+        ("chat history", "GET", f"/families/{args.family}/chat/messages?limit=50", None),
+    ]
+    if args.path:
+        items.append(("path", "POST", "/members/path", {"from_id": args.path[0], "to_id": args.path[1]}))
+    if args.only:
+        items = [item for item in items if item[0].split()[0] in args.only]
+    return items
+
+
+async def login(client, args):
+    r = await client.post("/auth/login", json={"username": args.username, "password": args.password})
+    r.raise_for_status()
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+async def hammer(client, headers, method, url, body, concurrency, duration):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                r = await client.request(method, url, headers=headers, json=body)
+                if r.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else 0
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+        "mean": statistics.fmean(latencies) * 1000 if latencies else 0,
+        "errors": errors, "requests": len(latencies),
+    }
+
+
+async def run_suite(base_url, args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        headers = await login(client, args)
+        results = {}
+        for label, method, url, body in endpoints(args):
+            await hammer(client, headers, method, url, body, min(args.concurrency, 10), 1)  # warmup
+            results[label] = await hammer(client, headers, method, url, body, args.concurrency, args.duration)
+            r = results[label]
+            print(f"  {label:<14}{r['rps']:>9.0f} req/s  p50 {r['p50']:>7.1f}ms  p95 {r['p95']:>7.1f}ms  "
+                  f"p99 {r['p99']:>7.1f}ms  lỗi {r['errors']}/{r['requests']}")
+        return results
+
+
+def start_server(async_db, args):
+    env = dict(os.environ, ASYNC_DB="1" if async_db else "0")
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port),
+           "--workers", str(args.workers), "--log-level", "warning"]
+    server = subprocess.Popen(cmd, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{args.port}/openapi.json", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.3)
+    server.terminate()
+    raise RuntimeError("uvicorn không khởi động được")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--username", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--family", type=int, required=True)
+    parser.add_argument("--path", type=int, nargs=2, default=None)
+    parser.add_argument("--only", nargs="+", choices=["members", "tree", "chat", "path"], default=None)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.concurrency} client đồng thời, {args.duration:.0f}s / endpoint")
+    if not args.compare:
+        asyncio.run(run_suite(args.url or "http://localhost:8000", args))
+        sys.exit(0)
+
+    results = {}
+    for async_db in (False, True):
+        mode = "async" if async_db else "sync"
+        print(f"[{mode}] ASYNC_DB={int(async_db)}")
+        server = start_server(async_db, args)
+        try:
+            results[mode] = asyncio.run(run_suite(f"http://127.0.0.1:{args.port}", args))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"\n{'':<16}{'sync req/s':>12}{'async req/s':>13}{'':>8}{'sync p99':>10}{'async p99':>11}")
+    for label in results["sync"]:
+        s, a = results["sync"][label], results["async"][label]
+        print(f"{label:<16}{s['rps']:>12.0f}{a['rps']:>13.0f}   x{a['rps'] / max(s['rps'], 1e-9):<5.2f}"
+              f"{s['p99']:>10.1f}{a['p99']:>11.1f}")
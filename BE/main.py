@@ -1,7 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from routers import auth
-from db.mysql_connection import Base, engine
+from db.mysql_connection import Base, engine, USE_ASYNC_DB
 from db.neo4j_connection import Neo4jConnection
 from models import Family, Person
 from sqlalchemy import text
@@ -13,8 +13,24 @@ from routers import families
 from routers import maintenance
 from routers import upload # <--- Import
 from routers import chat # <--- Import
+from routers import tree_events
+from routers import genealogy
+from routers import duplicates
+from pubsub import bus as pubsub_bus
+from chat_writer import chat_writer
+from contextlib import asynccontextmanager
+import asyncio
 
-app = FastAPI(title="Family Management Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Worker không có ai xem cây vẫn phải publish delta lên bus cho worker khác -> gắn loop ngay từ đầu
+    tree_events.tree_events.bind_loop(asyncio.get_running_loop())
+    yield
+    await chat_writer.close() # Ghi nốt tin nhắn còn trong lô
+    await pubsub_bus.close()
+
+
+app = FastAPI(title="Family Management Backend", lifespan=lifespan)
 
 # Mount Static Files
 import os
@@ -26,6 +42,12 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Kích hoạt middleware gia hạn session
 auth.setup_session_middleware(app)
 
+# ASYNC_DB=1: bản async của các endpoint nóng, đăng ký trước để được khớp trước bản sync
+if USE_ASYNC_DB:
+    from routers import async_api
+    app.include_router(async_api.router, include_in_schema=False)  # OpenAPI đã có từ bản sync (cùng path, cùng schema)
+    print("ASYNC_DB enabled: async endpoints for members list, tree, path, chat history")
+
 app.include_router(members.router)
 app.include_router(tree.router)
 app.include_router(users.router)
@@ -34,6 +56,9 @@ app.include_router(families.router)
 app.include_router(maintenance.router)
 app.include_router(upload.router) # <--- Include
 app.include_router(chat.router) # <--- Include
+app.include_router(tree_events.router)
+app.include_router(genealogy.router)
+app.include_router(duplicates.router)
 
 # ====== 1️⃣ TẠO BẢNG MYSQL (NẾU CÓ) ======
 Base.metadata.create_all(bind=engine)
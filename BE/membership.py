@@ -0,0 +1,131 @@
+"""
+Cache quyền thành viên gia phả cho verify_family_access / verify_editor_access.
+
+(user_id, family_id) -> Membership(person_id, role, linked) hoặc None (không phải thành viên),
+sống MEMBERSHIP_TTL giây. Lần miss chỉ tốn 1 query (khớp user_id hoặc CCCD trong cùng câu),
+lần hit không query gì. Các thao tác đổi thành viên/quyền gọi invalidate_membership() ngay;
+TTL chỉ để giới hạn độ trễ khi chạy nhiều worker (mỗi process một cache).
+
+Family.member_count được cập nhật cùng transaction khi thêm/xóa/chuyển thành viên,
+thay cho count() cả gia phả trong nhánh "gia phả chưa có ai" (bộ đếm = 0 vẫn được xác nhận
+bằng EXISTS trước khi cấp quyền, xem family_is_empty).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from sqlalchemy import case, exists, func
+from sqlalchemy.orm import Session
+
+from models import Family, Person
+
+MEMBERSHIP_TTL = 60          # giây
+MEMBERSHIP_CACHE_SIZE = 50000
+
+
+class Membership(NamedTuple):
+    person_id: int
+    role: str
+    linked: bool  # True: khớp theo user_id (tài khoản đã liên kết); False: chỉ khớp CCCD
+
+
+class _MembershipCache:
+    """LRU + TTL: (user_id, family_id) -> (hết hạn, cccd lúc tra, Membership | None)."""
+
+    def __init__(self, size: int = MEMBERSHIP_CACHE_SIZE, ttl: float = MEMBERSHIP_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get(self, key, cccd):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            expires, cached_cccd, membership = entry
+            if expires < time.monotonic() or cached_cccd != cccd:
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            return True, membership
+
+    def put(self, key, cccd, membership):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, cccd, membership)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: Optional[int] = None, family_id: Optional[int] = None):
+        with self.lock:
+            if user_id is None and family_id is None:
+                self.entries.clear()
+                return
+            for key in [k for k in self.entries
+                        if (user_id is None or k[0] == user_id) and (family_id is None or k[1] == family_id)]:
+                del self.entries[key]
+
+
+membership_cache = _MembershipCache()
+
+
+def load_membership(db: Session, user, family_id: int) -> Optional[Membership]:
+    cccd = getattr(user, 'cccd', None)
+    condition = Person.user_id == user.id
+    if cccd:
+        condition = condition | (Person.cccd == cccd)
+    # Ưu tiên bản ghi liên kết theo user_id
+    row = db.query(Person.id, Person.role, Person.user_id).filter(Person.family_id == family_id, condition)\
+        .order_by(case((Person.user_id == user.id, 0), else_=1)).first()
+    if not row:
+        return None
+    return Membership(row.id, row.role or 'member', row.user_id == user.id)
+
+
+def get_membership(db: Session, user, family_id: int) -> Optional[Membership]:
+    key = (user.id, family_id)
+    cccd = getattr(user, 'cccd', None)
+    hit, membership = membership_cache.get(key, cccd)
+    if not hit:
+        membership = load_membership(db, user, family_id)
+        membership_cache.put(key, cccd, membership)
+    return membership
+
+
+def invalidate_membership(user_id: Optional[int] = None, family_id: Optional[int] = None):
+    """Xóa cache của 1 user, 1 gia phả, 1 cặp (user, gia phả) hoặc toàn bộ (không truyền gì)."""
+    membership_cache.invalidate(user_id, family_id)
+
+
+# ----- Đếm thành viên trên Family -----
+
+def family_member_count(db: Session, family_id: int) -> int:
+    return db.query(Family.member_count).filter(Family.id == family_id).scalar() or 0
+
+
+def family_is_empty(db: Session, family_id: int) -> bool:
+    """
+    Gia phả chưa có Person nào. member_count chỉ là gợi ý (> 0 thì chắc chắn không rỗng, không cần
+    query persons); = 0 thì xác nhận bằng EXISTS vì DB cũ thêm cột DEFAULT 0 mà chưa chạy UPDATE
+    backfill sẽ thấy mọi gia phả = 0. Nhánh này dùng để cấp quyền nên không được tin bộ đếm.
+    """
+    if family_member_count(db, family_id) > 0:
+        return False
+    return not db.query(exists().where(Person.family_id == family_id)).scalar()
+
+
+def change_member_count(db: Session, family_id: Optional[int], delta: int):
+    """Cộng/trừ Family.member_count (UPDATE nguyên tử, chưa commit)."""
+    if family_id is None or not delta:
+        return
+    db.query(Family).filter(Family.id == family_id).update(
+        {Family.member_count: Family.member_count + delta}, synchronize_session=False
+    )
+
+
+def recount_members(db: Session, family_id: int):
+    """Đếm lại member_count (sau thao tác hàng loạt: import, ghép gia phả)."""
+    count = db.query(func.count(Person.id)).filter(Person.family_id == family_id).scalar()
+    db.query(Family).filter(Family.id == family_id).update({Family.member_count: count}, synchronize_session=False)
@@ -1,95 +1,70 @@
+import sys
+import time
+from sqlalchemy import func
 from db.mysql_connection import SessionLocal
-from models import Person, Relationship
-from sqlalchemy.orm import Session
-from datetime import datetime
+from models import Relationship, PersonLink
+from person_links import LINK_SPOUSE, ordered_pair
+from relationship_sync import regenerate_relationships as regenerate_relationship_rows
 
-def regenerate_relationships():
-    db = SessionLocal()
-    try:
-        print("Starting Relationship Regeneration...")
-        persons = db.query(Person).all()
-        processed_count = 0
-        
-        # Pre-fetch for faster lookup
-        person_map = {p.id: p for p in persons}
-        
-        for p in persons:
-            # 1. Father / Mother / Child
-            if p.father_id and p.father_id in person_map:
-                father = person_map[p.father_id]
-                # (Me, Dad) -> Bố
-                ensure_rel(db, p.id, father.id, "bố")
-                # (Dad, Me) -> Con
-                child_role = "con trai" if p.gender == 'male' else "con gái"
-                ensure_rel(db, father.id, p.id, child_role)
-                
-            if p.mother_id and p.mother_id in person_map:
-                mother = person_map[p.mother_id]
-                # (Me, Mom) -> Mẹ
-                ensure_rel(db, p.id, mother.id, "mẹ")
-                # (Mom, Me) -> Con
-                child_role = "con trai" if p.gender == 'male' else "con gái"
-                ensure_rel(db, mother.id, p.id, child_role)
+LEGACY_SPOUSE_TYPES = ['vợ', 'chồng']
 
-            # 2. Siblings (Recalculate for everyone)
-            # Find siblings via DB query is safer than map iteration for each
-            # Or use map? Map is faster.
-            # Siblings = same father OR same mother
-            siblings = []
-            if p.father_id:
-                siblings += [sib for sib in persons if sib.father_id == p.father_id and sib.id != p.id]
-            if p.mother_id:
-                siblings += [sib for sib in persons if sib.mother_id == p.mother_id and sib.id != p.id and sib not in siblings]
-            
-            for sib in siblings:
-                # Calculate Role
-                 # Check full status
-                is_full = (sib.father_id == p.father_id) and (sib.mother_id == p.mother_id)
-                suffix = " ruột" if is_full else ""
-                
-                # Check age
-                am_i_older = False
-                if p.date_of_birth and sib.date_of_birth:
-                    am_i_older = p.date_of_birth < sib.date_of_birth
-                else:
-                    am_i_older = p.id < sib.id
-                
-                # Relation: Me -> Sib ("Tôi là gì của Sib?")
-                if am_i_older:
-                    my_role = "anh" if p.gender == 'male' else "chị"
-                    if suffix: my_role += suffix
-                else:
-                    my_role = "em"
-                    if suffix: my_role += suffix
-                    if p.gender == 'male': my_role += " trai"
-                    else: my_role += " gái"
-                
-                ensure_rel(db, p.id, sib.id, my_role)
+def migrate_spouse_links(db):
+    # Bảng relationships cũ: 2 dòng/cặp, type là chuỗi (có chỗ ghi hoa 'Vợ') -> 1 dòng person_links/cặp.
+    # Chỉ cần chuyển vợ/chồng; bố/mẹ/con lấy từ persons, anh chị em sinh lại từ father_id/mother_id.
+    pairs = {
+        ordered_pair(p1, p2)
+        for p1, p2 in db.query(Relationship.person1_id, Relationship.person2_id)
+            .filter(func.lower(Relationship.type).in_(LEGACY_SPOUSE_TYPES)).yield_per(50000)
+        if p1 != p2
+    }
+    existing = {
+        (p1, p2) for p1, p2 in db.query(PersonLink.person1_id, PersonLink.person2_id)
+            .filter(PersonLink.kind == LINK_SPOUSE).yield_per(50000)
+    }
+    missing = sorted(pairs - existing)
+    for start in range(0, len(missing), 5000):
+        db.bulk_insert_mappings(PersonLink, [
+            {"person1_id": p1, "person2_id": p2, "kind": LINK_SPOUSE} for p1, p2 in missing[start:start + 5000]
+        ])
+    return len(missing)
 
-            processed_count += 1
-            if processed_count % 10 == 0:
-                print(f"Processed {processed_count}/{len(persons)} persons...")
-        
+def migrate_relationships():
+    db = SessionLocal()
+    try:
+        print("Migrating relationships -> person_links...")
+        started = time.perf_counter()
+        spouses = migrate_spouse_links(db)
+        siblings = regenerate_relationship_rows(db)
         db.commit()
-        print("Relationship Regeneration Completed Successfully!")
-        
+        print(f"Migration Completed! {spouses} spouse links, {siblings} sibling links in {time.perf_counter() - started:.1f}s")
+        print("Sau khi kiểm tra dữ liệu có thể DROP TABLE relationships.")
     except Exception as e:
         print(f"Error: {e}")
         db.rollback()
     finally:
         db.close()
 
-def ensure_rel(db: Session, p1: int, p2: int, type_: str):
-    exists = db.query(Relationship).filter(
-        Relationship.person1_id == p1, 
-        Relationship.person2_id == p2
-    ).first()
-    
-    if not exists:
-        db.add(Relationship(person1_id=p1, person2_id=p2, type=type_))
-    # If exists but Type is diff? Update?
-    # Old logic might have empty type? No we dropped table.
-    # So if exists, it's correct.
+def regenerate_relationships(family_id=None):
+    # Gom nhóm theo father_id/mother_id 1 lần rồi bulk insert (xem relationship_sync.py),
+    # không còn quét O(n^2) + query kiểm tra từng cặp như trước
+    db = SessionLocal()
+    try:
+        print("Starting Sibling Link Regeneration...")
+        started = time.perf_counter()
+        created = regenerate_relationship_rows(db, family_id)
+        db.commit()
+        print(f"Sibling Link Regeneration Completed Successfully! Created {created} links in {time.perf_counter() - started:.1f}s")
+
+    except Exception as e:
+        print(f"Error: {e}")
+        db.rollback()
+    finally:
+        db.close()
 
 if __name__ == "__main__":
-    regenerate_relationships()
+    # python migrate_db.py            -> chuyển bảng relationships cũ sang person_links
+    # python migrate_db.py family_id  -> chỉ sinh lại liên kết anh chị em của 1 gia phả
+    if len(sys.argv) > 1:
+        regenerate_relationships(int(sys.argv[1]))
+    else:
+        migrate_relationships()
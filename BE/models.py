@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Integer, String, Date, ForeignKey, Text, Enum, TIMESTAMP, UniqueConstraint
+    Column, Integer, SmallInteger, String, Date, ForeignKey, Text, Enum, TIMESTAMP, UniqueConstraint, Index
 )
 from sqlalchemy.orm import relationship
 from db.mysql_connection import Base
@@ -38,6 +38,8 @@ class Family(Base):
     join_code = Column(String(10), unique=True, nullable=True) # Mã tham gia gia phả
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=True) # Người tạo/Sở hữu gia phả
     created_at = Column(TIMESTAMP, nullable=True)
+    tree_version = Column(Integer, nullable=False, default=0, server_default="0") # Tăng mỗi lần cây thay đổi
+    member_count = Column(Integer, nullable=False, default=0, server_default="0") # Số Person, xem membership.py
 
     members = relationship("Person", back_populates="family")
 
@@ -61,6 +63,8 @@ class Person(Base):
     mother_id = Column(Integer, ForeignKey("persons.id"), nullable=True)
     biography = Column(Text, nullable=True)
     created_at = Column(TIMESTAMP, nullable=True)
+    generation = Column(Integer, nullable=True) # Đời thứ N (tính từ thủy tổ = 1), xem lineage.py
+    lineage_root_id = Column(Integer, nullable=True) # Thủy tổ của dòng (theo cha trước, rồi mẹ)
 
     # Quan hệ ORM
     family = relationship("Family", back_populates="members")
@@ -69,9 +73,56 @@ class Person(Base):
 
     __table_args__ = (
         UniqueConstraint('family_id', 'cccd', name='uq_family_member_cccd'),
+        Index('idx_persons_family_generation', 'family_id', 'generation'),
     )
 
 
+class PersonLineage(Base):
+    """Closure table tổ tiên/hậu duệ: mỗi cặp (tổ tiên, hậu duệ) một dòng, depth = số đời cách nhau."""
+    __tablename__ = "person_lineage"
+
+    ancestor_id = Column(Integer, ForeignKey("persons.id", ondelete="CASCADE"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("persons.id", ondelete="CASCADE"), primary_key=True)
+    depth = Column(Integer, nullable=False) # 1 = cha/mẹ, 2 = ông/bà ... (đường ngắn nhất)
+
+    __table_args__ = (
+        Index('idx_lineage_ancestor_depth', 'ancestor_id', 'depth'),
+        Index('idx_lineage_descendant_depth', 'descendant_id', 'depth'),
+    )
+
+
+class PersonSearchToken(Base):
+    """Chỉ mục tìm kiếm: mỗi token (đã bỏ dấu, chữ thường) của tên / quê quán / CCCD một dòng, xem search_index.py."""
+    __tablename__ = "person_search_tokens"
+
+    person_id = Column(Integer, ForeignKey("persons.id", ondelete="CASCADE"), primary_key=True)
+    field = Column(String(10), primary_key=True) # name, place, cccd
+    token = Column(String(64), primary_key=True)
+    family_id = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index('idx_search_family_token', 'family_id', 'token'),
+    )
+
+
+class PersonLink(Base):
+    """
+    Quan hệ vợ/chồng, anh chị em: mỗi cặp (không hướng) một dòng, person1_id < person2_id, kind là mã số
+    (xem person_links.py). Nhãn tiếng Việt (vợ, anh ruột, em gái...) tính khi đọc từ giới tính/ngày sinh.
+    Cha/mẹ - con không lưu ở đây, lấy từ persons.father_id/mother_id.
+    """
+    __tablename__ = "person_links"
+
+    person1_id = Column(Integer, ForeignKey("persons.id", ondelete="CASCADE"), primary_key=True)
+    kind = Column(SmallInteger, primary_key=True, autoincrement=False)
+    person2_id = Column(Integer, ForeignKey("persons.id", ondelete="CASCADE"), primary_key=True)
+
+    __table_args__ = (
+        Index('idx_links_person2_kind', 'person2_id', 'kind', 'person1_id'),
+    )
+
+
+# Bảng cũ (2 dòng/cặp, type là chuỗi tiếng Việt) - chỉ còn dùng để migrate sang person_links (migrate_db.py)
 class Relationship(Base):
     __tablename__ = "relationships"
 
@@ -98,3 +149,52 @@ class Message(Base):
     # ORM
     family = relationship("Family")
     sender = relationship("User")
+
+    __table_args__ = (
+        # Lịch sử chat phân trang theo mốc (created_at, id) trong 1 gia phả
+        Index('idx_messages_family_created', 'family_id', 'created_at', 'id'),
+    )
+
+
+class MessageSearchToken(Base):
+    """Chỉ mục tìm kiếm chat: mỗi từ (đã bỏ dấu, chữ thường) của 1 tin nhắn một dòng, xem chat_search.py."""
+    __tablename__ = "message_search_tokens"
+
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), primary_key=True)
+    token = Column(String(64), primary_key=True)
+    family_id = Column(Integer, nullable=False)
+    created_at = Column(TIMESTAMP, nullable=False) # Chép từ messages để lọc/sắp xếp ngay trên index
+
+    __table_args__ = (
+        Index('idx_msg_search_family_token', 'family_id', 'token', 'created_at', 'message_id'),
+    )
+
+
+class ChatReadState(Base):
+    """Con trỏ đã đọc + số tin chưa đọc của 1 user trong chat 1 gia phả, xem read_state.py."""
+    __tablename__ = "chat_read_state"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    family_id = Column(Integer, ForeignKey("families.id", ondelete="CASCADE"), primary_key=True)
+    last_read_message_id = Column(Integer, nullable=False, default=0, server_default="0")
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        # chat_writer cộng bộ đếm theo family_id
+        Index('idx_read_state_family', 'family_id', 'user_id'),
+    )
+
+
+class TreeChange(Base):
+    """Nhật ký thay đổi cây gia phả (delta) để client chỉ tải phần thay đổi."""
+    __tablename__ = "tree_changes"
+
+    id = Column(Integer, primary_key=True, index=True)
+    family_id = Column(Integer, ForeignKey("families.id", ondelete="CASCADE"), nullable=False)
+    version = Column(Integer, nullable=False) # Version của family sau thay đổi
+    op = Column(String(20), nullable=False) # node_added, node_updated, node_removed, edge_added, edge_removed, reset
+    payload = Column(Text, nullable=False) # JSON (node hoặc edge)
+
+    __table_args__ = (
+        Index('idx_tree_changes_family_version', 'family_id', 'version'),
+    )
@@ -0,0 +1,118 @@
+"""
+Băm / kiểm tra mật khẩu (bcrypt) trên executor riêng, có giới hạn.
+
+bcrypt cố ý tốn CPU (~0.2s/lần ở cost 12). Trước đây login / create_user / update_user gọi thẳng
+pwd_context trong handler sync, nên một đợt đăng nhập dồn dập chiếm hết threadpool của FastAPI
+và các API khác phải chờ. Ở đây:
+  - PASSWORD_WORKERS luồng riêng chỉ để chạy bcrypt (bcrypt nhả GIL khi băm),
+  - tối đa PASSWORD_QUEUE_LIMIT việc đang chờ + đang chạy; vượt quá thì PasswordQueueFull
+    (router trả 503 để client thử lại) thay vì xếp hàng vô hạn,
+  - số liệu hàng đợi xem qua password_pool_stats() (GET /maintenance/password-pool).
+
+Đổi cost: đặt BCRYPT_ROUNDS. Hash cũ với cost khác vẫn đăng nhập được, verify_password trả thêm
+hash mới để login lưu lại (rehash khi đăng nhập), không ai bị khóa tài khoản.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "64"))
+
+# min_rounds = max_rounds = cost hiện tại: hash có cost khác bị needs_update -> băm lại khi đăng nhập
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS, bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordQueueFull(Exception):
+    """Hàng đợi băm mật khẩu đã đầy."""
+
+
+class _PasswordPool:
+    def __init__(self, workers: int = PASSWORD_WORKERS, limit: int = PASSWORD_QUEUE_LIMIT):
+        self.workers = workers
+        self.limit = limit
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.lock = threading.Lock()
+        self.pending = 0          # đang chờ + đang chạy
+        self.max_pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0     # giây chờ trong hàng đợi (cộng dồn)
+        self.run_total = 0.0      # giây chạy bcrypt (cộng dồn)
+
+    def _run(self, fn, args, queued_at):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.perf_counter()
+            with self.lock:
+                self.pending -= 1
+                self.completed += 1
+                self.wait_total += started - queued_at
+                self.run_total += finished - started
+
+    async def run(self, fn, *args):
+        with self.lock:
+            if self.pending >= self.limit:
+                self.rejected += 1
+                raise PasswordQueueFull()
+            self.pending += 1
+            self.submitted += 1
+            self.max_pending = max(self.max_pending, self.pending)
+        loop = asyncio.get_running_loop()
+        # Client ngắt kết nối giữa chừng thì việc vẫn chạy xong và tự trừ pending
+        return await loop.run_in_executor(self.executor, self._run, fn, args, time.perf_counter())
+
+    def stats(self) -> dict:
+        with self.lock:
+            completed = self.completed or 1
+            return {
+                "rounds": BCRYPT_ROUNDS,
+                "workers": self.workers,
+                "queue_limit": self.limit,
+                "running": min(self.pending, self.workers),
+                "queued": max(0, self.pending - self.workers),
+                "max_pending": self.max_pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.wait_total / completed * 1000, 1),
+                "avg_run_ms": round(self.run_total / completed * 1000, 1),
+            }
+
+
+password_pool = _PasswordPool()
+
+
+async def hash_password(password: str) -> str:
+    return await password_pool.run(pwd_context.hash, password)
+
+
+def _verify_and_update(password: str, hashed: str):
+    try:
+        return pwd_context.verify_and_update(password, hashed)
+    except ValueError:
+        # Hash hỏng / không nhận dạng được: coi như sai mật khẩu
+        return False, None
+
+
+async def verify_password(password: str, hashed: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """(đúng mật khẩu?, hash mới nếu cần lưu lại do đổi cost/thuật toán, ngược lại None)."""
+    if not hashed:
+        return False, None
+    return await password_pool.run(_verify_and_update, password, hashed)
+
+
+def password_pool_stats() -> dict:
+    return password_pool.stats()
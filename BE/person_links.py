@@ -0,0 +1,137 @@
+"""
+Quan hệ vợ/chồng, anh chị em lưu gọn trong bảng person_links: mỗi cặp một dòng (person1_id < person2_id)
+với mã kind số nhỏ, thay cho bảng relationships cũ (2 dòng/cặp, type là chuỗi tiếng Việt).
+
+Tra cứu theo (người, kind) dùng khóa chính (person1_id, kind, ...) hoặc index (person2_id, kind, ...).
+Nhãn hiển thị (vợ, chồng, anh ruột, em gái, bố, con trai...) được tính khi đọc từ giới tính,
+ngày sinh và father_id/mother_id, nên không bao giờ lệch hoa/thường hay lệch với dữ liệu người.
+"""
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, select
+from sqlalchemy.orm import Session
+
+from models import Person, PersonLink
+
+LINK_SPOUSE = 1
+LINK_SIBLING = 2
+
+
+def ordered_pair(a: int, b: int) -> Tuple[int, int]:
+    return (a, b) if a < b else (b, a)
+
+
+def linked_pairs(db: Session, person_ids: Iterable[int], kind: int) -> List[Tuple[int, int]]:
+    """[(person_id, id người kia)] của các person_ids theo kind (2 truy vấn, mỗi chiều 1 index)."""
+    ids = list(set(person_ids))
+    if not ids:
+        return []
+    pairs = db.query(PersonLink.person1_id, PersonLink.person2_id).filter(
+        PersonLink.person1_id.in_(ids), PersonLink.kind == kind
+    ).all()
+    pairs += [
+        (p2, p1) for p1, p2 in db.query(PersonLink.person1_id, PersonLink.person2_id).filter(
+            PersonLink.person2_id.in_(ids), PersonLink.kind == kind
+        ).all()
+    ]
+    return [tuple(pair) for pair in pairs]
+
+
+def linked_ids(db: Session, person_id: int, kind: int) -> List[int]:
+    """Id những người liên kết với person_id (1 câu OR, MySQL/SQLite gộp 2 index)."""
+    other = case((PersonLink.person1_id == person_id, PersonLink.person2_id), else_=PersonLink.person1_id)
+    return db.execute(select(other).where(
+        PersonLink.kind == kind,
+        (PersonLink.person1_id == person_id) | (PersonLink.person2_id == person_id)
+    )).scalars().all()
+
+
+def spouse_ids_of(db: Session, person_ids: Iterable[int]) -> Dict[int, List[int]]:
+    result: Dict[int, List[int]] = {}
+    for pid, other in linked_pairs(db, person_ids, LINK_SPOUSE):
+        result.setdefault(pid, []).append(other)
+    return result
+
+
+def has_link(db: Session, a: int, b: int, kind: int) -> bool:
+    p1, p2 = ordered_pair(a, b)
+    return db.query(PersonLink.person1_id).filter(
+        PersonLink.person1_id == p1, PersonLink.kind == kind, PersonLink.person2_id == p2
+    ).first() is not None
+
+
+def add_link(db: Session, a: int, b: int, kind: int) -> bool:
+    """Thêm liên kết nếu chưa có (chưa commit). Trả về True nếu vừa thêm."""
+    if a == b or has_link(db, a, b, kind):
+        return False
+    p1, p2 = ordered_pair(a, b)
+    db.add(PersonLink(person1_id=p1, person2_id=p2, kind=kind))
+    return True
+
+
+def delete_person_links(db: Session, person_id: int, kind: Optional[int] = None):
+    for column in (PersonLink.person1_id, PersonLink.person2_id):
+        query = db.query(PersonLink).filter(column == person_id)
+        if kind is not None:
+            query = query.filter(PersonLink.kind == kind)
+        query.delete(synchronize_session=False)
+
+
+def move_links(db: Session, from_id: int, to_id: int):
+    """Chuyển mọi liên kết của from_id sang to_id (gộp người trùng), bỏ liên kết tự trỏ / đã có."""
+    rows = db.query(PersonLink.person1_id, PersonLink.person2_id, PersonLink.kind).filter(
+        (PersonLink.person1_id == from_id) | (PersonLink.person2_id == from_id)
+    ).all()
+    delete_person_links(db, from_id)
+    db.flush()
+    for p1, p2, kind in rows:
+        other = p2 if p1 == from_id else p1
+        add_link(db, to_id, other, kind)
+
+
+# ----- Nhãn tiếng Việt (tính khi đọc) -----
+
+def parent_label(gender) -> str:
+    return "mẹ" if gender == 'female' else "bố"
+
+
+def child_label(gender) -> str:
+    return "con trai" if gender == 'male' else "con gái"
+
+
+def spouse_label(gender) -> str:
+    return "chồng" if gender == 'male' else "vợ"
+
+
+def sibling_label(gender, older: bool, full: bool) -> str:
+    suffix = " ruột" if full else ""
+    if older:
+        return ("anh" if gender == 'male' else "chị") + suffix
+    return "em" + suffix + (" trai" if gender == 'male' else " gái")
+
+
+def age_key(person):
+    # Lớn tuổi trước; không có ngày sinh thì xếp sau, theo id (id nhỏ thường nhập trước)
+    return (person.date_of_birth or date.max, person.id)
+
+
+def describe_relation(a, b, spouses: bool = False) -> Optional[str]:
+    """a là gì của b (a, b có gender, date_of_birth, father_id, mother_id). spouses: 2 người có liên kết vợ/chồng."""
+    if a.id in (b.father_id, b.mother_id):
+        return parent_label(a.gender)
+    if b.id in (a.father_id, a.mother_id):
+        return child_label(a.gender)
+    if spouses:
+        return spouse_label(a.gender)
+    same_father = a.father_id and a.father_id == b.father_id
+    same_mother = a.mother_id and a.mother_id == b.mother_id
+    if same_father or same_mother:
+        full = bool(same_father and same_mother)
+        return sibling_label(a.gender, age_key(a) < age_key(b), full)
+    return None
+
+
+def relation_label(db: Session, a: Person, b: Person) -> Optional[str]:
+    """Quan hệ trực tiếp: a là gì của b (bố, mẹ, con, vợ/chồng, anh/chị/em), None nếu không trực tiếp."""
+    return describe_relation(a, b, spouses=has_link(db, a.id, b.id, LINK_SPOUSE))
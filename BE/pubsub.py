@@ -0,0 +1,104 @@
+"""
+Pub/sub cho sự kiện theo gia phả (tin nhắn chat, delta cây...) giữa các worker / máy chủ.
+
+ConnectionManager của mỗi worker chỉ giữ socket của chính nó. broadcast không gửi thẳng mà
+publish lên bus theo kênh "<loại>:<family_id>" (VD "chat:12"); worker nào đang có người kết nối
+tới family đó thì subscribe kênh và tự gửi tới socket của mình.
+
+  PUBSUB_URL không đặt / memory://      -> InProcessBus: chỉ trong 1 process (uvicorn 1 worker)
+  PUBSUB_URL=redis://localhost:6379/0   -> RedisBus (cần `pip install redis`), dùng được với
+  PUBSUB_URL=unix:///run/redis.sock        server tương thích Redis (Redis, Valkey, KeyDB...)
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict
+
+# handler(channel, data): data là JSON đã encode sẵn (str)
+Handler = Callable[[str, str], Awaitable[None]]
+
+
+class InProcessBus:
+    """Gọi thẳng handler của process hiện tại."""
+    distributed = False
+
+    def __init__(self):
+        self.handlers: Dict[str, Handler] = {}
+
+    async def publish(self, channel: str, data: str):
+        handler = self.handlers.get(channel)
+        if handler:
+            await handler(channel, data)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self.handlers[channel] = handler
+
+    async def unsubscribe(self, channel: str):
+        self.handlers.pop(channel, None)
+
+    async def close(self):
+        self.handlers.clear()
+
+
+class RedisBus:
+    """
+    PUBLISH/SUBSCRIBE của Redis. Mọi worker (kể cả worker gửi) nhận tin qua Redis nên thứ tự tin
+    của 1 kênh giống nhau ở mọi nơi. 1 kết nối subscribe / worker, 1 task đọc chuyển tin tới handler.
+    """
+    distributed = True
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # optional dependency, chỉ cần khi dùng RedisBus
+        self.client = redis.from_url(url, decode_responses=True)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.handlers: Dict[str, Handler] = {}
+        self.reader = None
+
+    async def publish(self, channel: str, data: str):
+        await self.client.publish(channel, data)
+
+    async def subscribe(self, channel: str, handler: Handler):
+        self.handlers[channel] = handler
+        await self.pubsub.subscribe(channel)
+        if self.reader is None or self.reader.done():
+            self.reader = asyncio.create_task(self._read_loop())
+
+    async def unsubscribe(self, channel: str):
+        self.handlers.pop(channel, None)
+        await self.pubsub.unsubscribe(channel)
+
+    async def _read_loop(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+                if message is None:
+                    continue
+                handler = self.handlers.get(message["channel"])
+                if handler:
+                    await handler(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Mất kết nối Redis: chờ rồi subscribe lại các kênh đang giữ
+                print(f"PubSub read error: {e}")
+                await asyncio.sleep(1)
+                try:
+                    if self.handlers:
+                        await self.pubsub.subscribe(*self.handlers)
+                except Exception as resubscribe_error:
+                    print(f"PubSub resubscribe error: {resubscribe_error}")
+
+    async def close(self):
+        if self.reader:
+            self.reader.cancel()
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+
+def create_bus(url: str = None):
+    url = url or os.getenv("PUBSUB_URL") or "memory://"
+    if url.startswith("memory://"):
+        return InProcessBus()
+    return RedisBus(url)
+
+
+bus = create_bus()
@@ -0,0 +1,131 @@
+"""
+Tin chưa đọc của từng (user, family): con trỏ đã đọc + bộ đếm cập nhật dần, không đếm lại messages.
+
+Bảng chat_read_state, mỗi (user_id, family_id) 1 dòng:
+  last_read_message_id  tin mới nhất user đã xem (client ack qua POST /families/{id}/chat/read)
+  unread_count          số tin sau con trỏ do người khác gửi
+
+  - Ghi tin: chat_writer gọi count_new_messages() trong cùng transaction với lô tin -> mỗi family
+    trong lô 1 câu UPDATE cộng số tin mới (trừ tin của chính người nhận).
+  - Ack: đếm lại các tin sau mốc mới (range trên idx_messages_family_created, thường chỉ vài dòng)
+    nên lệch đếm (nếu có do ack và ghi tin chạy chồng nhau) tự hết ở lần ack sau.
+  - Đọc: unread_summary() 1 query cho mọi gia phả của user (gia phả sở hữu + gia phả là thành viên).
+
+Dòng được tạo lần đầu user hỏi số chưa đọc / ack của gia phả đó, coi như đã đọc tới tin mới nhất
+lúc đó (thành viên mới không bị báo hàng nghìn tin cũ).
+"""
+from collections import Counter, defaultdict
+from typing import Iterable, List
+
+from sqlalchemy import and_, case, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import ChatReadState, Family, Message, Person
+
+
+def count_new_messages(db: Session, messages: Iterable[dict]):
+    """Cộng unread_count cho mọi người đọc của các family có tin mới (tin đã flush, chưa commit)."""
+    per_family = defaultdict(Counter)  # family_id -> {sender_id: số tin}
+    for m in messages:
+        per_family[m["family_id"]][m["sender_id"]] += 1
+    for family_id, senders in per_family.items():
+        total = sum(senders.values())
+        own = case(dict(senders), value=ChatReadState.user_id, else_=0)
+        db.execute(
+            update(ChatReadState)
+            .where(ChatReadState.family_id == family_id)
+            .values(unread_count=ChatReadState.unread_count + total - own)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def latest_message_id(db: Session, family_id: int) -> int:
+    row = db.execute(
+        select(Message.id).where(Message.family_id == family_id)
+        .order_by(Message.created_at.desc(), Message.id.desc()).limit(1)
+    ).first()
+    return row[0] if row else 0
+
+
+def seed_read_states(db: Session, user_id: int, family_ids: List[int]):
+    """Tạo dòng chat_read_state còn thiếu (đã đọc tới tin mới nhất, 0 chưa đọc), có commit."""
+    if not family_ids:
+        return
+    db.add_all([
+        ChatReadState(user_id=user_id, family_id=fid, last_read_message_id=latest_message_id(db, fid), unread_count=0)
+        for fid in family_ids
+    ])
+    try:
+        db.commit()
+    except IntegrityError:
+        # Request khác của cùng user vừa tạo trước
+        db.rollback()
+
+
+def unread_summary(db: Session, user_id: int) -> dict:
+    """Số tin chưa đọc của mọi gia phả của user."""
+    member_of = select(Person.family_id).where(Person.user_id == user_id)
+    rows = db.execute(
+        select(Family.id, Family.name, ChatReadState.unread_count, ChatReadState.last_read_message_id)
+        .outerjoin(ChatReadState, and_(ChatReadState.family_id == Family.id, ChatReadState.user_id == user_id))
+        .where(or_(Family.owner_id == user_id, Family.id.in_(member_of)))
+        .order_by(Family.id)
+    ).all()
+    missing = [row.id for row in rows if row.unread_count is None]
+    seed_read_states(db, user_id, missing)
+    seeded = {}
+    if missing:
+        seeded = dict(db.execute(
+            select(ChatReadState.family_id, ChatReadState.last_read_message_id)
+            .where(ChatReadState.user_id == user_id, ChatReadState.family_id.in_(missing))
+        ).all())
+
+    families = [
+        {
+            "family_id": row.id,
+            "name": row.name,
+            "unread": row.unread_count or 0,
+            "last_read_message_id": row.last_read_message_id if row.unread_count is not None else seeded.get(row.id, 0),
+        }
+        for row in rows
+    ]
+    return {"total": sum(f["unread"] for f in families), "families": families}
+
+
+def mark_read(db: Session, user_id: int, family_id: int, cursor) -> dict:
+    """
+    Đánh dấu đã đọc tới tin cursor = (created_at, id) (đã kiểm tra thuộc family). Con trỏ chỉ tiến,
+    ack tin cũ hơn (VD máy khác gửi chậm) không làm tăng lại số chưa đọc. Có commit.
+    """
+    created_at, message_id = cursor
+    state = db.get(ChatReadState, (user_id, family_id))
+    if state is not None and state.last_read_message_id >= message_id:
+        return {"family_id": family_id, "unread": state.unread_count, "last_read_message_id": state.last_read_message_id}
+
+    unread = db.execute(
+        select(func.count()).select_from(Message).where(
+            Message.family_id == family_id,
+            or_(Message.created_at > created_at, and_(Message.created_at == created_at, Message.id > message_id)),
+            Message.sender_id != user_id,
+        )
+    ).scalar()
+    if state is None:
+        state = ChatReadState(user_id=user_id, family_id=family_id)
+        db.add(state)
+    state.last_read_message_id = message_id
+    state.unread_count = unread
+    try:
+        db.commit()
+    except IntegrityError:
+        # Dòng vừa được tạo bởi request khác: ghi đè lên dòng đó
+        db.rollback()
+        db.execute(
+            update(ChatReadState)
+            .where(ChatReadState.user_id == user_id, ChatReadState.family_id == family_id,
+                   ChatReadState.last_read_message_id < message_id)
+            .values(last_read_message_id=message_id, unread_count=unread)
+        )
+        db.commit()
+        state = db.get(ChatReadState, (user_id, family_id), populate_existing=True)
+    return {"family_id": family_id, "unread": state.unread_count, "last_read_message_id": state.last_read_message_id}
@@ -0,0 +1,94 @@
+"""
+Sinh liên kết anh chị em (person_links, kind = LINK_SIBLING) từ father_id/mother_id theo tập.
+
+Thay vì mỗi người query anh chị em rồi kiểm tra tồn tại từng cặp, gom nhóm theo father_id/mother_id
+một lần, mỗi cặp (không hướng) một dòng, rồi insert phần còn thiếu / xóa phần sai bằng lệnh theo lô.
+Thứ tự anh/chị/em và ruột/cùng cha khác mẹ không lưu, tính khi đọc (person_links.describe_relation).
+"""
+from collections import defaultdict
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Person, PersonLink
+from person_links import LINK_SIBLING, ordered_pair
+
+INSERT_BATCH_SIZE = 5000
+
+
+def derive_sibling_pairs(rows, only_ids: Optional[Set[int]] = None) -> Set[Tuple[int, int]]:
+    """
+    rows: (id, father_id, mother_id). Trả về tập cặp (id nhỏ, id lớn) chung cha hoặc chung mẹ.
+    only_ids: chỉ lấy cặp có ít nhất 1 người thuộc tập này (dùng khi thêm/sửa thành viên).
+    """
+    groups = defaultdict(list)
+    for r in rows:
+        if r.father_id:
+            groups[("f", r.father_id)].append(r.id)
+        if r.mother_id:
+            groups[("m", r.mother_id)].append(r.id)
+
+    pairs = set()
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        for i, a in enumerate(members):
+            for b in members[i + 1:]:
+                if only_ids is None or a in only_ids or b in only_ids:
+                    pairs.add(ordered_pair(a, b))
+    return pairs
+
+
+def _apply(db: Session, wanted: Set[Tuple[int, int]], existing: Set[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    missing = sorted(wanted - existing)
+    stale = list(existing - wanted)
+    for start in range(0, len(missing), INSERT_BATCH_SIZE):
+        db.bulk_insert_mappings(PersonLink, [
+            {"person1_id": p1, "person2_id": p2, "kind": LINK_SIBLING}
+            for p1, p2 in missing[start:start + INSERT_BATCH_SIZE]
+        ])
+    for p1, p2 in stale:
+        db.query(PersonLink).filter(
+            PersonLink.person1_id == p1, PersonLink.kind == LINK_SIBLING, PersonLink.person2_id == p2
+        ).delete(synchronize_session=False)
+    return missing
+
+
+def sync_person_relationships(db: Session, person_ids: Iterable[int]) -> List[Tuple[int, int]]:
+    """
+    Đồng bộ liên kết anh chị em của person_ids theo cha/mẹ hiện tại (chưa commit, cần flush trước).
+    Chỉ load những người chung cha/mẹ với họ. Trả về các cặp vừa thêm.
+    """
+    ids = {pid for pid in person_ids if pid}
+    if not ids:
+        return []
+    people = db.query(Person.id, Person.father_id, Person.mother_id).filter(Person.id.in_(ids)).all()
+    parent_ids = {pid for r in people for pid in (r.father_id, r.mother_id) if pid}
+    if parent_ids:
+        people += db.query(Person.id, Person.father_id, Person.mother_id).filter(
+            Person.father_id.in_(parent_ids) | Person.mother_id.in_(parent_ids)
+        ).all()
+    rows = list({r.id: r for r in people}.values())
+
+    wanted = derive_sibling_pairs(rows, only_ids=ids)
+    existing = {
+        (p1, p2) for p1, p2 in db.query(PersonLink.person1_id, PersonLink.person2_id).filter(
+            PersonLink.kind == LINK_SIBLING,
+            PersonLink.person1_id.in_(ids) | PersonLink.person2_id.in_(ids)
+        ).all()
+    }
+    return _apply(db, wanted, existing)
+
+
+def regenerate_relationships(db: Session, family_id: Optional[int] = None) -> int:
+    """Sinh lại liên kết anh chị em của toàn bộ (hoặc 1 family) theo cha/mẹ (chưa commit). Trả về số cặp thêm."""
+    query = db.query(Person.id, Person.father_id, Person.mother_id)
+    if family_id is not None:
+        query = query.filter(Person.family_id == family_id)
+    wanted = derive_sibling_pairs(query.all())
+
+    existing_query = db.query(PersonLink.person1_id, PersonLink.person2_id).filter(PersonLink.kind == LINK_SIBLING)
+    if family_id is not None:
+        existing_query = existing_query.join(Person, Person.id == PersonLink.person1_id).filter(Person.family_id == family_id)
+    existing = {(p1, p2) for p1, p2 in existing_query.yield_per(50000)}
+    return len(_apply(db, wanted, existing))
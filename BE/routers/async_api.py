@@ -0,0 +1,133 @@
+# routers/async_api.py
+"""
+Bản async của các endpoint nóng, chỉ đăng ký khi ASYNC_DB=1 (main.py include router này TRƯỚC
+các router sync nên cùng path thì bản async được khớp trước):
+
+  GET  /members/{family_id}                   danh sách thành viên
+  GET  /members/{family_id}/tree              cây gia phả (Neo4j async)
+  POST /members/path                          quan hệ giữa 2 người (Neo4j async)
+  GET  /families/{family_id}/chat/messages    lịch sử chat
+
+Handler async không chiếm luồng của threadpool khi chờ MySQL/Neo4j, nên số request đồng thời
+chỉ còn bị giới hạn bởi pool kết nối. Logic dùng chung với bản sync: helper sync (quyền truy cập,
+delta cây...) chạy trên AsyncSession qua run_sync; riêng mô tả quan hệ có thể gọi Neo4j bản sync
+nên chạy trên threadpool với session sync riêng. Response giữ nguyên.
+"""
+from typing import List, Optional, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from db.async_connection import get_async_db
+from db.mysql_connection import SessionLocal
+from db.neo4j_connection import find_shortest_path_async, get_family_graph_async
+from dependencies import session_user_id
+from fast_json import FastJSONResponse
+from models import Person
+from schemas import MessageRead, PersonRead, TreeDeltaResponse, TreeResponse
+from tree_delta import get_changes_since, get_tree_version
+from user_cache import load_user, load_users
+from routers.members import (
+    PERSON_READ_COLUMNS, person_row_to_dict, verify_family_access, build_tree_payload,
+    build_delta_payload, describe_relationship_path,
+)
+from routers.chat import check_history_cursors, cursor_statement, history_statement, history_page
+
+router = APIRouter()
+
+
+async def get_current_user_async(request: Request, db: AsyncSession = Depends(get_async_db)):
+    user_id = session_user_id(request)
+    # Cache hit không chạm DB; miss thì query trên kết nối async
+    user = await db.run_sync(load_user, user_id)
+    if not user:
+        raise HTTPException(status_code=401, detail="Người dùng không tồn tại")
+    return user
+
+
+@router.get("/members/{family_id}", response_model=List[PersonRead], tags=["Members"])
+async def get_members_by_family(
+    family_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_user_async)
+):
+    await db.run_sync(verify_family_access, current_user, family_id)
+    rows = (await db.execute(select(*PERSON_READ_COLUMNS).where(Person.family_id == family_id))).all()
+    return FastJSONResponse([person_row_to_dict(r) for r in rows])
+
+
+@router.get("/members/{family_id}/tree", response_model=Union[TreeResponse, TreeDeltaResponse], tags=["Members"])
+async def get_family_tree(
+    family_id: int,
+    request: Request,
+    since: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user=Depends(get_current_user_async)
+):
+    base_url = str(request.base_url).rstrip('/')
+
+    if since is not None:
+        version, changes = await db.run_sync(get_changes_since, family_id, since)
+        if changes is not None:
+            return FastJSONResponse(build_delta_payload(version, since, changes, base_url))
+    else:
+        version = await db.run_sync(get_tree_version, family_id)
+
+    graph_data = await get_family_graph_async(family_id)
+    payload = build_tree_payload(graph_data['nodes'], graph_data['edges'], base_url)
+    payload["version"] = version
+    return FastJSONResponse(payload)
+
+
+def _describe_path(nodes, rels):
+    db = SessionLocal()
+    try:
+        return describe_relationship_path(db, nodes, rels)
+    finally:
+        db.close()
+
+
+@router.post("/members/path", tags=["Members"])
+async def find_relationship_path(
+    data: dict, # {from_id: int, to_id: int}
+    current_user=Depends(get_current_user_async)
+):
+    from_id = data.get("from_id")
+    to_id = data.get("to_id")
+    if not from_id or not to_id:
+        raise HTTPException(status_code=400, detail="Missing from_id or to_id")
+
+    path = await find_shortest_path_async(from_id, to_id)
+    if not path:
+        return {"relationship": "Không tìm thấy mối quan hệ"}
+
+    # Phần diễn giải chỉ tra vài Person theo id, nhưng nhánh "bác/chú họ" còn gọi find_shortest_path
+    # bản sync (chặn) bên trong -> chạy cả phần diễn giải trên threadpool, không chặn event loop
+    return await run_in_threadpool(_describe_path, path['nodes'], path['rels'])
+
+
+@router.get("/families/{family_id}/chat/messages", response_model=List[MessageRead], tags=["chat"])
+async def get_chat_history(
+    family_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    skip: int = Query(0, ge=0),
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    check_history_cursors(before_id, after_id)
+    cursor = None
+    if before_id is not None or after_id is not None:
+        cursor = (await db.execute(cursor_statement(family_id, before_id or after_id))).first()
+        if cursor is None:
+            raise HTTPException(status_code=404, detail="Không tìm thấy tin nhắn làm mốc")
+
+    rows = (await db.execute(history_statement(
+        family_id, limit, skip,
+        before=tuple(cursor) if before_id is not None else None,
+        after=tuple(cursor) if after_id is not None else None,
+    ))).all()
+    senders = await db.run_sync(load_users, [row.sender_id for row in rows])
+    return FastJSONResponse(history_page(rows, senders, newer=after_id is not None))
@@ -1,3 +1,4 @@
+import time
 from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
@@ -6,17 +7,21 @@ from models import User
 from pydantic import BaseModel
 from typing import Optional
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
-from passlib.context import CryptContext
+from itsdangerous.encoding import base64_decode, bytes_to_int
+from starlette.requests import cookie_parser
+from starlette.concurrency import run_in_threadpool
 from fastapi import FastAPI
 from dependencies import get_current_user
+from user_cache import load_user, invalidate_user
+from passwords import verify_password, PasswordQueueFull
 
 # =====================
 # ⚙️ Cấu hình
 # =====================
 SECRET_KEY = "your-secret-key"  # Nên lưu trong file .env
 SESSION_EXPIRE_SECONDS = 3600   # 1 giờ
+SESSION_RENEW_AFTER = SESSION_EXPIRE_SECONDS // 2   # token sống quá nửa đời mới ký lại
 serializer = URLSafeTimedSerializer(SECRET_KEY)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -32,52 +37,85 @@ class LoginRequest(BaseModel):
 # =====================
 # 🔐 Middleware gia hạn session
 # =====================
+def session_issued_at(token: str) -> Optional[int]:
+    """Thời điểm ký token (giây) đọc thẳng từ phần timestamp, KHÔNG kiểm HMAC - chỉ dùng để quyết định
+    có cần gia hạn hay không; token giả mạo tới bước gia hạn vẫn bị serializer.loads chặn."""
+    parts = token.rsplit(".", 2)
+    if len(parts) != 3:
+        return None
+    try:
+        return bytes_to_int(base64_decode(parts[1]))
+    except Exception:
+        return None
+
+
+def renew_session_token(token: str, now: Optional[float] = None) -> Optional[str]:
+    """Token mới nếu token hợp lệ đã sống quá SESSION_RENEW_AFTER giây, ngược lại None."""
+    issued_at = session_issued_at(token)
+    if issued_at is None:
+        return None
+    age = (now or time.time()) - issued_at
+    if age < SESSION_RENEW_AFTER or age > SESSION_EXPIRE_SECONDS:
+        return None
+    try:
+        data = serializer.loads(token, max_age=SESSION_EXPIRE_SECONDS)
+    except (BadSignature, SignatureExpired):
+        return None
+    return serializer.dumps({"user_id": data["user_id"], "role": data["role"]})
+
+
+def session_cookie_header(token: str) -> bytes:
+    # Cùng thuộc tính với cookie lúc đăng nhập (httponly, lax, path /; secure=False khi chưa có HTTPS)
+    return f"user_session={token}; HttpOnly; Max-Age={SESSION_EXPIRE_SECONDS}; Path=/; SameSite=lax".encode()
+
+
+class SessionRenewalMiddleware:
+    """
+    Gia hạn session kiểu trượt nhưng chỉ khi cần: token còn trẻ hơn SESSION_RENEW_AFTER thì không
+    verify, không ký lại, không gửi Set-Cookie (trường hợp thường gặp). Middleware ASGI thuần,
+    không qua BaseHTTPMiddleware nên không tốn thêm task/stream cho mỗi request.
+    Response tự đặt user_session (login/logout) thì giữ nguyên, không ghi đè.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"cookie" and b"user_session=" in value:
+                token = cookie_parser(value.decode("latin-1")).get("user_session")
+                break
+        new_token = renew_session_token(token) if token else None
+        if new_token is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                if not any(k == b"set-cookie" and v.startswith(b"user_session=") for k, v in headers):
+                    message["headers"] = list(headers) + [(b"set-cookie", session_cookie_header(new_token))]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
 def setup_session_middleware(app: FastAPI):
-    @app.middleware("http")
-    async def refresh_session_if_valid(request: Request, call_next):
-        response = await call_next(request)
-        token = request.cookies.get("user_session")
-        if token:
-            try:
-                data = serializer.loads(token, max_age=SESSION_EXPIRE_SECONDS)
-                # Reset thời gian sống cookie (gia hạn khi người dùng thao tác)
-                new_token = serializer.dumps(
-                    {"user_id": data["user_id"], "role": data["role"]}
-                )
-                response.set_cookie(
-                    key="user_session",
-                    value=new_token,
-                    httponly=True,
-                    max_age=SESSION_EXPIRE_SECONDS,
-                    samesite="lax",
-                    secure=False,  # Bật True nếu dùng HTTPS
-                    path="/"
-                )
-            except (BadSignature, SignatureExpired):
-                pass
-        return response
+    app.add_middleware(SessionRenewalMiddleware)
 
 
 # =====================
 # 🧭 Helper kiểm tra quyền
 # =====================
 def require_roles(allowed_roles: list[str]):
-    """Decorator kiểm tra quyền từ cookie session."""
-    def wrapper(request: Request, db: Session = Depends(get_db)):
-        token = request.cookies.get("user_session")
-        if not token:
-            raise HTTPException(status_code=401, detail="Chưa đăng nhập")
-
-        try:
-            data = serializer.loads(token, max_age=SESSION_EXPIRE_SECONDS)
-            user = db.query(User).filter(User.id == data["user_id"]).first()
-            if not user or user.role not in allowed_roles:
-                raise HTTPException(status_code=403, detail="Không có quyền truy cập")
-            return user
-        except SignatureExpired:
-            raise HTTPException(status_code=401, detail="Phiên đăng nhập đã hết hạn")
-        except BadSignature:
-            raise HTTPException(status_code=401, detail="Phiên không hợp lệ")
+    """Dependency kiểm tra quyền (token Bearer hoặc cookie session, như get_current_user)."""
+    def wrapper(user=Depends(get_current_user)):
+        if user.role not in allowed_roles:
+            raise HTTPException(status_code=403, detail="Không có quyền truy cập")
+        return user
     return wrapper
 
 
@@ -85,11 +123,28 @@ def require_roles(allowed_roles: list[str]):
 # 🔑 Đăng nhập
 # =====================
 @router.post("/login")
-def login(data: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.username == data.username).first()
-    if not user or not pwd_context.verify(data.password, user.password_hash):
+async def login(data: LoginRequest, db: Session = Depends(get_db)):
+    # async: chờ bcrypt trên executor riêng (passwords.py) không giữ luồng của threadpool;
+    # truy vấn DB vẫn đẩy sang threadpool để không chặn event loop
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.username == data.username).first())
+    try:
+        valid, new_hash = await verify_password(data.password, user.password_hash if user else None)
+    except PasswordQueueFull:
+        raise HTTPException(status_code=503, detail="Hệ thống đang bận, vui lòng thử lại", headers={"Retry-After": "1"})
+    if not valid:
         raise HTTPException(status_code=401, detail="Sai tên đăng nhập hoặc mật khẩu")
 
+    if new_hash:
+        # Hash cũ (cost/thuật toán khác cấu hình hiện tại) -> lưu hash mới, lỗi cũng không chặn đăng nhập
+        def save_new_hash():
+            try:
+                user.password_hash = new_hash
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"DEBUG: Rehash failed for user {user.id}: {e}")
+        await run_in_threadpool(save_new_hash)
+
     token = serializer.dumps({"user_id": user.id, "role": user.role})
     response = JSONResponse(content={
         "message": "Đăng nhập thành công",
@@ -150,7 +205,8 @@ class ProfileUpdateRequest(BaseModel):
 
 @router.put("/profile")
 def update_profile(data: ProfileUpdateRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    user = current_user
+    # current_user là bản chụp chỉ đọc (user_cache) -> query lại để sửa
+    user = db.query(User).filter(User.id == current_user.id).first()
     
     # Update fields
     if data.first_name is not None:
@@ -175,6 +231,7 @@ def update_profile(data: ProfileUpdateRequest, db: Session = Depends(get_db), cu
         
     db.commit()
     db.refresh(user)
+    invalidate_user(user.id)
     
     return {
         "user_id": user.id,
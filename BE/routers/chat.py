@@ -1,12 +1,20 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query, HTTPException
+from sqlalchemy import select, or_, and_
 from sqlalchemy.orm import Session
-from typing import List, Dict
+from typing import List, Dict, Optional
+from datetime import date
+import asyncio
 import json
-from datetime import datetime
-from db.mysql_connection import get_db
+from db.mysql_connection import get_db, SessionLocal
+from chat_writer import chat_writer
 from models import Message, User
-from schemas import MessageRead
-from dependencies import serializer, SESSION_EXPIRE_SECONDS
+from schemas import MessageRead, MessageSearchPage, ChatReadAck, ChatReadStateRead, ChatUnreadSummary
+from fast_json import FastJSONResponse, dumps
+from pubsub import bus as pubsub_bus
+from dependencies import serializer, SESSION_EXPIRE_SECONDS, get_current_user
+from user_cache import load_user, load_users
+from chat_search import query_terms, search_statement, highlight
+from read_state import unread_summary, mark_read
 from itsdangerous import SignatureExpired, BadSignature
 
 router = APIRouter(
@@ -14,45 +22,152 @@ router = APIRouter(
     tags=["chat"]
 )
 
+# Mỗi socket có hàng đợi gửi riêng + 1 task ghi: broadcast chỉ đẩy vào hàng đợi rồi trả về ngay,
+# máy chậm (mạng yếu) không làm chậm tin nhắn của cả gia đình.
+SEND_QUEUE_SIZE = 100      # tin chờ gửi tối đa / socket; đầy -> coi là client quá chậm, ngắt
+SEND_TIMEOUT_SECONDS = 10  # 1 lần gửi kẹt lâu hơn thế (phát hiện ở lần broadcast sau) -> coi như socket chết, ngắt
+
+
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, family_id: int):
+        self.websocket = websocket
+        self.family_id = family_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.writer: Optional[asyncio.Task] = None
+        self.sending_since: Optional[float] = None  # loop.time() lúc bắt đầu lần gửi đang dở
+
+
 class ConnectionManager:
-    def __init__(self):
-        # family_id -> List[WebSocket]
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+    """
+    Socket của worker này theo family. broadcast publish lên pubsub.bus (kênh "<channel>:<family_id>");
+    worker nào có socket của family đó subscribe kênh và gửi cho socket của mình (_deliver),
+    nên chạy nhiều worker / nhiều máy vẫn nhận được tin của nhau (xem pubsub.py).
+    """
+
+    def __init__(self, channel: str = "chat", bus=None):
+        self.channel = channel
+        self.bus = bus or pubsub_bus
+        # family_id -> {WebSocket: ClientConnection}
+        self.active_connections: Dict[int, Dict[WebSocket, ClientConnection]] = {}
+        self.evicted = 0
+
+    def _channel(self, family_id: int) -> str:
+        return f"{self.channel}:{family_id}"
 
     async def connect(self, websocket: WebSocket, family_id: int):
         await websocket.accept()
-        if family_id not in self.active_connections:
-            self.active_connections[family_id] = []
-        self.active_connections[family_id].append(websocket)
+        client = ClientConnection(websocket, family_id)
+        client.writer = asyncio.create_task(self._write_loop(client))
+        first = family_id not in self.active_connections
+        self.active_connections.setdefault(family_id, {})[websocket] = client
+        if first:
+            try:
+                await self.bus.subscribe(self._channel(family_id), self._on_message)
+            except Exception:
+                # Không subscribe được kênh: gỡ client này (dừng task ghi), socket khác của family vào
+                # trong lúc chờ cũng chưa có kênh -> ngắt để client tự kết nối lại và subscribe lại
+                self.disconnect(websocket, family_id)
+                for other in list(self.active_connections.get(family_id, {}).values()):
+                    self._evict(other, "pubsub subscribe failed")
+                await self._close(websocket)
+                raise
         print(f"WS Connected to family {family_id}. Total: {len(self.active_connections[family_id])}")
 
-    def disconnect(self, websocket: WebSocket, family_id: int):
+    def _remove(self, websocket: WebSocket, family_id: int) -> Optional[ClientConnection]:
+        clients = self.active_connections.get(family_id)
+        if not clients:
+            return None
+        client = clients.pop(websocket, None)
+        if not clients:
+            del self.active_connections[family_id]
+            asyncio.ensure_future(self._unsubscribe_if_idle(family_id))
+        return client
+
+    async def _unsubscribe_if_idle(self, family_id: int):
+        # Có thể đã có socket mới của family này kết nối lại trong lúc chờ
         if family_id in self.active_connections:
-            if websocket in self.active_connections[family_id]:
-                self.active_connections[family_id].remove(websocket)
-                if not self.active_connections[family_id]:
-                    del self.active_connections[family_id]
+            return
+        try:
+            await self.bus.unsubscribe(self._channel(family_id))
+        except Exception as e:
+            print(f"PubSub unsubscribe error: {e}")
+
+    def disconnect(self, websocket: WebSocket, family_id: int):
+        client = self._remove(websocket, family_id)
+        if client:
+            if client.writer and client.writer is not asyncio.current_task():
+                client.writer.cancel()
             print(f"WS Disconnected from family {family_id}")
 
+    def _evict(self, client: ClientConnection, reason: str):
+        """Ngắt client chậm/chết: bỏ khỏi danh sách ngay, đóng socket ở background."""
+        if self._remove(client.websocket, client.family_id) is None:
+            return
+        self.evicted += 1
+        print(f"WS evicted from family {client.family_id}: {reason}")
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        asyncio.ensure_future(self._close(client.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            # 1013 Try Again Later: client tự kết nối lại và tải lịch sử
+            await asyncio.wait_for(websocket.close(code=1013), SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+    async def _write_loop(self, client: ClientConnection):
+        # Không bọc wait_for từng lần gửi (tốn 1 task/tin); broadcast kiểm tra sending_since thay thế
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                text = await client.queue.get()
+                client.sending_since = loop.time()
+                await client.websocket.send_text(text)
+                client.sending_since = None
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self._evict(client, f"send error: {e}")
+
     async def broadcast(self, message: dict, family_id: int):
-        if family_id in self.active_connections:
-            # Copy list to avoid modification during iteration issues
-            connections = list(self.active_connections[family_id])
-            for connection in connections:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    print(f"Error sending message: {e}")
-                    # Could optionally remove dead connection here
+        # Encode 1 lần cho cả gia đình thay vì send_json (json.dumps) cho từng socket
+        text = dumps(message).decode("utf-8")
+        if not self.bus.distributed and family_id not in self.active_connections:
+            return
+        try:
+            await self.bus.publish(self._channel(family_id), text)
+        except Exception as e:
+            # Bus lỗi (mất kết nối Redis): ít nhất người trên worker này vẫn nhận được
+            print(f"PubSub publish error: {e}")
+            self._deliver(family_id, text)
 
-manager = ConnectionManager()
+    async def _on_message(self, channel: str, text: str):
+        self._deliver(int(channel.rsplit(":", 1)[1]), text)
+
+    def _deliver(self, family_id: int, text: str):
+        """Đẩy tin vào hàng đợi của từng socket của family trên worker này."""
+        clients = self.active_connections.get(family_id)
+        if not clients:
+            return
+        now = asyncio.get_running_loop().time()
+        for client in list(clients.values()):
+            if client.sending_since is not None and now - client.sending_since > SEND_TIMEOUT_SECONDS:
+                self._evict(client, "send timeout")
+                continue
+            try:
+                client.queue.put_nowait(text)
+            except asyncio.QueueFull:
+                self._evict(client, "send queue full")
+
+manager = ConnectionManager("chat")
 
 def get_user_from_token(token: str, db: Session):
     try:
         # Debugging
         print(f"Attempting to verify token: {token[:10]}...") 
         data = serializer.loads(token, max_age=SESSION_EXPIRE_SECONDS)
-        user = db.query(User).filter(User.id == data["user_id"]).first()
+        user = load_user(db, data["user_id"])
         if user:
             print(f"User verified: {user.username}")
         else:
@@ -68,68 +183,88 @@ def get_user_from_token(token: str, db: Session):
         print(f"Token verification error: {e}")
         return None
 
+MAX_CONTENT_LENGTH = 10000  # ký tự; TEXT của MySQL tối đa 65535 byte (utf8mb4 tới 4 byte/ký tự)
+MESSAGE_TYPE_LENGTH = 20    # messages.message_type VARCHAR(20)
+
+
+def clean_message(message_data):
+    """(content, message_type) đã kiểm tra + cắt độ dài trước khi vào lô ghi; tin không hợp lệ -> (None, None)."""
+    if not isinstance(message_data, dict):
+        return None, None
+    content = message_data.get("content")
+    if not isinstance(content, str) or not content:
+        return None, None
+    msg_type = message_data.get("message_type")
+    if not isinstance(msg_type, str) or not msg_type:
+        msg_type = "text"
+    return content[:MAX_CONTENT_LENGTH], msg_type[:MESSAGE_TYPE_LENGTH]
+
+
+def live_message_payload(row: dict, user) -> dict:
+    """Tin vừa lưu gửi qua WebSocket (như MessageRead + author cho UI chat)."""
+    return {
+        "id": row["id"],
+        "family_id": row["family_id"],
+        "sender_id": row["sender_id"],
+        "content": row["content"],
+        "created_at": row["created_at"].isoformat(),
+        "message_type": row["message_type"],
+        "sender_name": sender_display_name(user),
+        # "sender_avatar": user.avatar_url # If User had avatar
+        "author": {
+            "id": str(user.id),
+            "firstName": user.first_name,
+            "lastName": user.last_name,
+            "imageUrl": None # Placeholder
+        }
+    }
+
+
+# Task broadcast đang chờ lô ghi (giữ tham chiếu để task không bị GC giữa chừng)
+_pending_broadcasts = set()
+
+
+async def broadcast_when_saved(saved: asyncio.Future, user, family_id: int):
+    try:
+        row = await saved
+    except Exception as e:
+        print(f"Error saving message: {e}")
+        return
+    await manager.broadcast(live_message_payload(row, user), family_id)
+
+
 @router.websocket("/{family_id}/chat")
 async def websocket_endpoint(
     websocket: WebSocket, 
     family_id: int, 
-    token: str = Query(...),
-    db: Session = Depends(get_db)
+    token: str = Query(...)
 ):
-    # Authenticate
-    user = get_user_from_token(token, db)
+    # Authenticate bằng session ngắn, không giữ 1 kết nối DB suốt vòng đời socket
+    db = SessionLocal()
+    try:
+        user = get_user_from_token(token, db)
+    finally:
+        db.close()
     if not user:
         await websocket.close(code=4001, reason="Unauthorized/Invalid Token")
         return
 
     # TODO: Verify user belongs to family_id (Optional but recommended)
     
-    await manager.connect(websocket, family_id)
     try:
+        await manager.connect(websocket, family_id)
         while True:
             data = await websocket.receive_text() # Client sends JSON string
-            print(f"Received WS data: {data}")
             try:
-                message_data = json.loads(data)
-                
-                # Save to DB
-                content = message_data.get("content")
-                msg_type = message_data.get("message_type", "text")
+                content, msg_type = clean_message(json.loads(data))
                 
                 if content:
-                    print("Saving message to DB...")
-                    new_msg = Message(
-                        family_id=family_id,
-                        sender_id=user.id,
-                        content=content,
-                        message_type=msg_type,
-                        created_at=datetime.utcnow()
-                    )
-                    db.add(new_msg)
-                    db.commit()
-                    db.refresh(new_msg)
-                    print(f"Message saved with ID: {new_msg.id}")
-                    
-                    # Prepare payload
-                    # sender_data for UI
-                    response_data = {
-                        "id": new_msg.id,
-                        "family_id": new_msg.family_id,
-                        "sender_id": new_msg.sender_id,
-                        "content": new_msg.content,
-                        "created_at": new_msg.created_at.isoformat(),
-                        "message_type": new_msg.message_type,
-                        "sender_name": f"{user.first_name or ''} {user.last_name or ''}".strip() or user.username,
-                        # "sender_avatar": user.avatar_url # If User had avatar
-                        "author": {
-                            "id": str(user.id),
-                            "firstName": user.first_name,
-                            "lastName": user.last_name,
-                            "imageUrl": None # Placeholder
-                        }
-                    }
-                    
-                    print(f"Broadcasting message to family {family_id}")
-                    await manager.broadcast(response_data, family_id)
+                    # Không chờ MySQL: chat_writer ghi theo lô (vài ms / lô) trên luồng riêng,
+                    # tin được broadcast ngay khi lô chứa nó commit xong (đã có id)
+                    saved = chat_writer.submit(family_id, user.id, content, msg_type)
+                    task = asyncio.create_task(broadcast_when_saved(saved, user, family_id))
+                    _pending_broadcasts.add(task)
+                    task.add_done_callback(_pending_broadcasts.discard)
             except Exception as e:
                 print(f"Error processing message: {e}")
                 
@@ -140,36 +275,171 @@ async def websocket_endpoint(
         manager.disconnect(websocket, family_id)
 
 
+def sender_display_name(sender) -> str:
+    if sender is None:
+        return "Người dùng đã bị xóa"
+    return f"{sender.first_name or ''} {sender.last_name or ''}".strip() or sender.username
+
+
+def message_to_dict(msg, sender) -> dict:
+    """1 tin nhắn theo MessageRead (msg: Message hoặc row MESSAGE_COLUMNS; dùng chung cho bản sync và async)."""
+    return {
+        "id": msg.id,
+        "family_id": msg.family_id,
+        "sender_id": msg.sender_id,
+        "content": msg.content,
+        "created_at": msg.created_at.isoformat(),
+        "message_type": msg.message_type,
+        "sender_name": sender_display_name(sender),
+        "sender_avatar": None,
+    }
+
+
+# ----- Lịch sử chat: phân trang theo mốc (keyset) -----
+# Thứ tự (created_at, id) đi theo index idx_messages_family_created (family_id, created_at, id):
+# mỗi trang chỉ đọc `limit` dòng từ mốc, không quét bỏ `skip` dòng như offset.
+
+MESSAGE_COLUMNS = (
+    Message.id, Message.family_id, Message.sender_id, Message.content, Message.created_at, Message.message_type,
+)
+
+
+def cursor_statement(family_id: int, message_id: int):
+    """(created_at, id) của tin làm mốc, chỉ trong gia phả family_id."""
+    return select(Message.created_at, Message.id).where(Message.id == message_id, Message.family_id == family_id)
+
+
+def history_statement(family_id: int, limit: int, skip: int = 0, before=None, after=None):
+    """
+    before: lấy các tin cũ hơn mốc (cuộn lên), after: các tin mới hơn mốc (bắt kịp sau khi mất kết nối).
+    Không có mốc: trang mới nhất; `skip` (offset) chỉ giữ cho client cũ.
+    """
+    statement = select(*MESSAGE_COLUMNS).where(Message.family_id == family_id)
+    if after is not None:
+        created_at, message_id = after
+        return statement.where(or_(
+            Message.created_at > created_at,
+            and_(Message.created_at == created_at, Message.id > message_id),
+        )).order_by(Message.created_at.asc(), Message.id.asc()).limit(limit)
+    if before is not None:
+        created_at, message_id = before
+        statement = statement.where(or_(
+            Message.created_at < created_at,
+            and_(Message.created_at == created_at, Message.id < message_id),
+        ))
+    statement = statement.order_by(Message.created_at.desc(), Message.id.desc())
+    if skip and before is None:
+        statement = statement.offset(skip)
+    return statement.limit(limit)
+
+
+def check_history_cursors(before_id: Optional[int], after_id: Optional[int]):
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="Chỉ dùng một trong before_id hoặc after_id")
+
+
+def history_page(rows, senders, newer: bool) -> list:
+    # Luôn trả mới nhất trước như trước đây (after_id đọc tăng dần nên đảo lại)
+    if newer:
+        rows = list(reversed(rows))
+    return [message_to_dict(row, senders.get(row.sender_id)) for row in rows]
+
+
 @router.get("/{family_id}/chat/messages", response_model=List[MessageRead])
 def get_chat_history(
     family_id: int, 
-    limit: int = 50, 
-    skip: int = 0, 
+    limit: int = Query(50, ge=1, le=200), 
+    skip: int = Query(0, ge=0), 
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
     db: Session = Depends(get_db)
 ):
-    messages = db.query(Message)\
-        .filter(Message.family_id == family_id)\
-        .order_by(Message.created_at.desc())\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
-    
-    # Enrich with sender info
-    result = []
-    # Fetch all senders in batch or one by one (optimization opportunity)
-    # For now, simplistic loop (N+1 query but limit is 50, acceptable for prototype)
-    for msg in messages:
-        sender = msg.sender
-        sender_name = f"{sender.first_name or ''} {sender.last_name or ''}".strip() or sender.username
-        
-        result.append(MessageRead(
-            id=msg.id,
-            family_id=msg.family_id,
-            sender_id=msg.sender_id,
-            content=msg.content,
-            created_at=msg.created_at.isoformat(),
-            message_type=msg.message_type,
-            sender_name=sender_name
-        ))
+    check_history_cursors(before_id, after_id)
+    cursor = None
+    if before_id is not None or after_id is not None:
+        cursor = db.execute(cursor_statement(family_id, before_id or after_id)).first()
+        if cursor is None:
+            raise HTTPException(status_code=404, detail="Không tìm thấy tin nhắn làm mốc")
+
+    rows = db.execute(history_statement(
+        family_id, limit, skip,
+        before=tuple(cursor) if before_id is not None else None,
+        after=tuple(cursor) if after_id is not None else None,
+    )).all()
+    # Người gửi của cả trang: cache user + 1 query IN cho phần thiếu (không lazy load từng tin)
+    senders = load_users(db, [row.sender_id for row in rows])
     
-    return result
+    # Fast path: trả dict thuần, response_model chỉ dùng cho OpenAPI
+    return FastJSONResponse(history_page(rows, senders, newer=after_id is not None))
+
+
+# ----- Tìm kiếm tin nhắn (không dấu, theo từ, xem chat_search.py) -----
+@router.get("/{family_id}/chat/search", response_model=MessageSearchPage)
+def search_chat_messages(
+    family_id: int,
+    q: str = Query(..., min_length=1, max_length=200),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    limit: int = Query(20, ge=1, le=100),
+    before_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    from routers.members import verify_family_access
+    verify_family_access(db, current_user, family_id)
+
+    terms = query_terms(q)
+    if not terms:
+        return FastJSONResponse({"query": q, "limit": limit, "items": [], "next_before_id": None})
+
+    before = None
+    if before_id is not None:
+        before = db.execute(cursor_statement(family_id, before_id)).first()
+        if before is None:
+            raise HTTPException(status_code=404, detail="Không tìm thấy tin nhắn làm mốc")
+
+    # Lấy dư 1 dòng để biết còn trang sau không
+    ids = db.execute(search_statement(
+        family_id, terms, limit + 1, date_from, date_to, tuple(before) if before else None
+    )).scalars().all()
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+
+    rows = {row.id: row for row in db.execute(select(*MESSAGE_COLUMNS).where(Message.id.in_(ids))).all()} if ids else {}
+    senders = load_users(db, [row.sender_id for row in rows.values()])
+    items = []
+    for message_id in ids:
+        row = rows.get(message_id)
+        if row is None:
+            continue
+        item = message_to_dict(row, senders.get(row.sender_id))
+        item.update(highlight(row.content, terms))
+        items.append(item)
+    return FastJSONResponse({
+        "query": q,
+        "limit": limit,
+        "items": items,
+        "next_before_id": ids[-1] if has_more else None,
+    })
+
+
+# ----- Tin chưa đọc (bộ đếm cập nhật dần, xem read_state.py) -----
+@router.get("/chat/unread", response_model=ChatUnreadSummary)
+def get_unread_counts(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Số tin chưa đọc của mọi gia phả của user (badge danh sách gia phả)."""
+    return FastJSONResponse(unread_summary(db, current_user.id))
+
+
+@router.post("/{family_id}/chat/read", response_model=ChatReadStateRead)
+def mark_chat_read(
+    family_id: int,
+    ack: ChatReadAck,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    from routers.members import verify_family_access
+    verify_family_access(db, current_user, family_id)
+    cursor = db.execute(cursor_statement(family_id, ack.message_id)).first()
+    if cursor is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy tin nhắn")
+    return FastJSONResponse(mark_read(db, current_user.id, family_id, tuple(cursor)))
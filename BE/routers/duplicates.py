@@ -0,0 +1,158 @@
+from fastapi import APIRouter, Depends, BackgroundTasks, Query, HTTPException
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Dict
+import threading
+from db.mysql_connection import get_db, SessionLocal
+from models import Person, User
+from schemas import DuplicateReport, MergeMembersRequest, PersonRead
+from dependencies import get_current_user
+from duplicates import find_family_duplicates, merge_person_records
+from tree_delta import TreeChangeSet, save_changes, get_tree_version
+from lineage import refresh_lineage, refresh_closure, delete_person_closure, is_ancestor_or_self
+from person_links import LINK_SPOUSE, linked_ids
+from relationship_sync import sync_person_relationships
+from membership import invalidate_membership, change_member_count
+from search_index import index_persons, remove_from_index
+from db.neo4j_connection import merge_persons_in_graph
+from routers.tree_events import publish_tree_changes
+from routers.members import verify_family_access, verify_editor_access
+
+router = APIRouter(prefix="/members", tags=["Duplicates"])
+
+# family_id -> kết quả quét trùng gần nhất
+duplicate_jobs: Dict[int, dict] = {}
+_jobs_lock = threading.Lock()
+
+
+def run_duplicate_scan(family_id: int):
+    db = SessionLocal()
+    job = duplicate_jobs[family_id]
+    try:
+        version = get_tree_version(db, family_id)
+        suggestions = find_family_duplicates(db, family_id)
+        job.update({"version": version, "suggestions": suggestions, "error": None})
+        print(f"DEBUG: Duplicate scan family {family_id}: {len(suggestions)} suggestions")
+    except Exception as e:
+        print(f"DEBUG: Duplicate scan error (family {family_id}): {e}")
+        job["error"] = str(e)
+    finally:
+        db.close()
+        job["generated_at"] = datetime.utcnow().isoformat()
+        job["status"] = "done"
+
+
+# ----- Chạy quét người trùng (background) -----
+@router.post("/{family_id}/duplicates/scan")
+def start_duplicate_scan(family_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    verify_editor_access(db, current_user, family_id)
+    with _jobs_lock:
+        job = duplicate_jobs.setdefault(family_id, {"status": "idle", "version": None, "generated_at": None, "suggestions": [], "error": None})
+        if job["status"] == "running":
+            return {"status": "running"}
+        job["status"] = "running"
+    background_tasks.add_task(run_duplicate_scan, family_id)
+    return {"status": "started"}
+
+
+# ----- Gợi ý gộp (xếp theo điểm) -----
+@router.get("/{family_id}/duplicates", response_model=DuplicateReport)
+def get_duplicate_suggestions(
+    family_id: int,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    verify_family_access(db, current_user, family_id)
+    job = duplicate_jobs.get(family_id) or {"status": "idle", "version": None, "generated_at": None, "suggestions": [], "error": None}
+    suggestions = job["suggestions"]
+    return {
+        "family_id": family_id,
+        "status": job["status"],
+        "version": job["version"],
+        # Cây đã đổi sau lần quét -> nên quét lại
+        "stale": job["version"] is not None and job["version"] != get_tree_version(db, family_id),
+        "generated_at": job["generated_at"],
+        "error": job["error"],
+        "total": len(suggestions),
+        "skip": skip,
+        "limit": limit,
+        "suggestions": suggestions[skip:skip + limit],
+    }
+
+
+# ----- Gộp 2 thành viên trùng -----
+@router.post("/{family_id}/merge", response_model=PersonRead)
+def merge_members(family_id: int, request: MergeMembersRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Gộp duplicate_id vào keep_id: con, quan hệ, tài khoản, avatar chuyển sang keep rồi xóa duplicate."""
+    verify_editor_access(db, current_user, family_id)
+    if request.keep_id == request.duplicate_id:
+        raise HTTPException(status_code=400, detail="Không thể gộp một người với chính họ")
+
+    keep = db.query(Person).filter(Person.id == request.keep_id, Person.family_id == family_id).first()
+    duplicate = db.query(Person).filter(Person.id == request.duplicate_id, Person.family_id == family_id).first()
+    if not keep or not duplicate:
+        raise HTTPException(status_code=404, detail="Member not found in this family")
+    if keep.gender != duplicate.gender:
+        raise HTTPException(status_code=400, detail="Hai người khác giới tính, không thể gộp")
+    if keep.user_id and duplicate.user_id and keep.user_id != duplicate.user_id:
+        raise HTTPException(status_code=400, detail="Cả hai đều đã liên kết tài khoản khác nhau")
+    if keep.cccd and duplicate.cccd and keep.cccd != duplicate.cccd:
+        raise HTTPException(status_code=400, detail="Hai người có CCCD khác nhau")
+    if is_ancestor_or_self(db, keep.id, duplicate.id) or is_ancestor_or_self(db, duplicate.id, keep.id):
+        raise HTTPException(status_code=400, detail="Không thể gộp tổ tiên với con cháu của họ")
+
+    duplicate_id = duplicate.id
+    old_parents = (keep.father_id, keep.mother_id)
+    try:
+        # Vợ/chồng của duplicate được chuyển sang keep: node của họ đổi mảng spouses (lấy trước khi gộp)
+        moved_spouse_ids = [sid for sid in linked_ids(db, duplicate_id, LINK_SPOUSE) if sid != keep.id]
+        children = merge_person_records(db, keep, duplicate)
+        child_ids = [child_id for child_id, _, _ in children]
+
+        # Chỉ mục: closure, đời, tìm kiếm
+        delete_person_closure(db, duplicate_id)
+        refresh_closure(db, child_ids + ([keep.id] if (keep.father_id, keep.mother_id) != old_parents else []))
+        sync_person_relationships(db, [keep.id] + child_ids)
+        spouse_ids = linked_ids(db, keep.id, LINK_SPOUSE)
+        refresh_lineage(db, [keep.id] + child_ids + spouse_ids)
+        remove_from_index(db, duplicate_id)
+        index_persons(db, [keep])
+
+        # Delta cây gia phả
+        tree_changes = TreeChangeSet(family_id)
+        tree_changes.node_removed(duplicate_id)
+        tree_changes.parent_links_changed(keep.id, old_parents[0], old_parents[1], keep.father_id, keep.mother_id)
+        tree_changes.node_updated(db, keep)
+        for child_id, old_father_id, old_mother_id in children:
+            new_father_id = keep.id if old_father_id == duplicate_id else old_father_id
+            new_mother_id = keep.id if old_mother_id == duplicate_id else old_mother_id
+            tree_changes.parent_links_changed(child_id, old_father_id, old_mother_id, new_father_id, new_mother_id)
+        for child in db.query(Person).filter(Person.id.in_(child_ids)).all() if child_ids else []:
+            tree_changes.node_updated(db, child)
+        for spouse in db.query(Person).filter(Person.id.in_(moved_spouse_ids)).all() if moved_spouse_ids else []:
+            tree_changes.node_updated(db, spouse)
+        save_changes(db, tree_changes)
+
+        db.delete(duplicate)
+        change_member_count(db, family_id, -1)
+        db.commit()
+        invalidate_membership(family_id=family_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        print(f"Merge error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi gộp thành viên: {e}")
+
+    db.refresh(keep)
+    publish_tree_changes(tree_changes)
+
+    # --- SYNC NEO4J: 1 transaction ---
+    try:
+        merge_persons_in_graph(keep, duplicate_id)
+    except Exception as e:
+        print(f"Neo4j Merge Error: {e}")
+
+    return keep
@@ -4,13 +4,19 @@ from typing import List, Optional
 from pydantic import BaseModel
 from db.mysql_connection import get_db
 from models import Family, Person, User
-from schemas import PersonRead, FamilyRead, FamilyCreate, FamilyUpdate, JoinFamilyRequest, UpdateMemberRoleRequest
+from schemas import PersonRead, FamilyRead, FamilyCreate, FamilyUpdate, JoinFamilyRequest, UpdateMemberRoleRequest, GraftRequest, GraftResult
 from fastapi import Request
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from dependencies import get_current_user
 import uuid
 # Import Helper Sync Neo4j
-from db.neo4j_connection import add_person_to_graph
+from db.neo4j_connection import sync_person_node, graft_in_graph
+from search_index import index_persons
+from tree_delta import TreeChangeSet, save_changes
+from routers.tree_events import publish_tree_changes
+from lineage import refresh_lineage
+from family_graft import graft_family
+from membership import invalidate_membership, change_member_count
 
 # Should be in config
 SECRET_KEY = "your-secret-key"
@@ -67,16 +73,19 @@ def create_family(family: FamilyCreate, db: Session = Depends(get_db), current_u
     )
     try:
         db.add(new_person)
+        db.flush()
+        change_member_count(db, new_family.id, 1)
+        refresh_lineage(db, [new_person.id])
+        index_persons(db, [new_person])
+        tree_changes = TreeChangeSet(new_family.id)
+        tree_changes.node_added(db, new_person)
+        save_changes(db, tree_changes)
         db.commit()
+        invalidate_membership(family_id=new_family.id)
+        publish_tree_changes(tree_changes)
         
         # --- SYNC NEO4J ---
-        full_name = f"{new_person.last_name} {new_person.first_name}".strip()
-        add_person_to_graph(
-            id=new_person.id, 
-            full_name=full_name,
-            gender=new_person.gender,
-            family_id=new_family.id
-        )
+        sync_person_node(new_person)
     except Exception as e:
         print(f"Không thể tạo Person cho User: {e}")
         pass
@@ -123,9 +132,15 @@ def join_family(request: JoinFamilyRequest, db: Session = Depends(get_db), curre
                 if not matched_person.avatar_url: 
                     # Use placeholder or no-op
                     pass 
+                index_persons(db, [matched_person])
                 
                 db.commit()
+                invalidate_membership(user_id=current_user.id, family_id=family.id)
                 db.refresh(matched_person)
+                try:
+                    sync_person_node(matched_person)
+                except Exception as neo_e:
+                    print(f"Neo4j Sync Error: {neo_e}")
                 return family
             else:
                 # Matched person already has account? 
@@ -147,18 +162,21 @@ def join_family(request: JoinFamilyRequest, db: Session = Depends(get_db), curre
             role='member' 
         )
         db.add(new_person)
+        db.flush()
+        change_member_count(db, family.id, 1)
+        refresh_lineage(db, [new_person.id])
+        index_persons(db, [new_person])
+        tree_changes = TreeChangeSet(family.id)
+        tree_changes.node_added(db, new_person)
+        save_changes(db, tree_changes)
         db.commit()
+        invalidate_membership(family_id=family.id)
+        publish_tree_changes(tree_changes)
         db.refresh(new_person) # Refresh to get the ID
         
         # --- SYNC NEO4J ---
         try:
-            full_name = f"{new_person.last_name} {new_person.first_name}".strip()
-            add_person_to_graph(
-                id=new_person.id, 
-                full_name=full_name,
-                gender=new_person.gender,
-                family_id=family.id
-            )
+            sync_person_node(new_person)
         except Exception as neo_e:
              print(f"Neo4j Sync Error: {neo_e}")
 
@@ -222,6 +240,7 @@ def delete_family(family_id: int, db: Session = Depends(get_db), current_user: U
     
     db.delete(family)
     db.commit()
+    invalidate_membership(family_id=family_id)
     return {"message": "Xóa gia phả thành công"}
 
 # API 5: Lấy thông tin thành viên của User hiện tại
@@ -242,7 +261,12 @@ def get_current_member_in_family(family_id: int, db: Session = Depends(get_db),
         if person.role != 'admin':
             person.role = 'admin'
             db.commit()
+            invalidate_membership(user_id=current_user.id, family_id=family_id)
             db.refresh(person)
+            try:
+                sync_person_node(person)
+            except Exception as neo_e:
+                print(f"Neo4j Sync Error: {neo_e}")
             
     return person
 
@@ -278,5 +302,50 @@ def update_member_role(
          
     target_member.role = request.role
     db.commit()
+    invalidate_membership(family_id=family_id)
+    
+    # --- SYNC NEO4J (role lưu trên node) ---
+    try:
+        sync_person_node(target_member)
+    except Exception as neo_e:
+        print(f"Neo4j Sync Error: {neo_e}")
     
-    return {"message": "Cập nhật quyền thành công", "new_role": request.role}
\ No newline at end of file
+    return {"message": "Cập nhật quyền thành công", "new_role": request.role}
+
+# API 7: Ghép nhánh / gộp gia phả khác vào gia phả này
+@router.post("/{family_id}/graft", response_model=GraftResult)
+def graft_branch(family_id: int, request: GraftRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    # Cần quyền Admin/Editor ở cả 2 gia phả
+    from routers.members import verify_editor_access
+    verify_editor_access(db, current_user, family_id)
+    verify_editor_access(db, current_user, request.source_family_id)
+
+    try:
+        result = graft_family(
+            db, request.source_family_id, family_id,
+            root_id=request.root_id, attach_to_id=request.attach_to_id, id_map=request.id_map
+        )
+        db.commit()
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Graft error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi ghép gia phả: {e}")
+    invalidate_membership(family_id=family_id)
+    invalidate_membership(family_id=request.source_family_id)
+    publish_tree_changes(*result["changesets"])
+
+    # --- SYNC NEO4J: 1 transaction, cập nhật theo lô ---
+    try:
+        graft_in_graph(family_id, result["moved_ids"], result["merged"], result["attached"], result["demoted_ids"])
+    except Exception as neo_e:
+        print(f"Neo4j Graft Sync Error: {neo_e}")
+
+    return {
+        "source_family_id": request.source_family_id,
+        "target_family_id": family_id,
+        "moved": len(result["moved_ids"]),
+        "merged": len(result["merged"]),
+    }
@@ -0,0 +1,163 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from db.mysql_connection import get_db
+from models import Person, PersonLineage, User
+from schemas import GenerationSummary, GenerationPage, LineagePage, LineageCheck, FamilyStatistics
+from dependencies import get_current_user
+from fast_json import FastJSONResponse
+from lineage import rebuild_family_lineage
+from family_stats import get_family_statistics
+from tree_delta import bump_tree_version
+from routers.members import verify_family_access, verify_editor_access, PERSON_READ_COLUMNS, person_row_to_dict
+
+router = APIRouter(prefix="/genealogy", tags=["Genealogy"])
+
+
+# ----- Thống kê số người theo đời -----
+@router.get("/{family_id}/generations", response_model=List[GenerationSummary])
+def get_generation_summary(family_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    verify_family_access(db, current_user, family_id)
+    rows = db.query(Person.generation, func.count(Person.id))\
+        .filter(Person.family_id == family_id, Person.generation.isnot(None))\
+        .group_by(Person.generation)\
+        .order_by(Person.generation)\
+        .all()
+    return FastJSONResponse([{"generation": g, "count": c} for g, c in rows])
+
+
+# ----- Danh sách thành viên Đời thứ N (phân trang) -----
+@router.get("/{family_id}/generations/{generation}", response_model=GenerationPage)
+def get_members_by_generation(
+    family_id: int,
+    generation: int,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    verify_family_access(db, current_user, family_id)
+    # Dùng index (family_id, generation)
+    base = db.query(*PERSON_READ_COLUMNS).filter(Person.family_id == family_id, Person.generation == generation)
+    total = base.with_entities(func.count(Person.id)).scalar()
+    rows = base.order_by(Person.date_of_birth, Person.id).offset(skip).limit(limit).all()
+    return FastJSONResponse({
+        "generation": generation,
+        "total": total,
+        "skip": skip,
+        "limit": limit,
+        "items": [person_row_to_dict(r) for r in rows],
+    })
+
+
+# ----- Thống kê gia phả / nhánh (cache theo tree_version) -----
+@router.get("/{family_id}/statistics", response_model=FamilyStatistics)
+def get_statistics(
+    family_id: int,
+    root_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    verify_family_access(db, current_user, family_id)
+    stats = get_family_statistics(db, family_id, root_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Member not found in this family")
+    return FastJSONResponse(stats)
+
+
+# ----- Tính lại chỉ mục đời cho cả gia phả -----
+@router.post("/{family_id}/generations/rebuild")
+def rebuild_generations(family_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    verify_editor_access(db, current_user, family_id)
+    updated = rebuild_family_lineage(db, family_id)
+    # Đời + closure đổi -> tăng version để thống kê (cache theo tree_version) không trả số cũ
+    bump_tree_version(db, family_id)
+    db.commit()
+    return {"message": f"Đã cập nhật đời cho {updated} thành viên và dựng lại bảng tổ tiên/hậu duệ"}
+
+
+# ----- Tổ tiên / Hậu duệ (closure table) -----
+def _lineage_page(db: Session, person_id: int, direction: str, min_depth: int, max_depth: Optional[int], skip: int, limit: int):
+    if direction == "ancestors":
+        own_col, other_col = PersonLineage.descendant_id, PersonLineage.ancestor_id
+    else:
+        own_col, other_col = PersonLineage.ancestor_id, PersonLineage.descendant_id
+
+    filters = [own_col == person_id, PersonLineage.depth >= min_depth]
+    if max_depth is not None:
+        filters.append(PersonLineage.depth <= max_depth)
+
+    total = db.query(func.count()).select_from(PersonLineage).filter(*filters).scalar()
+    rows = db.query(PersonLineage.depth, *PERSON_READ_COLUMNS)\
+        .join(Person, Person.id == other_col)\
+        .filter(*filters)\
+        .order_by(PersonLineage.depth, Person.id)\
+        .offset(skip).limit(limit).all()
+    return FastJSONResponse({
+        "person_id": person_id,
+        "total": total,
+        "skip": skip,
+        "limit": limit,
+        "items": [person_row_to_dict(r) for r in rows],
+    })
+
+
+def _get_person_checked(db: Session, person_id: int, user: User) -> int:
+    row = db.query(Person.family_id).filter(Person.id == person_id).first()
+    # Người không thuộc gia phả nào: không có quyền gia phả nào để kiểm tra -> coi như không tìm thấy
+    if row is None or row.family_id is None:
+        raise HTTPException(status_code=404, detail="Member not found")
+    verify_family_access(db, user, row.family_id)
+    return row.family_id
+
+
+@router.get("/person/{person_id}/ancestors", response_model=LineagePage)
+def get_ancestors(
+    person_id: int,
+    min_depth: int = Query(1, ge=1),
+    max_depth: Optional[int] = Query(None, ge=1),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    _get_person_checked(db, person_id, current_user)
+    return _lineage_page(db, person_id, "ancestors", min_depth, max_depth, skip, limit)
+
+
+@router.get("/person/{person_id}/descendants", response_model=LineagePage)
+def get_descendants(
+    person_id: int,
+    min_depth: int = Query(1, ge=1),
+    max_depth: Optional[int] = Query(None, ge=1),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    _get_person_checked(db, person_id, current_user)
+    return _lineage_page(db, person_id, "descendants", min_depth, max_depth, skip, limit)
+
+
+@router.get("/is-ancestor", response_model=LineageCheck)
+def check_is_ancestor(
+    ancestor_id: int,
+    descendant_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """A có thuộc dòng trên của B không (1 lookup theo khóa chính)."""
+    # Kiểm tra quyền cả 2 người: không cho dò quan hệ của người ở gia phả không được xem
+    _get_person_checked(db, ancestor_id, current_user)
+    _get_person_checked(db, descendant_id, current_user)
+    depth = db.query(PersonLineage.depth).filter(
+        PersonLineage.ancestor_id == ancestor_id,
+        PersonLineage.descendant_id == descendant_id
+    ).scalar()
+    return {
+        "ancestor_id": ancestor_id,
+        "descendant_id": descendant_id,
+        "is_ancestor": depth is not None,
+        "depth": depth,
+    }
@@ -1,12 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
 from sqlalchemy.orm import Session
-from db.mysql_connection import get_db
-from models import Person, Relationship, User
-from db.neo4j_connection import add_person_to_graph, create_relationship_in_graph
+from datetime import datetime
+import threading
+from typing import Optional
+from db.mysql_connection import get_db, SessionLocal
+from models import Person, PersonLink, User
+from person_links import LINK_SPOUSE
+from db.neo4j_connection import sync_person_node, create_relationship_in_graph
 from dependencies import get_current_user
+from routers.auth import require_roles
+from lineage import find_parent_cycles
+from search_index import rebuild_search_index
+from chat_search import rebuild_chat_search_index
+from relationship_sync import regenerate_relationships
+from passwords import password_pool_stats
 
 router = APIRouter(prefix="/maintenance", tags=["Maintenance"])
 
+# Kết quả lần quét vòng lặp cha/con gần nhất
+cycle_scan_state = {"running": False, "started_at": None, "finished_at": None, "persons_scanned": 0, "cycles": [], "error": None}
+_cycle_scan_lock = threading.Lock()
+
 @router.post("/sync-neo4j")
 def sync_neo4j(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """
@@ -23,15 +37,7 @@ def sync_neo4j(db: Session = Depends(get_db), current_user: User = Depends(get_c
         nodes_created = 0
         for p in persons:
             try:
-                full_name = f"{p.last_name} {p.first_name}".strip()
-                add_person_to_graph(
-                    id=p.id,
-                    full_name=full_name,
-                    gender=p.gender,
-                    family_id=p.family_id,
-                    father_id=None,
-                    mother_id=None
-                )
+                sync_person_node(p)
                 nodes_created += 1
             except Exception as node_e:
                 print(f"DEBUG: Error adding node {p.id}: {node_e}")
@@ -51,20 +57,16 @@ def sync_neo4j(db: Session = Depends(get_db), current_user: User = Depends(get_c
             except Exception as rel_e:
                 print(f"DEBUG: Error adding rel from person {p.id}: {rel_e}")
 
-        # 4. Đẩy Relationships từ bảng Relationship (Đề phòng data chỉ có ở đây)
-        rels = db.query(Relationship).all()
-        print(f"DEBUG: Found {len(rels)} entries in Relationship table.")
-        for r in rels:
+        # 4. Đẩy vợ/chồng từ person_links (dữ liệu chỉ có ở MySQL, không suy ra được từ father_id/mother_id)
+        links = db.query(PersonLink.person1_id, PersonLink.person2_id).filter(PersonLink.kind == LINK_SPOUSE).all()
+        print(f"DEBUG: Found {len(links)} spouse links.")
+        for p1, p2 in links:
             try:
-                # Map relationship_type or extra_info
-                # person1_id is Child, person2_id is Parent (based on import logic)
-                parent_id = r.person2_id
-                child_id = r.person1_id
-                if r.relationship_type.lower() in ['father', 'mother', 'parent'] or r.extra_info in ['Cha', 'Mẹ']:
-                   create_relationship_in_graph(parent_id, child_id, "PARENT_OF")
-                   rel_count += 1
+                create_relationship_in_graph(p1, p2, "SPOUSE")
+                create_relationship_in_graph(p2, p1, "SPOUSE")
+                rel_count += 2
             except Exception as rel_e:
-                 print(f"DEBUG: Error adding rel {r.id}: {rel_e}")
+                 print(f"DEBUG: Error adding spouse link {p1}-{p2}: {rel_e}")
 
         print(f"DEBUG: Sync completed. Nodes: {nodes_created}, Rels: {rel_count}")
                 
@@ -75,3 +77,76 @@ def sync_neo4j(db: Session = Depends(get_db), current_user: User = Depends(get_c
     except Exception as e:
         print(f"DEBUG: Global Sync Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/rebuild-search-index")
+def rebuild_search(family_id: Optional[int] = None, db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin"]))):
+    """Dựng lại chỉ mục tìm kiếm thành viên (dữ liệu cũ trước khi có bảng person_search_tokens)."""
+    count = rebuild_search_index(db, family_id)
+    return {"status": "success", "message": f"Indexed {count} persons."}
+
+
+@router.post("/rebuild-chat-search-index")
+def rebuild_chat_search(family_id: Optional[int] = None, db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin"]))):
+    """Dựng lại chỉ mục tìm kiếm chat (tin nhắn cũ trước khi có bảng message_search_tokens)."""
+    count = rebuild_chat_search_index(db, family_id)
+    return {"status": "success", "message": f"Indexed {count} messages."}
+
+
+@router.post("/regenerate-relationships")
+def regenerate_relationship_rows(family_id: Optional[int] = None, db: Session = Depends(get_db), current_user: User = Depends(require_roles(["admin"]))):
+    """Sinh lại liên kết anh chị em (person_links) từ father_id/mother_id."""
+    count = regenerate_relationships(db, family_id)
+    db.commit()
+    return {"status": "success", "message": f"Created {count} sibling links."}
+
+
+def scan_parent_cycles():
+    """Quét toàn bộ persons (mọi family, kể cả liên kết chéo family) tìm vòng lặp cha/con."""
+    db = SessionLocal()
+    try:
+        rows, family_of = [], {}
+        for pid, father_id, mother_id, family_id in db.query(
+            Person.id, Person.father_id, Person.mother_id, Person.family_id
+        ).yield_per(10000):
+            rows.append((pid, father_id, mother_id))
+            family_of[pid] = family_id
+
+        cycles = find_parent_cycles(rows)
+        cycle_scan_state["persons_scanned"] = len(rows)
+        cycle_scan_state["cycles"] = [
+            {"person_ids": cycle, "family_ids": sorted({family_of[pid] for pid in cycle if family_of.get(pid)})}
+            for cycle in cycles
+        ]
+        cycle_scan_state["error"] = None
+        print(f"DEBUG: Cycle scan done. Persons: {len(rows)}, cycles: {len(cycles)}")
+    except Exception as e:
+        print(f"DEBUG: Cycle scan error: {e}")
+        cycle_scan_state["error"] = str(e)
+    finally:
+        db.close()
+        cycle_scan_state["finished_at"] = datetime.utcnow().isoformat()
+        cycle_scan_state["running"] = False
+
+
+@router.post("/scan-cycles")
+def start_cycle_scan(background_tasks: BackgroundTasks, current_user: User = Depends(require_roles(["admin"]))):
+    """Chạy quét vòng lặp cha/con ở background; xem kết quả qua GET /maintenance/cycles. Chỉ admin hệ thống."""
+    with _cycle_scan_lock:
+        if cycle_scan_state["running"]:
+            return {"status": "running", "message": "Cycle scan is already running."}
+        cycle_scan_state["running"] = True
+        cycle_scan_state["started_at"] = datetime.utcnow().isoformat()
+    background_tasks.add_task(scan_parent_cycles)
+    return {"status": "started"}
+
+
+@router.get("/cycles")
+def get_cycle_scan_result(current_user: User = Depends(require_roles(["admin"]))):
+    return cycle_scan_state
+
+
+@router.get("/password-pool")
+def get_password_pool_stats(current_user: User = Depends(require_roles(["admin"]))):
+    """Số liệu hàng đợi băm mật khẩu (bcrypt) của worker này."""
+    return password_pool_stats()
@@ -1,10 +1,14 @@
 # routers/members.py
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, Query
 from sqlalchemy.orm import Session
 from db.mysql_connection import SessionLocal
-from models import Person, Relationship
-from schemas import PersonCreate, PersonRead
-from typing import List, Optional
+from models import Person
+from schemas import PersonCreate, PersonRead, MemberSearchPage
+from typing import List, Optional, Union
+from fast_json import FastJSONResponse
+from tree_delta import TreeChangeSet, save_changes, get_changes_since, get_tree_version, MAX_DELTA_CHANGES
+from routers.tree_events import publish_tree_changes
+from lineage import refresh_lineage, rebuild_family_lineage, refresh_closure, delete_person_closure, creates_cycle, find_parent_cycles
 import pandas as pd
 import io
 from datetime import datetime
@@ -23,52 +27,52 @@ def get_db():
 
 from dependencies import get_current_user
 from models import User
+from membership import get_membership, invalidate_membership, family_is_empty, change_member_count, recount_members
 
 # ... import User model to type hint ...
 
-# Helper check quyền
+# Helper check quyền (membership cache: lần hit không tốn query, xem membership.py)
 def verify_family_access(db: Session, user: User, family_id: int):
     # 1. Admin hệ thống có quyền xem mọi thứ
     if user.role == "admin":
         return True
     
-    # 2. Kiểm tra xem user có phải là một Person trong gia phả này không (qua user_id)
-    is_member = db.query(Person).filter(
-        Person.user_id == user.id, 
-        Person.family_id == family_id
-    ).first()
+    # 2. User là một Person trong gia phả này (qua user_id, fallback qua CCCD nếu chưa link)
+    membership = get_membership(db, user, family_id)
     
-    # 3. Fallback: Kiểm tra qua CCCD (nếu user có CCCD và chưa được link qua user_id)
-    if not is_member and hasattr(user, 'cccd') and user.cccd:
-        is_member = db.query(Person).filter(
-            Person.cccd == user.cccd, 
-            Person.family_id == family_id
-        ).first()
-    
-    if not is_member:
+    if not membership:
         # HACK: Nếu gia phả chưa có thành viên nào (vừa tạo), cho phép truy cập để Import
-        member_count = db.query(Person).filter(Person.family_id == family_id).count()
-        if member_count == 0:
+        if family_is_empty(db, family_id):
             return True
             
         raise HTTPException(status_code=403, detail="Bạn không có quyền truy cập vào gia phả này")
-    return is_member
+    return membership
 
 def verify_editor_access(db: Session, user: User, family_id: int):
-    # Check if user is Admin/Editor in the family
-    member = db.query(Person).filter(
-        Person.user_id == user.id, 
-        Person.family_id == family_id
-    ).first()
+    # Check if user is Admin/Editor in the family (phải link qua user_id)
+    membership = get_membership(db, user, family_id)
     
-    if not member:
+    if not membership or not membership.linked:
          raise HTTPException(status_code=403, detail="Bạn không phải thành viên gia phả")
          
-    if member.role not in ['admin', 'editor']:
+    if membership.role not in ['admin', 'editor']:
          raise HTTPException(status_code=403, detail="Chỉ Admin hoặc Editor mới có quyền thực hiện")
-    return member
+    return membership
+
+from db.neo4j_connection import sync_person_node, set_parents_in_graph, create_relationship_in_graph, delete_person_from_graph
+from search_index import index_persons, remove_from_index, search_persons, INDEXED_COLUMNS
+from relationship_sync import sync_person_relationships, regenerate_relationships
+from person_links import LINK_SPOUSE, add_link, linked_ids, delete_person_links
+
+def ensure_no_parent_cycle(db: Session, child_id: int, *parent_ids):
+    """Chặn liên kết cha/mẹ khiến 1 người thành tổ tiên của chính mình (tra closure table, không duyệt cây)."""
+    for parent_id in parent_ids:
+        if creates_cycle(db, child_id, parent_id):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Liên kết không hợp lệ: người {parent_id} là con cháu của người {child_id} (tạo vòng lặp cha/con)"
+            )
 
-from db.neo4j_connection import add_person_to_graph, create_relationship_in_graph, delete_person_from_graph
 
 # ----- Thêm thành viên -----
 @router.post("/", response_model=PersonRead)
@@ -81,181 +85,91 @@ def create_member(person: PersonCreate, db: Session = Depends(get_db), current_u
     is_father_of = person.is_father_of_id
     is_mother_of = person.is_mother_of_id
     
-    # Create the person
-    person_data = person.dict(exclude={'is_father_of_id', 'is_mother_of_id', 'spouse_id'})
-    db_person = Person(**person_data)
-    db.add(db_person)
-    db.commit()
-    db.refresh(db_person)
-    
-    # Link to child if specified
-    if is_father_of:
-        child = db.query(Person).filter(Person.id == is_father_of).first()
-        if child:
-            child.father_id = db_person.id
-            db.commit()
-            
-            # Sync to Relationship table with Vietnamese types
-            try:
-                # 1. (Father, Child) -> Bố
-                exists = db.query(Relationship).filter(Relationship.person1_id == db_person.id, Relationship.person2_id == child.id).first()
-                if not exists:
-                    db.add(Relationship(person1_id=db_person.id, person2_id=child.id, type="bố"))
-                
-                # 2. (Child, Father) -> Con
-                exists_rev = db.query(Relationship).filter(Relationship.person1_id == child.id, Relationship.person2_id == db_person.id).first()
-                if not exists_rev:
-                    child_role = "con trai" if child.gender == 'male' else "con gái"
-                    db.add(Relationship(person1_id=child.id, person2_id=db_person.id, type=child_role))
-                
-                db.commit()
-            except Exception as e:
-                print(f"Error syncing relationship (Father): {e}")
-
-            # Also sync to Neo4j
-            try:
-                create_relationship_in_graph(db_person.id, child.id, "FATHER_OF")
-            except: pass
-
-    if is_mother_of:
-        child = db.query(Person).filter(Person.id == is_mother_of).first()
-        if child:
-            child.mother_id = db_person.id
-            db.commit()
-
-            # Sync to Relationship table with Vietnamese types
-            try:
-                # 1. (Mother, Child) -> Mẹ
-                exists = db.query(Relationship).filter(Relationship.person1_id == db_person.id, Relationship.person2_id == child.id).first()
-                if not exists:
-                    db.add(Relationship(person1_id=db_person.id, person2_id=child.id, type="mẹ"))
-                
-                # 2. (Child, Mother) -> Con
-                exists_rev = db.query(Relationship).filter(Relationship.person1_id == child.id, Relationship.person2_id == db_person.id).first()
-                if not exists_rev:
-                    child_role = "con trai" if child.gender == 'male' else "con gái"
-                    db.add(Relationship(person1_id=child.id, person2_id=db_person.id, type=child_role))
-                
-                db.commit()
-            except Exception as e:
-                print(f"Error syncing relationship (Mother): {e}")
-
-            # Also sync to Neo4j
-            try:
-                create_relationship_in_graph(db_person.id, child.id, "MOTHER_OF")
-            except: pass
-
-    # Link to Spouse if specified
-    if person.spouse_id:
-        spouse = db.query(Person).filter(Person.id == person.spouse_id).first()
-        if spouse:
-            try:
-                # Determine roles based on gender
-                # db_person (New) -> Spouse (Existing)
-                role_1_to_2 = "chồng" if db_person.gender == 'male' else "vợ"
-                
-                # Spouse (Existing) -> db_person (New)
-                role_2_to_1 = "chồng" if spouse.gender == 'male' else "vợ"
-
-                # 1. DB Relationship
-                exists = db.query(Relationship).filter(
-                    Relationship.person1_id == db_person.id, 
-                    Relationship.person2_id == spouse.id
-                ).first()
-                
-                if not exists:
-                    db.add(Relationship(person1_id=db_person.id, person2_id=spouse.id, type=role_1_to_2))
-                    db.add(Relationship(person1_id=spouse.id, person2_id=db_person.id, type=role_2_to_1))
-                    db.commit()
-
-                # 2. Neo4j Sync
-                create_relationship_in_graph(db_person.id, spouse.id, "SPOUSE")
-                create_relationship_in_graph(spouse.id, db_person.id, "SPOUSE") 
-            except Exception as e:
-                print(f"Error linking spouse: {e}")
-    
-    # --- Sync Siblings (Anh/Chị/Em) ---
-    # Find siblings based on Father/Mother ID
-    siblings = set()
-    if db_person.father_id:
-        p_sibs = db.query(Person).filter(Person.father_id == db_person.father_id, Person.id != db_person.id).all()
-        siblings.update(p_sibs)
-    if db_person.mother_id:
-        m_sibs = db.query(Person).filter(Person.mother_id == db_person.mother_id, Person.id != db_person.id).all()
-        siblings.update(m_sibs)
+    # Người mới làm cha/mẹ của child: vòng lặp nếu child là cha/mẹ (hoặc tổ tiên của cha/mẹ) người mới
+    for child_id in (is_father_of, is_mother_of):
+        if child_id:
+            ensure_no_parent_cycle(db, child_id, person.father_id, person.mother_id)
     
-    for sib in siblings:
-        try:
-            # Determine relationship type
-            # Check full status
-            is_full = (sib.father_id == db_person.father_id) and (sib.mother_id == db_person.mother_id)
-            suffix = " ruột" if is_full else ""
-            
-            # Compare Age (DOB)
-            # Default: db_person is younger (since just created?) -> sibling is older
-            # Better: check DOB
-            am_i_older = False
-            if db_person.date_of_birth and sib.date_of_birth:
-                am_i_older = db_person.date_of_birth < sib.date_of_birth
-            else:
-                # Fallback: ID check (lower ID usually older)
-                am_i_older = db_person.id < sib.id
-            
-            # Relation 1: Me (P1) -> Sib (P2) ("Tôi là gì của Sib?")
-            if am_i_older:
-                my_role = "anh" if db_person.gender == 'male' else "chị"
-                if suffix: my_role += suffix
-            else:
-                my_role = "em"
-                if suffix: my_role += suffix
-                if db_person.gender == 'male': my_role += " trai"
-                else: my_role += " gái"
-
-            # Relation 2: Sib (P1) -> Me (P2) ("Sib là gì của Tôi?")
-            if not am_i_older: # Sib is older
-                sib_role = "anh" if sib.gender == 'male' else "chị"
-                if suffix: sib_role += suffix
-            else: # Sib is younger
-                sib_role = "em"
-                if suffix: sib_role += suffix
-                if sib.gender == 'male': sib_role += " trai"
-                else: sib_role += " gái"
-            
-            # Add to DB
-            exists1 = db.query(Relationship).filter(Relationship.person1_id == db_person.id, Relationship.person2_id == sib.id).first()
-            if not exists1:
-                db.add(Relationship(person1_id=db_person.id, person2_id=sib.id, type=my_role))
-                
-            exists2 = db.query(Relationship).filter(Relationship.person1_id == sib.id, Relationship.person2_id == db_person.id).first()
-            if not exists2:
-                db.add(Relationship(person1_id=sib.id, person2_id=db_person.id, type=sib_role))
-            
-            db.commit()
+    # 1. MySQL: person + liên kết cha/mẹ/vợ chồng/anh chị em + đời, closure, chỉ mục tìm kiếm, delta
+    #    trong CÙNG 1 transaction -> lỗi ở bước nào cũng rollback hết (không còn person thiếu
+    #    closure/delta/chỉ mục, guard vòng lặp cha/con đọc closure nên không được thiếu)
+    try:
+        person_data = person.dict(exclude={'is_father_of_id', 'is_mother_of_id', 'spouse_id'})
+        db_person = Person(**person_data)
+        db.add(db_person)
+        db.flush()
+        change_member_count(db, db_person.family_id, 1)
+
+        # Delta cho client (tree?since=)
+        tree_changes = TreeChangeSet(db_person.family_id)
+        tree_changes.parent_links_changed(db_person.id, None, None, db_person.father_id, db_person.mother_id)
+        touched_nodes = [] # Node có sẵn bị thay đổi (con được gắn cha/mẹ, vợ/chồng)
+        relinked_ids = [db_person.id] # Người có cha/mẹ thay đổi (cập nhật closure table)
+        graph_links = [] # Cạnh Neo4j tạo sau khi commit
+
+        # Link to child if specified
+        if is_father_of:
+            child = db.query(Person).filter(Person.id == is_father_of).first()
+            if child:
+                tree_changes.parent_links_changed(child.id, child.father_id, child.mother_id, db_person.id, child.mother_id)
+                touched_nodes.append(child)
+                relinked_ids.append(child.id)
+                child.father_id = db_person.id
+                graph_links.append((db_person.id, child.id, "FATHER_OF"))
+
+        if is_mother_of:
+            child = db.query(Person).filter(Person.id == is_mother_of).first()
+            if child:
+                tree_changes.parent_links_changed(child.id, child.father_id, child.mother_id, child.father_id, db_person.id)
+                touched_nodes.append(child)
+                relinked_ids.append(child.id)
+                child.mother_id = db_person.id
+                graph_links.append((db_person.id, child.id, "MOTHER_OF"))
+
+        # Link to Spouse if specified: 1 dòng person_links cho cặp (nhãn vợ/chồng tính theo giới tính khi đọc)
+        if person.spouse_id:
+            spouse = db.query(Person).filter(Person.id == person.spouse_id).first()
+            if spouse:
+                touched_nodes.append(spouse)
+                if add_link(db, db_person.id, spouse.id, LINK_SPOUSE):
+                    graph_links.append((db_person.id, spouse.id, "SPOUSE"))
+                    graph_links.append((spouse.id, db_person.id, "SPOUSE"))
+        db.flush()
+
+        # Liên kết anh/chị/em theo cha/mẹ (gom nhóm, insert 1 lượt)
+        for p1, p2 in sync_person_relationships(db, relinked_ids):
+            graph_links.append((p1, p2, "SIBLING"))
+            graph_links.append((p2, p1, "SIBLING"))
+
+        # Chỉ mục đời (Đời thứ N), closure, chỉ mục tìm kiếm + delta cây gia phả
+        refresh_lineage(db, [db_person.id] + [node.id for node in touched_nodes])
+        refresh_closure(db, relinked_ids)
+        index_persons(db, [db_person])
+        tree_changes.node_added(db, db_person)
+        for node in touched_nodes:
+            tree_changes.node_updated(db, node)
+        save_changes(db, tree_changes)
+        db.commit()
+        db.refresh(db_person)
+    except Exception as e:
+        db.rollback()
+        print(f"Create member error: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi tạo thành viên: {e}")
 
-            # Neo4j Sibling
-            try:
-                create_relationship_in_graph(db_person.id, sib.id, "SIBLING")
-                create_relationship_in_graph(sib.id, db_person.id, "SIBLING")
-            except: pass
-            
-        except Exception as ex:
-            print(f"Error syncing sibling {sib.id}: {ex}")
-    
-    # --- End Sibling Sync ---
+    if db_person.cccd:
+        invalidate_membership(family_id=db_person.family_id) # User có CCCD này giờ là thành viên
+    publish_tree_changes(tree_changes)
 
-    # --- Sync self to Neo4j ---
+    # 2. Sync Neo4j (sau khi MySQL đã commit; lỗi chỉ log, sync lại được bằng /maintenance)
     try:
-        full_name = f"{db_person.last_name} {db_person.first_name}".strip()
-        add_person_to_graph(
-            id=db_person.id,
-            full_name=full_name,
-            gender=db_person.gender,
-            family_id=db_person.family_id,
-            father_id=db_person.father_id,
-            mother_id=db_person.mother_id
-        )
+        sync_person_node(db_person, with_parents=True)
     except Exception as e:
         print(f"Neo4j Sync Error (create_member): {e}")
+    for from_id, to_id, rel_type in graph_links:
+        try:
+            create_relationship_in_graph(from_id, to_id, rel_type)
+        except Exception as e:
+            print(f"Neo4j Sync Error (create_member {rel_type} {from_id}->{to_id}): {e}")
         
     return db_person
 
@@ -270,117 +184,130 @@ def get_member_spouses(member_id: int, db: Session = Depends(get_db), current_us
     
     verify_family_access(db, current_user, member.family_id)
     
-    # Tìm tất cả quan hệ vợ/chồng từ bảng Relationship
-    spouse_relationships = db.query(Relationship).filter(
-        Relationship.person1_id == member_id,
-        Relationship.type.in_(['vợ', 'chồng'])
-    ).all()
-    
-    # Lấy thông tin chi tiết của các vợ/chồng
-    spouses = []
-    for rel in spouse_relationships:
-        spouse = db.query(Person).filter(Person.id == rel.person2_id).first()
-        if spouse:
-            spouses.append(spouse)
-    
-    return spouses
+    # Tìm tất cả liên kết vợ/chồng (index person_links theo (người, kind)), lấy thông tin 1 lượt
+    spouse_ids = linked_ids(db, member_id, LINK_SPOUSE)
+    if not spouse_ids:
+        return []
+    return db.query(Person).filter(Person.id.in_(spouse_ids)).order_by(Person.id).all()
 
 
 # ----- Lấy danh sách thành viên theo Family -----
+# Các cột của PersonRead, query thẳng dạng row thay vì load ORM object
+PERSON_READ_COLUMNS = (
+    Person.id, Person.family_id, Person.user_id, Person.cccd, Person.first_name, Person.last_name,
+    Person.gender, Person.role, Person.date_of_birth, Person.date_of_death, Person.place_of_birth,
+    Person.avatar_url, Person.biography, Person.father_id, Person.mother_id, Person.generation,
+)
+
+
+def person_row_to_dict(row):
+    data = dict(row._mapping)
+    data["role"] = data["role"] or "member"
+    return data
+
+
 @router.get("/{family_id}", response_model=List[PersonRead])
 def get_members_by_family(family_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     verify_family_access(db, current_user, family_id)
-    members = db.query(Person).filter(Person.family_id == family_id).all()
-    return members
-
+    rows = db.query(*PERSON_READ_COLUMNS).filter(Person.family_id == family_id).all()
+    # Fast path: serialize row -> dict -> JSON, không dựng PersonRead cho từng thành viên
+    return FastJSONResponse([person_row_to_dict(r) for r in rows])
+
+
+# ----- Tìm kiếm thành viên (không dấu, theo tiền tố) -----
+@router.get("/{family_id}/search", response_model=MemberSearchPage)
+def search_members(
+    family_id: int,
+    q: str = Query(..., min_length=1, max_length=200),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    verify_family_access(db, current_user, family_id)
+    total, hits = search_persons(db, family_id, q, skip, limit)
+    items = []
+    if hits:
+        rows = {r.id: r for r in db.query(*PERSON_READ_COLUMNS).filter(Person.id.in_([pid for pid, _ in hits])).all()}
+        for pid, score in hits:
+            if pid in rows:
+                item = person_row_to_dict(rows[pid])
+                item["score"] = score
+                items.append(item)
+    return FastJSONResponse({"query": q, "total": total, "skip": skip, "limit": limit, "items": items})
+
+
+from schemas import TreeResponse, TreeDeltaResponse
+
+
+def build_tree_payload(graph_nodes, graph_edges, base_url):
+    """
+    Dựng payload TreeResponse dạng dict thuần (không tạo TreeNode/TreeEdge cho từng phần tử).
+    graph_nodes đã chứa đủ thuộc tính hiển thị (xem get_family_graph), không cần query MySQL.
+    """
+    nodes = []
+    for n in graph_nodes:
+        # Fix URL if relative
+        url = n.get('avatar_url')
+        if url and url.startswith("/"):
+            url = f"{base_url}{url}"
+        birth_date = n.get('birth_date') # 'YYYY-MM-DD'
+        nodes.append({
+            "id": n['id'],
+            "name": n['name'],
+            "gender": n['gender'] or 'male',
+            "birth_year": str(n['birth_year']) if n.get('birth_year') else '?',
+            "dob": f"{birth_date[8:10]}/{birth_date[5:7]}/{birth_date[:4]}" if birth_date else None,
+            "avatar_url": url,
+            "father_id": n.get('father_id'),
+            "mother_id": n.get('mother_id'),
+            "spouses": n.get('spouses') or [],
+        })
+
+    edges = [{"from_id": e['from_id'], "to_id": e['to_id'], "type": e['type']} for e in graph_edges]
+    return {"nodes": nodes, "edges": edges}
+
+
+def build_delta_payload(version, since, changes, base_url):
+    """Payload TreeDeltaResponse (avatar tương đối -> URL đầy đủ như node trong snapshot)."""
+    for c in changes:
+        url = c["data"].get("avatar_url") if c["op"] in ("node_added", "node_updated") else None
+        if url and url.startswith("/"):
+            c["data"]["avatar_url"] = f"{base_url}{url}"
+    return {"version": version, "since": since, "changes": changes}
 
-from schemas import TreeResponse, TreeNode, TreeEdge
 
 # ----- Lấy dữ liệu Sơ đồ cây (GraphView) -----
-@router.get("/{family_id}/tree", response_model=TreeResponse)
-def get_family_tree(family_id: int, request: Request, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    """API trả về Nodes và Edges để vẽ cây gia phả (Query từ Neo4j)."""
-    # 1. Fetch Graph from Neo4j
+@router.get("/{family_id}/tree", response_model=Union[TreeResponse, TreeDeltaResponse])
+def get_family_tree(
+    family_id: int,
+    request: Request,
+    since: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    API trả về Nodes và Edges để vẽ cây gia phả (Query từ Neo4j).
+    Nếu có `since` (tree_version client đang giữ): chỉ trả về delta từ version đó,
+    hoặc full snapshot nếu version quá cũ.
+    """
+    base_url = str(request.base_url).rstrip('/')
+
+    if since is not None:
+        version, changes = get_changes_since(db, family_id, since)
+        if changes is not None:
+            return FastJSONResponse(build_delta_payload(version, since, changes, base_url))
+    else:
+        version = get_tree_version(db, family_id)
+
+    # 1 query Neo4j: node đã có avatar, ngày sinh, vợ/chồng -> không round trip MySQL
     from db.neo4j_connection import get_family_graph
     
     graph_data = get_family_graph(family_id)
-    
-    nodes = []
-    edges = []
-    
-    # Query SQL for reliable Spouse data and Avatars
-    spouse_map = {}
-    avatar_map = {}
-    try:
-        node_ids = [n['id'] for n in graph_data['nodes']]
-        if node_ids:
-            # 1. Spouses
-            sp_rels = db.query(Relationship).filter(
-                Relationship.type.in_(['vợ', 'chồng']),
-                Relationship.person1_id.in_(node_ids)
-            ).all()
-            
-            for r in sp_rels:
-                p1, p2 = r.person1_id, r.person2_id
-                if p1 not in spouse_map: spouse_map[p1] = []
-                if p2 not in spouse_map[p1]: spouse_map[p1].append(p2)
-            
-            # 2. Avatars & DOB & Birth Year (Fetch Persons via IN clause)
-            persons = db.query(Person).filter(Person.id.in_(node_ids)).all()
-            base_url = str(request.base_url).rstrip('/')
-            dob_map = {}
-            birth_year_map = {}
-            for p in persons:
-                if p.avatar_url:
-                    # Fix URL if relative
-                    url = p.avatar_url
-                    if url.startswith("/"):
-                        url = f"{base_url}{url}"
-                    avatar_map[p.id] = url
-                
-                # Capture DOB
-                if p.date_of_birth:
-                    dob_map[p.id] = p.date_of_birth.strftime("%d/%m/%Y")
-                    # Extract birth year from date_of_birth
-                    birth_year_map[p.id] = str(p.date_of_birth.year)
-                
-    except Exception as e:
-        print(f"Error fetching extra data from SQL: {e}")
-
-    for n in graph_data['nodes']:
-        nodes.append(TreeNode(
-            id=n['id'],
-            name=n['name'],
-            gender=n['gender'] or 'male',
-            birth_year=birth_year_map.get(n['id'], n.get('birth_year', '?')),
-            dob=dob_map.get(n['id']),
-            avatar_url=avatar_map.get(n['id']),
-            father_id=n.get('father_id'),
-            mother_id=n.get('mother_id'),
-            spouses=spouse_map.get(n['id'], [])
-        ))
-        
-    for e in graph_data['edges']:
-        # Map Neo4j edge type to our Edge type
-        # Neo4j: (Father)-[:PARENT_OF]->(Child)
-        # TreeEdge expects from -> to.
-        # But our TreeView (GraphView) expects directional edges.
-        # Logic in members.py before: Father->Child. PARENT_OF is Father->Child. So it matches.
-        
-        # We need to distinguish Father/Mother.
-        # But Neo4j edge is just PARENT_OF. We check Gender of From Node?
-        # GraphData edges: {from, to, type}.
-        # We can look up gender from nodes list.
-        
-        # Build map
-        node_gender_map = {n['id']: n['gender'] for n in graph_data['nodes']}
-        parent_gender = node_gender_map.get(e['from_id'], 'male')
-        
-        edge_type = 'FATHER_OF' if parent_gender == 'male' else 'MOTHER_OF'
-        
-        edges.append(TreeEdge(from_id=e['from_id'], to_id=e['to_id'], type=edge_type))
-            
-    return TreeResponse(nodes=nodes, edges=edges)
+    payload = build_tree_payload(graph_data['nodes'], graph_data['edges'], base_url)
+    # Version đọc trước khi lấy graph: delta sau đó (nếu có) client áp lại vẫn đúng
+    payload["version"] = version
+    return FastJSONResponse(payload)
 
 
 # ----- Cập nhật thành viên -----
@@ -392,25 +319,58 @@ def update_member(member_id: int, person_update: PersonCreate, db: Session = Dep
     
     verify_family_access(db, current_user, db_person.family_id)
     
+    old_family_id = db_person.family_id
+    old_father_id, old_mother_id = db_person.father_id, db_person.mother_id
+    
     update_data = person_update.dict(exclude_unset=True)
+    new_parent_ids = [
+        update_data[key] for key in ('father_id', 'mother_id')
+        if key in update_data and update_data[key] != getattr(db_person, key)
+    ]
+    ensure_no_parent_cycle(db, member_id, *new_parent_ids)
     for key, value in update_data.items():
         setattr(db_person, key, value)
+    if db_person.family_id != old_family_id:
+        change_member_count(db, old_family_id, -1)
+        change_member_count(db, db_person.family_id, 1)
     
+    # --- Chỉ mục đời + delta cây gia phả ---
+    db.flush()
+    if (db_person.father_id, db_person.mother_id, db_person.family_id) != (old_father_id, old_mother_id, old_family_id):
+        refresh_lineage(db, [db_person.id])
+    if (db_person.father_id, db_person.mother_id) != (old_father_id, old_mother_id):
+        refresh_closure(db, [db_person.id])
+        sync_person_relationships(db, [db_person.id])
+    if INDEXED_COLUMNS.intersection(update_data):
+        index_persons(db, [db_person])
+    if db_person.family_id == old_family_id:
+        tree_changes = TreeChangeSet(old_family_id)
+        tree_changes.parent_links_changed(db_person.id, old_father_id, old_mother_id, db_person.father_id, db_person.mother_id)
+        tree_changes.node_updated(db, db_person)
+        changesets = [tree_changes]
+    else:
+        # Chuyển sang gia phả khác: xóa khỏi cây cũ, thêm vào cây mới
+        removed = TreeChangeSet(old_family_id)
+        removed.node_removed(db_person.id)
+        added = TreeChangeSet(db_person.family_id)
+        added.node_added(db, db_person)
+        changesets = [removed, added]
+    for changeset in changesets:
+        save_changes(db, changeset)
 
     db.commit()
     db.refresh(db_person)
+    if 'cccd' in update_data or db_person.family_id != old_family_id:
+        invalidate_membership(family_id=old_family_id)
+        invalidate_membership(family_id=db_person.family_id)
+    publish_tree_changes(*changesets)
     
     # --- SYNC NEO4J (Update Info) ---
     try:
-        full_name = f"{db_person.last_name} {db_person.first_name}".strip()
-        add_person_to_graph(
-            id=db_person.id,
-            full_name=full_name,
-            gender=db_person.gender,
-            family_id=db_person.family_id
-            # Note: Not syncing parents here to avoid duplicating edges if changed. 
-            # Parent changes should be handled via specific relationship logic if needed.
-        )
+        sync_person_node(db_person)
+        # Cha/mẹ thay đổi: thay cạnh cũ thay vì MERGE thêm cạnh mới
+        if (db_person.father_id, db_person.mother_id) != (old_father_id, old_mother_id):
+            set_parents_in_graph(db_person.id, db_person.father_id, db_person.mother_id)
     except Exception as e:
         print(f"Neo4j Update Error: {e}")
 
@@ -428,14 +388,43 @@ def delete_member(member_id: int, db: Session = Depends(get_db), current_user: U
     
     # 1. Delete from MySQL
     try:
-        # 1a. Delete all relationships involving this person (to avoid foreign key constraint)
-        db.query(Relationship).filter(
-            (Relationship.person1_id == member_id) | (Relationship.person2_id == member_id)
-        ).delete(synchronize_session=False)
+        tree_changes = TreeChangeSet(db_person.family_id)
+        spouse_ids = linked_ids(db, member_id, LINK_SPOUSE)
+        children = db.query(Person).filter(
+            (Person.father_id == member_id) | (Person.mother_id == member_id)
+        ).all()
+
+        # 1a. Delete all links involving this person (to avoid foreign key constraint)
+        delete_person_links(db, member_id)
+
+        # 1b. Gỡ liên kết cha/mẹ của các con (tương đương ON DELETE SET NULL)
+        tree_changes.node_removed(member_id)
+        tree_changes.parent_links_changed(member_id, db_person.father_id, db_person.mother_id, None, None)
+        for child in children:
+            new_father_id = None if child.father_id == member_id else child.father_id
+            new_mother_id = None if child.mother_id == member_id else child.mother_id
+            tree_changes.parent_links_changed(child.id, child.father_id, child.mother_id, new_father_id, new_mother_id)
+            child.father_id, child.mother_id = new_father_id, new_mother_id
+        db.flush()
+        delete_person_closure(db, member_id)
+        remove_from_index(db, member_id)
+        refresh_closure(db, [child.id for child in children])
+        refresh_lineage(db, [child.id for child in children] + spouse_ids)
+        sync_person_relationships(db, [child.id for child in children])
+
+        for child in children:
+            tree_changes.node_updated(db, child)
+        for spouse in db.query(Person).filter(Person.id.in_(spouse_ids)).all() if spouse_ids else []:
+            tree_changes.node_updated(db, spouse)
+        save_changes(db, tree_changes)
         
-        # 1b. Delete the person
+        # 1c. Delete the person
+        family_id = db_person.family_id
         db.delete(db_person)
+        change_member_count(db, family_id, -1)
         db.commit()
+        invalidate_membership(family_id=family_id)
+        publish_tree_changes(tree_changes)
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Lỗi xóa dữ liệu MySQL: {e}")
@@ -586,6 +575,13 @@ async def import_members(
         
         # --- PASS 2: UPDATE RELATIONSHIPS ---
         
+        # Lưu cha/mẹ ban đầu của anchor để ghi delta nếu bị thay đổi
+        anchor_before = None
+        if anchor_id:
+            anchor_obj = db.query(Person).filter(Person.id == anchor_id).first()
+            if anchor_obj:
+                anchor_before = (anchor_obj, anchor_obj.father_id, anchor_obj.mother_id)
+        
         for person, row in persons_to_update:
             # 1. Check direct father_id/mother_id columns
             f_val = row[col_father] if col_father and pd.notna(row[col_father]) else None
@@ -639,43 +635,44 @@ async def import_members(
         # --- SYNC TO RELATIONSHIP TABLE ---
         sync_errors = []
         try:
-            for person, row in persons_to_update:
-                try:
-                    with db.begin_nested():
-                        # Sync Father
-                        if person.father_id:
-                            exists = db.query(Relationship).filter(
-                                Relationship.person1_id == person.id,
-                                Relationship.person2_id == person.father_id,
-                                Relationship.type == 'bố'
-                            ).first()
-                            if not exists:
-                                db.add(Relationship(
-                                    person1_id=person.id, 
-                                    person2_id=person.father_id, 
-                                    type='bố' 
-                                ))
-                        
-                        # Sync Mother
-                        if person.mother_id:
-                            exists = db.query(Relationship).filter(
-                                Relationship.person1_id == person.id,
-                                Relationship.person2_id == person.mother_id,
-                                Relationship.type == 'mẹ'
-                            ).first()
-                            if not exists:
-                                db.add(Relationship(
-                                    person1_id=person.id, 
-                                    person2_id=person.mother_id, 
-                                    type='mẹ'
-                                ))
-                except Exception as inner_e:
-                    # Nested rollback happens automatically on exit of context manager if error
-                    # print(f"DEBUG: Error syncing row {person.id}: {inner_e}") # Suppress excessive logs
-                    sync_errors.append(str(inner_e))
+            # Liên kết anh/chị/em: sinh lại cho cả family 1 lượt (gom nhóm theo cha/mẹ)
+            try:
+                db.flush()
+                with db.begin_nested():
+                    regenerate_relationships(db, family_id)
+            except Exception as inner_e:
+                sync_errors.append(str(inner_e))
+            
+            # --- Chỉ mục đời: tính lại cả family 1 lượt ---
+            db.flush()
+            cycles = find_parent_cycles(
+                db.query(Person.id, Person.father_id, Person.mother_id).filter(Person.family_id == family_id).all()
+            )
+            if cycles:
+                raise ValueError(f"File tạo vòng lặp cha/con giữa các thành viên {cycles[0]}")
+            rebuild_family_lineage(db, family_id)
+            index_persons(db, [person for person, row in persons_to_update])
+            
+            # --- Delta cây gia phả ---
+            tree_changes = TreeChangeSet(family_id)
+            if len(persons_to_update) > MAX_DELTA_CHANGES:
+                tree_changes.reset()
+            else:
+                for person, row in persons_to_update:
+                    tree_changes.node_added(db, person)
+                    tree_changes.parent_links_changed(person.id, None, None, person.father_id, person.mother_id)
+                if anchor_before:
+                    anchor_obj, old_f, old_m = anchor_before
+                    if (anchor_obj.father_id, anchor_obj.mother_id) != (old_f, old_m):
+                        tree_changes.parent_links_changed(anchor_obj.id, old_f, old_m, anchor_obj.father_id, anchor_obj.mother_id)
+                        tree_changes.node_updated(db, anchor_obj)
+            save_changes(db, tree_changes)
             
             # Commit the main transaction (Persons)
+            recount_members(db, family_id)
             db.commit()
+            invalidate_membership(family_id=family_id) # CCCD trong file có thể khớp user
+            publish_tree_changes(tree_changes)
             
             # --- PASS 3: SYNC TO NEO4J (2-Step approach to avoid race condition) ---
             print("DEBUG: Starting Neo4j Sync (2-Step)...")
@@ -684,16 +681,8 @@ async def import_members(
             # Step 1: Create all Person Nodes first
             for person, row in persons_to_update:
                 try:
-                    full_name = f"{person.last_name} {person.first_name}".strip()
-                    # Call with father/mother=None to only create the node
-                    add_person_to_graph(
-                        id=person.id,
-                        full_name=full_name,
-                        gender=person.gender,
-                        family_id=family_id,
-                        father_id=None,
-                        mother_id=None
-                    )
+                    # Chỉ tạo node (cạnh cha/mẹ tạo ở Step 2)
+                    sync_person_node(person)
                 except Exception as ex:
                     print(f"Neo4j Node Sync Error (Row {person.id}): {ex}")
                     neo4j_errors.append(f"Node: {ex}")
@@ -708,6 +697,15 @@ async def import_members(
                 except Exception as ex:
                     print(f"Neo4j Rel Sync Error (Row {person.id}): {ex}")
                     neo4j_errors.append(f"Rel: {ex}")
+
+            # Anchor bị gắn cha/mẹ mới từ file import
+            if anchor_before:
+                anchor_obj, old_f, old_m = anchor_before
+                if (anchor_obj.father_id, anchor_obj.mother_id) != (old_f, old_m):
+                    try:
+                        set_parents_in_graph(anchor_obj.id, anchor_obj.father_id, anchor_obj.mother_id)
+                    except Exception as ex:
+                        neo4j_errors.append(f"Rel: {ex}")
             
         except Exception as e:
             db.rollback() 
@@ -738,29 +736,11 @@ async def import_members(
 # ----- TÌM KIẾM MỐI QUAN HỆ (NEO4J) -----
 from db.neo4j_connection import find_shortest_path
 
-@router.post("/path")
-def find_relationship_path(
-    data: dict, # {from_id: int, to_id: int}
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    from_id = data.get("from_id")
-    to_id = data.get("to_id")
-    
-    if not from_id or not to_id:
-         raise HTTPException(status_code=400, detail="Missing from_id or to_id")
-    
-    # Verify access to both persons? Or just if they belong to accessible families?
-    # Ideally check if user can see both. For simplicity, we trust Neo4j graph context or check family_id
-    
-    path = find_shortest_path(from_id, to_id)
-    if not path:
-         return {"relationship": "Không tìm thấy mối quan hệ"}
-         
-    # Path structure: {'nodes': [{id, name, gender}, ...], 'rels': [{start, end, type}, ...]}
-    nodes = path['nodes']
-    rels = path['rels']
-    
+def describe_relationship_path(db: Session, nodes, rels):
+    """
+    Diễn giải đường đi Neo4j thành câu mô tả quan hệ (dùng chung cho bản sync và async của /path).
+    nodes: [{id, name, gender}, ...], rels: [{start, end, type}, ...]
+    """
     # --- HÀM TỔNG HỢP QUAN HỆ (MỤC 3 EXPLANATION) ---
     def get_summary_term(nodes, rels):
         n_steps = len(rels)
@@ -1619,3 +1599,26 @@ def find_relationship_path(
     
     return result
 
+
+@router.post("/path")
+def find_relationship_path(
+    data: dict, # {from_id: int, to_id: int}
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    from_id = data.get("from_id")
+    to_id = data.get("to_id")
+    
+    if not from_id or not to_id:
+         raise HTTPException(status_code=400, detail="Missing from_id or to_id")
+    
+    # Verify access to both persons? Or just if they belong to accessible families?
+    # Ideally check if user can see both. For simplicity, we trust Neo4j graph context or check family_id
+    
+    path = find_shortest_path(from_id, to_id)
+    if not path:
+         return {"relationship": "Không tìm thấy mối quan hệ"}
+         
+    # Path structure: {'nodes': [{id, name, gender}, ...], 'rels': [{start, end, type}, ...]}
+    return describe_relationship_path(db, path['nodes'], path['rels'])
+
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from db.mysql_connection import SessionLocal
-from models import Person, Relationship
+from models import Person
+from person_links import LINK_SPOUSE, linked_ids, relation_label
 from typing import List, Optional, Dict
 from datetime import date
 
@@ -190,13 +191,10 @@ def calculate_relationship(person1_id: int, person2_id: int, family_id: int, db:
     p1 = person_map[person1_id]
     p2 = person_map[person2_id]
 
-    # 0. Check Direct
-    direct_rel = db.query(Relationship).filter(
-        Relationship.person1_id == person2_id,
-        Relationship.person2_id == person1_id
-    ).first()
+    # 0. Check Direct (P2 là gì của P1: bố/mẹ/con/vợ/chồng/anh/chị/em, nhãn tính từ dữ liệu người)
+    direct_rel = relation_label(db, p2, p1)
     if direct_rel:
-        return {"relationship": direct_rel.type}
+        return {"relationship": direct_rel}
 
     # 1. Blood
     blood_rel = _calculate_blood_relationship(person1_id, person2_id, person_map, parents_map, p1, p2)
@@ -205,14 +203,10 @@ def calculate_relationship(person1_id: int, person2_id: int, family_id: int, db:
 
     # 2. In-Law (Thông qua Vợ/Chồng)
     # Tìm vợ/chồng của P1
-    spouse_rel_p1 = db.query(Relationship).filter(
-        ((Relationship.person1_id == person1_id) & (Relationship.type.in_(['Vợ', 'Chồng']))) |
-        ((Relationship.person2_id == person1_id) & (Relationship.type.in_(['Vợ', 'Chồng'])))
-    ).first()
+    spouse_ids_p1 = linked_ids(db, person1_id, LINK_SPOUSE)
 
-    if spouse_rel_p1:
+    for s1_id in spouse_ids_p1:
         # P1 có spouse là S1
-        s1_id = spouse_rel_p1.person2_id if spouse_rel_p1.person1_id == person1_id else spouse_rel_p1.person1_id
         if s1_id in person_map:
             # Check quan hệ của P2 đối với S1 (P2 là gì của S1?)
             rel_p2_s1 = _calculate_blood_relationship(s1_id, person2_id, person_map, parents_map, person_map[s1_id], p2)
@@ -229,13 +223,9 @@ def calculate_relationship(person1_id: int, person2_id: int, family_id: int, db:
     # Logic: P2 is Spouse of S2. S2 is related to P1 (e.g. S2 is Son/Daughter of P1).
     # Then P2 is Son/Daughter-in-law.
     
-    spouse_rel_p2 = db.query(Relationship).filter(
-        ((Relationship.person1_id == person2_id) & (Relationship.type.in_(['Vợ', 'Chồng']))) |
-        ((Relationship.person2_id == person2_id) & (Relationship.type.in_(['Vợ', 'Chồng'])))
-    ).first()
+    spouse_ids_p2 = linked_ids(db, person2_id, LINK_SPOUSE)
 
-    if spouse_rel_p2:
-         s2_id = spouse_rel_p2.person2_id if spouse_rel_p2.person1_id == person2_id else spouse_rel_p2.person1_id
+    for s2_id in spouse_ids_p2:
          if s2_id in person_map:
              # Check quan hệ của S2 đối với P1 (S2 là gì của P1?)
              rel_s2_p1 = _calculate_blood_relationship(person1_id, s2_id, person_map, parents_map, p1, person_map[s2_id])
@@ -0,0 +1,117 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, HTTPException
+from typing import Dict, Optional
+import asyncio
+from db.mysql_connection import SessionLocal
+from routers.chat import ConnectionManager, get_user_from_token
+from tree_delta import TreeChangeSet, MAX_DELTA_CHANGES
+
+router = APIRouter(
+    prefix="/families",
+    tags=["tree events"]
+)
+
+# Gom các thay đổi liên tiếp (VD: import, nhiều thao tác sửa nhanh) thành 1 event
+COALESCE_DELAY_SECONDS = 0.2
+
+
+class TreeEventCoalescer:
+    """
+    Đẩy delta cây gia phả tới các client đang xem family qua WebSocket.
+
+    publish() được gọi từ các route sync (chạy trong threadpool) sau khi commit,
+    nên chỉ chuyển dữ liệu sang event loop bằng call_soon_threadsafe. Các delta của
+    cùng family trong COALESCE_DELAY_SECONDS được gửi chung trong một event.
+    """
+
+    def __init__(self, manager: ConnectionManager, delay: float = COALESCE_DELAY_SECONDS):
+        self.manager = manager
+        self.delay = delay
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # family_id -> {"version": int, "reset": bool, "changes": [...]}
+        self.pending: Dict[int, dict] = {}
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def publish(self, changeset: TreeChangeSet):
+        if self.loop is None or changeset.version is None:
+            return
+        if not self.manager.bus.distributed and changeset.family_id not in self.manager.active_connections:
+            return # Không ai đang xem -> bỏ qua (bus nhiều worker: người xem có thể ở worker khác)
+        changes = [{"version": changeset.version, **c} for c in changeset.changes]
+        self.loop.call_soon_threadsafe(self._enqueue, changeset.family_id, changeset.version, changes)
+
+    def _enqueue(self, family_id: int, version: int, changes: list):
+        batch = self.pending.get(family_id)
+        if batch is None:
+            batch = {"version": version, "reset": False, "changes": []}
+            self.pending[family_id] = batch
+            self.loop.call_later(self.delay, lambda: asyncio.ensure_future(self._flush(family_id)))
+
+        batch["version"] = max(batch["version"], version)
+        batch["changes"].extend(changes)
+        if any(c["op"] == "reset" for c in changes) or len(batch["changes"]) > MAX_DELTA_CHANGES:
+            # Quá nhiều thay đổi -> client tự tải lại snapshot
+            batch["reset"] = True
+            batch["changes"] = []
+
+    async def _flush(self, family_id: int):
+        batch = self.pending.pop(family_id, None)
+        if not batch:
+            return
+        await self.manager.broadcast({
+            "type": "tree_changes",
+            "family_id": family_id,
+            "version": batch["version"],
+            "reset": batch["reset"],
+            "changes": batch["changes"],
+        }, family_id)
+
+
+tree_manager = ConnectionManager("tree")
+tree_events = TreeEventCoalescer(tree_manager)
+
+
+def publish_tree_changes(*changesets: TreeChangeSet):
+    """Gọi sau khi commit: đẩy delta tới client đang xem cây (không raise lỗi)."""
+    for changeset in changesets:
+        try:
+            tree_events.publish(changeset)
+        except Exception as e:
+            print(f"Tree event publish error: {e}")
+
+
+@router.websocket("/{family_id}/tree/ws")
+async def tree_websocket_endpoint(
+    websocket: WebSocket,
+    family_id: int,
+    token: str = Query(...)
+):
+    # Authenticate + check quyền (session ngắn, không giữ suốt vòng đời socket)
+    from routers.members import verify_family_access
+    db = SessionLocal()
+    try:
+        user = get_user_from_token(token, db)
+        if user:
+            try:
+                verify_family_access(db, user, family_id)
+            except HTTPException:
+                user = None
+    finally:
+        db.close()
+
+    if not user:
+        await websocket.close(code=4001, reason="Unauthorized/Invalid Token")
+        return
+
+    tree_events.bind_loop(asyncio.get_running_loop())
+    try:
+        await tree_manager.connect(websocket, family_id)
+        while True:
+            # Client không cần gửi gì, chỉ giữ kết nối (ping)
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        tree_manager.disconnect(websocket, family_id)
+    except Exception as e:
+        print(f"Tree WebSocket Error: {e}")
+        tree_manager.disconnect(websocket, family_id)
@@ -3,11 +3,19 @@ from sqlalchemy.orm import Session
 from db.mysql_connection import get_db
 import models, schemas
 from models import User
-from passlib.context import CryptContext
+from membership import invalidate_membership
+from user_cache import invalidate_user
+from starlette.concurrency import run_in_threadpool
+from passwords import hash_password, PasswordQueueFull
 
 router = APIRouter(prefix="/user", tags=["users"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+async def hash_password_or_503(password: str) -> str:
+    try:
+        return await hash_password(password)
+    except PasswordQueueFull:
+        raise HTTPException(status_code=503, detail="Hệ thống đang bận, vui lòng thử lại", headers={"Retry-After": "1"})
 
 
 # Lấy tất cả users
@@ -45,71 +53,84 @@ def get_user(user_id: int, db: Session = Depends(get_db)):
 
 
 # Tạo user mới (hash mật khẩu trước khi lưu)
+# async: bcrypt chạy trên executor riêng (passwords.py), phần DB chạy trong threadpool
 @router.post("/")
-def create_user(data: schemas.UserCreate, db: Session = Depends(get_db)):
-    # Kiểm tra username đã tồn tại chưa
-    if db.query(User).filter(User.username == data.username).first():
+async def create_user(data: schemas.UserCreate, db: Session = Depends(get_db)):
+    # Kiểm tra username đã tồn tại chưa (trước khi tốn công băm mật khẩu)
+    if await run_in_threadpool(lambda: db.query(User).filter(User.username == data.username).first()):
         raise HTTPException(status_code=400, detail="Username already registered")
-    
-    # Tạo user mới
-    user = models.User(
-        username=data.username,
-        password_hash=pwd_context.hash(data.password),
-        first_name=data.first_name,
-        last_name=data.last_name,
-        gender=data.gender,
-        date_of_birth=data.date_of_birth,
-        place_of_birth=data.place_of_birth,
-        email=data.email,
-        role=data.role,
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
-    return {
-        "id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name,
-        "email": user.email,
-        "role": user.role,
-    }
+
+    password_hash = await hash_password_or_503(data.password)
+
+    def save():
+        # Tạo user mới
+        user = models.User(
+            username=data.username,
+            password_hash=password_hash,
+            first_name=data.first_name,
+            last_name=data.last_name,
+            gender=data.gender,
+            date_of_birth=data.date_of_birth,
+            place_of_birth=data.place_of_birth,
+            email=data.email,
+            role=data.role,
+        )
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        return {
+            "id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "email": user.email,
+            "role": user.role,
+        }
+
+    return await run_in_threadpool(save)
 
 # Cập nhật user
 @router.put("/{user_id}")
-def update_user(user_id: int, data: schemas.UserUpdate, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="Người dùng không tồn tại")
+async def update_user(user_id: int, data: schemas.UserUpdate, db: Session = Depends(get_db)):
+    # Băm mật khẩu mới (nếu có) trên executor riêng trước, phần DB chạy trong threadpool
+    password_hash = await hash_password_or_503(data.password) if data.password else None
 
-    # Nếu có password mới thì hash lại
-    if data.password:
-        user.password_hash = pwd_context.hash(data.password)
+    def save():
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="Người dùng không tồn tại")
 
-    # Cập nhật các field khác (chỉ update nếu gửi lên)
-    if data.username:
-        user.username = data.username
-    if data.first_name:
-        user.first_name = data.first_name
-    if data.last_name:
-        user.last_name = data.last_name
-    if data.email:
-        user.email = data.email
-    if data.role:
-        user.role = data.role
+        # Nếu có password mới thì dùng hash đã băm sẵn
+        if password_hash:
+            user.password_hash = password_hash
 
+        # Cập nhật các field khác (chỉ update nếu gửi lên)
+        if data.username:
+            user.username = data.username
+        if data.first_name:
+            user.first_name = data.first_name
+        if data.last_name:
+            user.last_name = data.last_name
+        if data.email:
+            user.email = data.email
+        if data.role:
+            user.role = data.role
 
-    db.commit()
-    db.refresh(user)
 
-    return {
-        "user_id": user.id,
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name,
-        "email": user.email,
-        "role": user.role
-    }
+        db.commit()
+        db.refresh(user)
+        invalidate_user(user.id)
+
+        return {
+            "user_id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "email": user.email,
+            "role": user.role
+        }
+
+    return await run_in_threadpool(save)
 # xóa user
  
 @router.delete("/{id}")
@@ -120,4 +141,6 @@ def delete_user(id: int, db: Session = Depends(get_db)):
 
     db.delete(user)
     db.commit()
+    invalidate_membership(user_id=id)
+    invalidate_user(id)
     return {"message": "Xóa người dùng thành công"}
\ No newline at end of file
@@ -1,6 +1,6 @@
 from enum import Enum
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import date
 
 
@@ -97,6 +97,7 @@ class PersonRead(PersonBase):
     id: int
     role: Optional[str] = "member"
     user_id: Optional[int] = None
+    generation: Optional[int] = None # Đời thứ N
 
     class Config:
         from_attributes = True
@@ -122,6 +123,104 @@ class TreeEdge(BaseModel):
 class TreeResponse(BaseModel):
     nodes: List[TreeNode]
     edges: List[TreeEdge]
+    version: int = 0 # tree_version của family tại thời điểm snapshot
+
+class TreeChangeRead(BaseModel):
+    version: int
+    op: str # node_added, node_updated, node_removed, edge_added, edge_removed
+    data: dict # TreeNode / TreeEdge / {id}
+
+class TreeDeltaResponse(BaseModel):
+    version: int
+    since: int
+    changes: List[TreeChangeRead]
+
+
+class MemberSearchResult(PersonRead):
+    score: int # Điểm khớp, cao hơn = liên quan hơn
+
+class MemberSearchPage(BaseModel):
+    query: str
+    total: int
+    skip: int
+    limit: int
+    items: List[MemberSearchResult]
+
+
+class DuplicatePerson(BaseModel):
+    id: int
+    name: str
+
+class DuplicateSuggestion(BaseModel):
+    person_a: DuplicatePerson
+    person_b: DuplicatePerson
+    score: float # 0..1
+    reasons: List[str]
+
+class MergeMembersRequest(BaseModel):
+    keep_id: int # Người giữ lại
+    duplicate_id: int # Người bị gộp (xóa)
+
+class DuplicateReport(BaseModel):
+    family_id: int
+    status: str # idle, running, done
+    version: Optional[int] = None # tree_version lúc quét
+    stale: bool = False
+    generated_at: Optional[str] = None
+    error: Optional[str] = None
+    total: int
+    skip: int
+    limit: int
+    suggestions: List[DuplicateSuggestion]
+
+
+# --- Genealogy Schemas ---
+class GenerationSummary(BaseModel):
+    generation: int # Đời thứ N
+    count: int
+
+class GenerationPage(BaseModel):
+    generation: int
+    total: int
+    skip: int
+    limit: int
+    items: List[PersonRead]
+
+class BranchStatistics(BaseModel):
+    person_id: int
+    name: str
+    descendants: int
+    living_descendants: int
+    male_line_descendants: int # Hậu duệ theo dòng cha
+    average_lifespan: Optional[float] = None # Năm
+
+class FamilyStatistics(BaseModel):
+    family_id: int
+    root_id: Optional[int] = None # None = cả gia phả
+    version: int # tree_version dùng để tính
+    total_members: int
+    living_members: int
+    male_members: int
+    male_line_members: Optional[int] = None
+    average_lifespan: Optional[float] = None
+    generations: List[GenerationSummary]
+    branches: List[BranchStatistics]
+
+class LineageMember(PersonRead):
+    depth: int # Số đời cách người được hỏi
+
+class LineagePage(BaseModel):
+    person_id: int
+    total: int
+    skip: int
+    limit: int
+    items: List[LineageMember]
+
+class LineageCheck(BaseModel):
+    ancestor_id: int
+    descendant_id: int
+    is_ancestor: bool
+    depth: Optional[int] = None
 
 
 # --- Family Schemas ---
@@ -148,6 +247,18 @@ class FamilyUpdate(BaseModel):
 class JoinFamilyRequest(BaseModel):
     join_code: str
 
+class GraftRequest(BaseModel):
+    source_family_id: int
+    root_id: Optional[int] = None # Gốc nhánh cần chuyển, None = gộp toàn bộ gia phả nguồn
+    attach_to_id: Optional[int] = None # Người ở gia phả đích làm cha/mẹ của gốc nhánh
+    id_map: Dict[int, int] = {} # {id ở nguồn: id ở đích} cho người có sẵn ở cả 2 gia phả
+
+class GraftResult(BaseModel):
+    source_family_id: int
+    target_family_id: int
+    moved: int
+    merged: int
+
 class UpdateMemberRoleRequest(BaseModel):
     role: str # 'editor' or 'member'
 
@@ -171,3 +282,28 @@ class MessageRead(BaseModel):
 
     class Config:
         from_attributes = True
+
+class MessageSearchResult(MessageRead):
+    snippet: str # Đoạn trích quanh từ khớp
+    highlights: List[List[int]] # [start, end) của các từ khớp trong snippet
+
+class MessageSearchPage(BaseModel):
+    query: str
+    limit: int
+    items: List[MessageSearchResult]
+    next_before_id: Optional[int] = None # Truyền lại làm before_id để lấy trang tiếp (None = hết)
+
+class ChatReadAck(BaseModel):
+    message_id: int # Tin mới nhất client đã hiển thị
+
+class ChatReadStateRead(BaseModel):
+    family_id: int
+    unread: int
+    last_read_message_id: int
+
+class ChatUnreadFamily(ChatReadStateRead):
+    name: str
+
+class ChatUnreadSummary(BaseModel):
+    total: int
+    families: List[ChatUnreadFamily]
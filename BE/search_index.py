@@ -0,0 +1,137 @@
+"""
+Chỉ mục tìm kiếm thành viên (không dấu, không phân biệt thanh điệu).
+
+Tên, quê quán và CCCD của mỗi Person được chuẩn hóa (bỏ dấu tiếng Việt, đ -> d, chữ thường)
+rồi tách token, lưu vào bảng person_search_tokens với index (family_id, token).
+Truy vấn "nguyen van" khớp token theo tiền tố (token LIKE 'nguyen%': tiền tố cố định nên dùng được
+index với mọi collation), không phải quét toàn bộ persons. Điểm, tổng số kết quả và phân trang
+đều tính trong SQL nên tiền tố ngắn ("ng") vẫn đếm/xếp hạng đúng trên toàn bộ người khớp.
+
+index_persons() được gọi trong cùng transaction với các thao tác ghi thành viên.
+"""
+import re
+import unicodedata
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from models import Person, PersonSearchToken
+
+# Trọng số theo trường: khớp tên / CCCD quan trọng hơn khớp quê quán
+FIELD_WEIGHTS = {"name": 3, "cccd": 3, "place": 1}
+MAX_TOKEN_LENGTH = 64
+MAX_QUERY_TERMS = 8
+REBUILD_BATCH_SIZE = 2000
+# Cột Person ảnh hưởng tới chỉ mục (sửa các cột khác không cần index lại)
+INDEXED_COLUMNS = {"first_name", "last_name", "place_of_birth", "cccd", "family_id"}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold(text: Optional[str]) -> str:
+    """'Nguyễn Đức' -> 'nguyen duc'."""
+    if not text:
+        return ""
+    text = text.replace("đ", "d").replace("Đ", "D")
+    text = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn").lower()
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return [t[:MAX_TOKEN_LENGTH] for t in _TOKEN_RE.findall(fold(text))]
+
+
+def person_tokens(person) -> set:
+    """Tập (field, token) của 1 người."""
+    tokens = {("name", t) for t in tokenize(f"{person.last_name or ''} {person.first_name or ''}")}
+    tokens.update(("place", t) for t in tokenize(person.place_of_birth))
+    if person.cccd:
+        tokens.update(("cccd", t) for t in tokenize(person.cccd))
+    return tokens
+
+
+def index_persons(db: Session, persons: Iterable[Person]):
+    """Ghi lại token cho persons (đã flush, chưa commit)."""
+    persons = [p for p in persons if p.id]
+    if not persons:
+        return
+    db.query(PersonSearchToken).filter(
+        PersonSearchToken.person_id.in_([p.id for p in persons])
+    ).delete(synchronize_session=False)
+    rows = [
+        {"person_id": p.id, "family_id": p.family_id, "field": field, "token": token}
+        for p in persons
+        for field, token in person_tokens(p)
+    ]
+    if rows:
+        db.bulk_insert_mappings(PersonSearchToken, rows)
+
+
+def remove_from_index(db: Session, person_id: int):
+    db.query(PersonSearchToken).filter(PersonSearchToken.person_id == person_id).delete(synchronize_session=False)
+
+
+def rebuild_search_index(db: Session, family_id: Optional[int] = None) -> int:
+    """Dựng lại chỉ mục (cả hệ thống hoặc 1 family) theo từng lô, có commit. Trả về số người đã index."""
+    query = db.query(Person)
+    if family_id is not None:
+        query = query.filter(Person.family_id == family_id)
+    count, last_id = 0, 0
+    while True:
+        batch = query.filter(Person.id > last_id).order_by(Person.id).limit(REBUILD_BATCH_SIZE).all()
+        if not batch:
+            break
+        index_persons(db, batch)
+        db.commit()
+        count += len(batch)
+        last_id = batch[-1].id
+    return count
+
+
+def _prefix(column, term: str):
+    """
+    token bắt đầu bằng term. Dùng LIKE thay cho khoảng (>= term AND < term + '{'): khoảng đó chỉ đúng
+    với collation nhị phân, bảng tạo bởi create_all / create_database.py là utf8mb4_unicode_ci.
+    token chỉ gồm [a-z0-9] nên không cần escape % và _.
+    """
+    return column.like(term + "%")
+
+
+def search_persons(db: Session, family_id: int, query: str, skip: int = 0, limit: int = 20) -> Tuple[int, List[Tuple[int, int]]]:
+    """
+    Tìm thành viên trong family. Mọi từ trong query phải khớp (đầy đủ hoặc tiền tố) ít nhất 1 token.
+    Trả về (total, [(person_id, score), ...] của trang hiện tại), xếp theo điểm giảm dần.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return 0, []
+
+    # Mỗi từ: điểm tốt nhất của từng người = trọng số trường x (2 nếu khớp nguyên token, 1 nếu chỉ
+    # khớp tiền tố), quét khoảng tiền tố trên (family_id, token). Join các từ theo person_id = người
+    # khớp đủ mọi từ; điểm = tổng các từ.
+    weight = case(FIELD_WEIGHTS, value=PersonSearchToken.field, else_=1)
+    term_scores = []
+    for term in terms:
+        term_scores.append(
+            db.query(
+                PersonSearchToken.person_id.label("person_id"),
+                func.max(weight * case((PersonSearchToken.token == term, 2), else_=1)).label("score"),
+            ).filter(
+                PersonSearchToken.family_id == family_id, _prefix(PersonSearchToken.token, term)
+            ).group_by(PersonSearchToken.person_id).subquery()
+        )
+
+    first = term_scores[0]
+    total_score = first.c.score
+    matched = db.query(first.c.person_id, first.c.score)
+    for other in term_scores[1:]:
+        matched = matched.join(other, other.c.person_id == first.c.person_id)
+        total_score = total_score + other.c.score
+    matched = matched.with_entities(first.c.person_id, total_score.label("score"))
+
+    total = matched.count()
+    if not total:
+        return 0, []
+    page = matched.order_by(total_score.desc(), first.c.person_id).offset(skip).limit(limit).all()
+    return total, [(pid, int(score)) for pid, score in page]
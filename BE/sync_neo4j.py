@@ -5,7 +5,7 @@ import sys
 sys.path.append('.')
 
 from db.mysql_connection import SessionLocal
-from db.neo4j_connection import Neo4jConnection, add_person_to_graph, create_relationship_in_graph
+from db.neo4j_connection import Neo4jConnection, sync_person_node, create_relationship_in_graph
 from models import Person
 from dotenv import load_dotenv
 
@@ -25,9 +25,8 @@ def sync_all_to_neo4j():
         print("\n👤 Adding all persons to Neo4j...")
         all_persons = db.query(Person).all()
         for person in all_persons:
-            full_name = f"{person.last_name or ''} {person.first_name}".strip()
-            add_person_to_graph(person.id, full_name, person.gender, person.family_id)
-            print(f"  ✓ Added: {full_name} (ID: {person.id})")
+            sync_person_node(person)
+            print(f"  ✓ Added: {person.last_name or ''} {person.first_name} (ID: {person.id})")
         
         # 3. Thêm tất cả relationships
         print("\n🔗 Adding relationships...")
@@ -50,20 +49,18 @@ def sync_all_to_neo4j():
         
         # 4. Thêm SPOUSE relationships
         print("\n💑 Adding spouse relationships...")
-        from models import Relationship
-        spouse_rels = db.query(Relationship).filter(Relationship.type.in_(['vợ', 'chồng'])).all()
-        processed_pairs = set()
+        from models import PersonLink
+        from person_links import LINK_SPOUSE
+        # Mỗi cặp vợ/chồng chỉ 1 dòng trong person_links
+        spouse_links = db.query(PersonLink).filter(PersonLink.kind == LINK_SPOUSE).all()
         
-        for rel in spouse_rels:
-            pair = tuple(sorted([rel.person1_id, rel.person2_id]))
-            if pair not in processed_pairs:
-                try:
-                    create_relationship_in_graph(rel.person1_id, rel.person2_id, "SPOUSE")
-                    create_relationship_in_graph(rel.person2_id, rel.person1_id, "SPOUSE")
-                    print(f"  ✓ SPOUSE: {rel.person1_id} <-> {rel.person2_id}")
-                    processed_pairs.add(pair)
-                except Exception as e:
-                    print(f"  ❌ Error creating SPOUSE: {e}")
+        for link in spouse_links:
+            try:
+                create_relationship_in_graph(link.person1_id, link.person2_id, "SPOUSE")
+                create_relationship_in_graph(link.person2_id, link.person1_id, "SPOUSE")
+                print(f"  ✓ SPOUSE: {link.person1_id} <-> {link.person2_id}")
+            except Exception as e:
+                print(f"  ❌ Error creating SPOUSE: {e}")
         
         print("\n✅ Sync completed!")
         
@@ -0,0 +1,73 @@
+"""Ghép nhánh / gộp gia phả (family_graft.py). Chạy: cd BE && python -m pytest -q tests"""
+import os
+import sys
+
+os.environ.setdefault("MYSQL_URL", "sqlite://")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.mysql_connection import Base
+from models import Family, Person
+from family_graft import graft_family
+from lineage import rebuild_family_lineage
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all([Family(id=1, name="Nguồn"), Family(id=2, name="Đích")])
+    session.commit()
+    yield session
+    session.close()
+
+
+def add_person(db, family_id, name, father=None, gender="male"):
+    person = Person(family_id=family_id, first_name=name, gender=gender, father_id=father.id if father else None)
+    db.add(person)
+    db.flush()
+    return person
+
+
+def test_branch_graft_rejects_mapping_outside_branch(db):
+    grandpa = add_person(db, 1, "Ông")
+    uncle = add_person(db, 1, "Bác", father=grandpa)
+    father = add_person(db, 1, "Cha", father=grandpa)
+    add_person(db, 1, "Con", father=father)
+    uncle_copy = add_person(db, 2, "Bác")
+    rebuild_family_lineage(db, 1)
+    db.commit()
+
+    with pytest.raises(ValueError):
+        graft_family(db, 1, 2, root_id=father.id, id_map={uncle.id: uncle_copy.id})
+    db.rollback()
+
+    # Người ngoài nhánh vẫn còn nguyên ở gia phả nguồn
+    assert db.get(Person, uncle.id).family_id == 1
+    assert db.get(Person, father.id).family_id == 1
+
+
+def test_full_family_merge_moves_everyone_and_merges_mapped(db):
+    grandpa = add_person(db, 1, "Ông")
+    father = add_person(db, 1, "Cha", father=grandpa)
+    child = add_person(db, 1, "Con", father=father)
+    grandpa_copy = add_person(db, 2, "Ông")
+    rebuild_family_lineage(db, 1)
+    rebuild_family_lineage(db, 2)
+    db.commit()
+    grandpa_id, father_id, child_id = grandpa.id, father.id, child.id
+
+    result = graft_family(db, 1, 2, id_map={grandpa_id: grandpa_copy.id})
+    db.commit()
+
+    assert sorted(result["moved_ids"]) == sorted([father_id, child_id])
+    assert db.get(Person, grandpa_id) is None
+    assert db.get(Person, father_id).family_id == 2
+    assert db.get(Person, father_id).father_id == grandpa_copy.id
+    assert db.get(Person, child_id).family_id == 2
+    assert db.get(Family, 1).member_count == 0
+    assert db.get(Family, 2).member_count == 3
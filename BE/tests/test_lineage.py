@@ -0,0 +1,71 @@
+"""Chống vòng lặp cha/con (lineage.creates_cycle, members.ensure_no_parent_cycle). Chạy: cd BE && python -m pytest -q tests"""
+import os
+import sys
+
+os.environ.setdefault("MYSQL_URL", "sqlite://")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.mysql_connection import Base
+from models import Person
+from lineage import creates_cycle, rebuild_family_lineage
+from routers.members import ensure_no_parent_cycle
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def add_chain(db, names):
+    """Ông -> cha -> con ...: mỗi người là con của người đứng trước."""
+    people, father = [], None
+    for name in names:
+        person = Person(family_id=1, first_name=name, gender="male", father_id=father.id if father else None)
+        db.add(person)
+        db.flush()
+        people.append(person)
+        father = person
+    rebuild_family_lineage(db, 1)
+    db.commit()
+    return people
+
+
+def test_self_parent_is_cycle(db):
+    person, = add_chain(db, ["An"])
+    assert creates_cycle(db, person.id, person.id)
+    with pytest.raises(HTTPException) as error:
+        ensure_no_parent_cycle(db, person.id, person.id)
+    assert error.value.status_code == 400
+
+
+def test_child_as_parent_of_own_parent_is_cycle(db):
+    father, child = add_chain(db, ["Cha", "Con"])
+    assert creates_cycle(db, father.id, child.id)
+    with pytest.raises(HTTPException):
+        ensure_no_parent_cycle(db, father.id, child.id)
+
+
+def test_grandchild_as_parent_of_grandparent_is_cycle(db):
+    grandpa, father, grandchild = add_chain(db, ["Ông", "Cha", "Cháu"])
+    assert creates_cycle(db, grandpa.id, grandchild.id)
+    with pytest.raises(HTTPException):
+        ensure_no_parent_cycle(db, grandpa.id, None, grandchild.id)
+
+
+def test_reparent_to_unrelated_person_is_allowed(db):
+    grandpa, father, child = add_chain(db, ["Ông", "Cha", "Con"])
+    uncle, = add_chain(db, ["Chú"])
+    # Con chuyển sang làm con của chú, hoặc lên làm con của ông: không tạo vòng
+    assert not creates_cycle(db, child.id, uncle.id)
+    assert not creates_cycle(db, child.id, grandpa.id)
+    assert not creates_cycle(db, child.id, None)
+    ensure_no_parent_cycle(db, child.id, uncle.id, grandpa.id)
@@ -0,0 +1,54 @@
+"""Tìm thành viên theo tiền tố (search_index.py). Chạy: cd BE && python -m pytest -q tests"""
+import os
+import sys
+
+os.environ.setdefault("MYSQL_URL", "sqlite://")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.mysql_connection import Base
+from models import Person
+from search_index import index_persons, search_persons
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def add_people(db, family_id, names):
+    people = [Person(family_id=family_id, last_name=last, first_name=first, gender="male") for last, first in names]
+    db.add_all(people)
+    db.flush()
+    index_persons(db, people)
+    db.commit()
+    return people
+
+
+def test_prefix_finds_longer_token(db):
+    nguyen, = add_people(db, 1, [("Nguyễn", "Văn An")])
+    total, hits = search_persons(db, 1, "ngu")
+    assert total == 1
+    assert hits[0][0] == nguyen.id
+
+
+def test_exact_token_ranks_above_prefix(db):
+    prefix_only, exact = add_people(db, 1, [("Nguyễn", "Anh"), ("Nguyễn", "An")])
+    total, hits = search_persons(db, 1, "nguyen an")
+    assert total == 2
+    assert [pid for pid, _ in hits] == [exact.id, prefix_only.id]
+
+
+def test_total_and_paging_cover_every_match(db):
+    add_people(db, 1, [("Nguyễn", f"Người {i}") for i in range(120)])
+    add_people(db, 2, [("Nguyễn", "Khác họ")])
+    total, hits = search_persons(db, 1, "ng", skip=100, limit=50)
+    assert total == 120
+    assert len(hits) == 20
@@ -0,0 +1,165 @@
+"""
+Delta cho cây gia phả.
+
+Mỗi Family có `tree_version` tăng dần. Mỗi lần ghi (thêm/sửa/xóa thành viên, import...)
+router gom các thay đổi vào một TreeChangeSet rồi gọi save_changes() trước khi commit:
+version được tăng 1 lần và các delta (node/edge added/updated/removed) được ghi vào
+bảng tree_changes. Client gọi GET /members/{family_id}/tree?since=<version> để lấy delta.
+"""
+import json
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from models import Family, Person, TreeChange
+from person_links import LINK_SPOUSE, linked_ids
+
+# Giữ lại delta của N version gần nhất cho mỗi family
+TREE_CHANGE_RETENTION = 1000
+# Quá số delta này thì trả full snapshot (rẻ hơn cho client) / ghi 1 delta "reset"
+MAX_DELTA_CHANGES = 500
+
+
+def node_payload(db: Session, person: Person) -> dict:
+    """Node giống TreeNode; avatar_url để dạng tương đối, router tự ghép base_url khi đọc."""
+    spouses = linked_ids(db, person.id, LINK_SPOUSE)
+    dob = person.date_of_birth
+    if isinstance(dob, str):
+        # Import gán chuỗi 'YYYY-MM-DD' trước khi flush
+        dob = date.fromisoformat(dob)
+    return {
+        "id": person.id,
+        "name": f"{person.last_name or ''} {person.first_name}".strip(),
+        "gender": person.gender or 'male',
+        "birth_year": str(dob.year) if dob else '?',
+        "dob": dob.strftime("%d/%m/%Y") if dob else None,
+        "avatar_url": person.avatar_url,
+        "father_id": person.father_id,
+        "mother_id": person.mother_id,
+        "spouses": spouses,
+    }
+
+
+def edge_payload(from_id: int, to_id: int, type: str) -> dict:
+    return {"from_id": from_id, "to_id": to_id, "type": type}
+
+
+class TreeChangeSet:
+    """Các thay đổi của một lần ghi trên một family."""
+
+    def __init__(self, family_id: int):
+        self.family_id = family_id
+        self.changes: List[dict] = []
+        self.version: Optional[int] = None
+
+    def __bool__(self):
+        return bool(self.changes)
+
+    def _add(self, op: str, data: dict):
+        self.changes.append({"op": op, "data": data})
+
+    def node_added(self, db: Session, person: Person):
+        self._add("node_added", node_payload(db, person))
+
+    def node_updated(self, db: Session, person: Person):
+        self._add("node_updated", node_payload(db, person))
+
+    def node_removed(self, person_id: int):
+        self._add("node_removed", {"id": person_id})
+
+    def edge_added(self, from_id: int, to_id: int, type: str):
+        self._add("edge_added", edge_payload(from_id, to_id, type))
+
+    def edge_removed(self, from_id: int, to_id: int, type: str):
+        self._add("edge_removed", edge_payload(from_id, to_id, type))
+
+    def reset(self):
+        """Thay đổi hàng loạt: không ghi từng delta, client tải lại full snapshot."""
+        self._add("reset", {})
+
+    def parent_links_changed(self, child_id: int, old_father_id, old_mother_id, new_father_id, new_mother_id):
+        """Sinh edge_removed/edge_added khi father_id/mother_id của child thay đổi."""
+        if old_father_id != new_father_id:
+            if old_father_id:
+                self.edge_removed(old_father_id, child_id, "FATHER_OF")
+            if new_father_id:
+                self.edge_added(new_father_id, child_id, "FATHER_OF")
+        if old_mother_id != new_mother_id:
+            if old_mother_id:
+                self.edge_removed(old_mother_id, child_id, "MOTHER_OF")
+            if new_mother_id:
+                self.edge_added(new_mother_id, child_id, "MOTHER_OF")
+
+
+def bump_tree_version(db: Session, family_id: int) -> Optional[int]:
+    """
+    Tăng tree_version (chưa commit), trả về version mới (None nếu family không tồn tại).
+    Gọi thẳng (không kèm delta) khi chỉ dữ liệu dẫn xuất thay đổi (đời, closure): client tree?since=
+    nhận version mới với 0 thay đổi, còn cache theo version (family_stats) tự tính lại.
+    """
+    db.query(Family).filter(Family.id == family_id).update(
+        {Family.tree_version: Family.tree_version + 1}, synchronize_session=False
+    )
+    return db.query(Family.tree_version).filter(Family.id == family_id).scalar()
+
+
+def save_changes(db: Session, changeset: TreeChangeSet) -> Optional[int]:
+    """
+    Tăng tree_version của family và ghi delta (chưa commit, caller tự commit).
+    Trả về version mới, hoặc None nếu không có thay đổi.
+    """
+    if not changeset or changeset.family_id is None:
+        return None
+
+    version = bump_tree_version(db, changeset.family_id)
+    if version is None:
+        return None
+
+    if len(changeset.changes) > MAX_DELTA_CHANGES or any(c["op"] == "reset" for c in changeset.changes):
+        # Thay đổi lớn (import...) -> client nên tải lại full snapshot
+        rows = [{"op": "reset", "data": {}}]
+    else:
+        rows = changeset.changes
+
+    db.bulk_insert_mappings(TreeChange, [
+        {
+            "family_id": changeset.family_id,
+            "version": version,
+            "op": c["op"],
+            "payload": json.dumps(c["data"], ensure_ascii=False),
+        }
+        for c in rows
+    ])
+    db.query(TreeChange).filter(
+        TreeChange.family_id == changeset.family_id,
+        TreeChange.version <= version - TREE_CHANGE_RETENTION
+    ).delete(synchronize_session=False)
+
+    changeset.version = version
+    return version
+
+
+def get_tree_version(db: Session, family_id: int) -> int:
+    return db.query(Family.tree_version).filter(Family.id == family_id).scalar() or 0
+
+
+def get_changes_since(db: Session, family_id: int, since: int):
+    """
+    Trả về (current_version, changes). changes = None nghĩa là client phải tải full snapshot
+    (since quá cũ, quá nhiều delta, hoặc có delta "reset").
+    """
+    current = get_tree_version(db, family_id)
+    if since == current:
+        return current, []
+    if since > current or since < current - TREE_CHANGE_RETENTION:
+        return current, None
+
+    rows = db.query(TreeChange.version, TreeChange.op, TreeChange.payload).filter(
+        TreeChange.family_id == family_id,
+        TreeChange.version > since
+    ).order_by(TreeChange.version, TreeChange.id).limit(MAX_DELTA_CHANGES + 1).all()
+
+    if len(rows) > MAX_DELTA_CHANGES or any(r.op == "reset" for r in rows):
+        return current, None
+    return current, [{"version": r.version, "op": r.op, "data": json.loads(r.payload)} for r in rows]
@@ -0,0 +1,114 @@
+"""
+Cache user đã xác thực cho get_current_user / WebSocket (get_user_from_token).
+
+Mỗi request có token trước đây đều SELECT users theo id. Ở đây giữ bản chụp (CurrentUser, không gắn
+session) theo user_id trong USER_CACHE_TTL giây; update_profile / update_user / delete_user gọi
+invalidate_user() ngay, TTL chỉ giới hạn độ trễ giữa các worker.
+
+CurrentUser là bản chỉ đọc: endpoint muốn sửa user phải query lại User trong session của mình.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy.orm import Session
+
+from models import User
+
+USER_CACHE_TTL = 30          # giây
+USER_CACHE_SIZE = 10000
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    id: int
+    username: str
+    first_name: Optional[str]
+    last_name: Optional[str]
+    gender: Optional[str]
+    date_of_birth: Optional[date]
+    place_of_birth: Optional[str]
+    email: str
+    cccd: Optional[str]
+    role: str
+
+    @classmethod
+    def from_orm(cls, user: User) -> "CurrentUser":
+        return cls(
+            id=user.id, username=user.username, first_name=user.first_name, last_name=user.last_name,
+            gender=user.gender, date_of_birth=user.date_of_birth, place_of_birth=user.place_of_birth,
+            email=user.email, cccd=user.cccd, role=user.role,
+        )
+
+
+class _UserCache:
+    def __init__(self, size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[int, tuple]" = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[CurrentUser]:
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user: CurrentUser):
+        with self.lock:
+            self.entries[user.id] = (time.monotonic() + self.ttl, user)
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: Optional[int] = None):
+        with self.lock:
+            if user_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(user_id, None)
+
+
+user_cache = _UserCache()
+
+
+def load_user(db: Session, user_id: int) -> Optional[CurrentUser]:
+    """User theo id: lấy từ cache, miss thì query 1 lần. Không cache user không tồn tại."""
+    user = user_cache.get(user_id)
+    if user is None:
+        row = db.query(User).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        user = CurrentUser.from_orm(row)
+        user_cache.put(user)
+    return user
+
+
+def load_users(db: Session, user_ids: Iterable[int]) -> Dict[int, CurrentUser]:
+    """Nhiều user theo id (VD người gửi của 1 trang chat): lấy từ cache, phần thiếu query 1 lần (IN)."""
+    result: Dict[int, CurrentUser] = {}
+    missing = []
+    for user_id in set(user_ids):
+        user = user_cache.get(user_id)
+        if user is None:
+            missing.append(user_id)
+        else:
+            result[user_id] = user
+    if missing:
+        for row in db.query(User).filter(User.id.in_(missing)):
+            user = CurrentUser.from_orm(row)
+            user_cache.put(user)
+            result[user.id] = user
+    return result
+
+
+def invalidate_user(user_id: Optional[int] = None):
+    user_cache.invalidate(user_id)
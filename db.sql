@@ -48,6 +48,8 @@ CREATE TABLE IF NOT EXISTS families (
     join_code VARCHAR(10) UNIQUE COMMENT 'Mã tham gia gia phả',
     owner_id INT COMMENT 'Người tạo gia phả',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    tree_version INT NOT NULL DEFAULT 0 COMMENT 'Version cây gia phả, tăng mỗi lần thay đổi',
+    member_count INT NOT NULL DEFAULT 0 COMMENT 'Số thành viên (persons), cập nhật khi thêm/xóa',
     
     INDEX idx_join_code (join_code),
     INDEX idx_owner (owner_id),
@@ -77,8 +79,11 @@ CREATE TABLE IF NOT EXISTS persons (
     mother_id INT COMMENT 'ID của mẹ',
     biography TEXT COMMENT 'Tiểu sử',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    generation INT COMMENT 'Đời thứ N (thủy tổ = 1)',
+    lineage_root_id INT COMMENT 'Thủy tổ của dòng',
     
     INDEX idx_family (family_id),
+    INDEX idx_persons_family_generation (family_id, generation),
     INDEX idx_user (user_id),
     INDEX idx_cccd (cccd),
     INDEX idx_father (father_id),
@@ -95,8 +100,8 @@ COMMENT='Bảng quản lý thành viên gia phả';
 
 
 -- ================================================
--- 4. TABLE: relationships
--- Quản lý mối quan hệ giữa các thành viên
+-- 4. TABLE: relationships (CŨ - thay bằng person_links ở mục 9)
+-- Chỉ giữ để chạy migrate_db.py trên database cũ
 -- ================================================
 CREATE TABLE IF NOT EXISTS relationships (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -127,7 +132,7 @@ CREATE TABLE IF NOT EXISTS messages (
     message_type VARCHAR(20) DEFAULT 'text' COMMENT 'Loại: text, image, file',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     
-    INDEX idx_family (family_id),
+    INDEX idx_messages_family_created (family_id, created_at, id) COMMENT 'Phân trang lịch sử chat (keyset)',
     INDEX idx_sender (sender_id),
     INDEX idx_created_at (created_at),
     
@@ -137,6 +142,135 @@ CREATE TABLE IF NOT EXISTS messages (
 COMMENT='Bảng quản lý tin nhắn chat';
 
 
+-- ================================================
+-- 6. TABLE: tree_changes
+-- Delta thay đổi cây gia phả (GET /members/{family_id}/tree?since=)
+-- ================================================
+CREATE TABLE IF NOT EXISTS tree_changes (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    family_id INT NOT NULL,
+    version INT NOT NULL COMMENT 'tree_version của family sau thay đổi',
+    op VARCHAR(20) NOT NULL COMMENT 'node_added, node_updated, node_removed, edge_added, edge_removed, reset',
+    payload TEXT NOT NULL COMMENT 'JSON node/edge',
+    
+    INDEX idx_tree_changes_family_version (family_id, version),
+    
+    FOREIGN KEY (family_id) REFERENCES families(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Bảng delta thay đổi cây gia phả';
+
+
+-- ================================================
+-- 7. TABLE: person_lineage
+-- Closure table tổ tiên/hậu duệ (depth 1 = cha/mẹ, 2 = ông/bà, ...)
+-- ================================================
+CREATE TABLE IF NOT EXISTS person_lineage (
+    ancestor_id INT NOT NULL,
+    descendant_id INT NOT NULL,
+    depth INT NOT NULL,
+    
+    PRIMARY KEY (ancestor_id, descendant_id),
+    INDEX idx_lineage_ancestor_depth (ancestor_id, depth),
+    INDEX idx_lineage_descendant_depth (descendant_id, depth),
+    
+    FOREIGN KEY (ancestor_id) REFERENCES persons(id) ON DELETE CASCADE,
+    FOREIGN KEY (descendant_id) REFERENCES persons(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Bảng closure tổ tiên/hậu duệ';
+
+
+-- ================================================
+-- 8. TABLE: person_search_tokens
+-- Chỉ mục tìm kiếm thành viên (token tên/quê quán/CCCD đã bỏ dấu)
+-- ================================================
+CREATE TABLE IF NOT EXISTS person_search_tokens (
+    person_id INT NOT NULL,
+    field VARCHAR(10) NOT NULL COMMENT 'name, place, cccd',
+    token VARCHAR(64) NOT NULL COMMENT 'Chữ thường, không dấu',
+    family_id INT,
+    
+    PRIMARY KEY (person_id, field, token),
+    INDEX idx_search_family_token (family_id, token),
+    
+    FOREIGN KEY (person_id) REFERENCES persons(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin
+COMMENT='Bảng chỉ mục tìm kiếm thành viên';
+
+
+-- ================================================
+-- 9. TABLE: person_links
+-- Quan hệ vợ/chồng (kind 1), anh chị em (kind 2): 1 dòng/cặp, person1_id < person2_id
+-- Nhãn (vợ, chồng, anh ruột, em gái...) tính khi đọc; cha/mẹ lấy từ persons.father_id/mother_id
+-- ================================================
+CREATE TABLE IF NOT EXISTS person_links (
+    person1_id INT NOT NULL COMMENT 'ID nhỏ hơn của cặp',
+    kind SMALLINT NOT NULL COMMENT '1 = vợ/chồng, 2 = anh chị em',
+    person2_id INT NOT NULL COMMENT 'ID lớn hơn của cặp',
+    
+    PRIMARY KEY (person1_id, kind, person2_id),
+    INDEX idx_links_person2_kind (person2_id, kind, person1_id),
+    
+    FOREIGN KEY (person1_id) REFERENCES persons(id) ON DELETE CASCADE,
+    FOREIGN KEY (person2_id) REFERENCES persons(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Bảng liên kết vợ/chồng, anh chị em';
+
+
+-- ================================================
+-- 10. TABLE: message_search_tokens
+-- Chỉ mục tìm kiếm chat (mỗi từ đã bỏ dấu của 1 tin nhắn 1 dòng, xem BE/chat_search.py)
+-- ================================================
+CREATE TABLE IF NOT EXISTS message_search_tokens (
+    message_id INT NOT NULL,
+    token VARCHAR(64) NOT NULL COMMENT 'Chữ thường, không dấu',
+    family_id INT NOT NULL,
+    created_at TIMESTAMP NOT NULL COMMENT 'Chép từ messages.created_at',
+    
+    PRIMARY KEY (message_id, token),
+    INDEX idx_msg_search_family_token (family_id, token, created_at, message_id),
+    
+    FOREIGN KEY (message_id) REFERENCES messages(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin
+COMMENT='Bảng chỉ mục tìm kiếm tin nhắn chat';
+
+
+-- ================================================
+-- 11. TABLE: chat_read_state
+-- Tin chưa đọc: con trỏ đã đọc + bộ đếm của mỗi (user, gia phả), xem BE/read_state.py
+-- ================================================
+CREATE TABLE IF NOT EXISTS chat_read_state (
+    user_id INT NOT NULL,
+    family_id INT NOT NULL,
+    last_read_message_id INT NOT NULL DEFAULT 0 COMMENT 'Tin mới nhất đã đọc',
+    unread_count INT NOT NULL DEFAULT 0 COMMENT 'Số tin của người khác sau con trỏ',
+    
+    PRIMARY KEY (user_id, family_id),
+    INDEX idx_read_state_family (family_id, user_id),
+    
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (family_id) REFERENCES families(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+COMMENT='Bảng trạng thái đã đọc chat';
+
+
+-- ================================================
+-- MIGRATIONS (cho database đã tạo từ phiên bản cũ)
+-- ================================================
+-- ALTER TABLE families ADD COLUMN tree_version INT NOT NULL DEFAULT 0;
+-- ALTER TABLE families ADD COLUMN member_count INT NOT NULL DEFAULT 0;
+-- UPDATE families f SET member_count = (SELECT COUNT(*) FROM persons p WHERE p.family_id = f.id);
+-- ALTER TABLE persons ADD COLUMN generation INT, ADD COLUMN lineage_root_id INT,
+--     ADD INDEX idx_persons_family_generation (family_id, generation);
+--     (sau đó gọi POST /genealogy/{family_id}/generations/rebuild cho từng gia phả)
+-- Bảng person_lineage: tạo như mục 7 ở trên, rồi gọi lại POST .../generations/rebuild để điền dữ liệu
+-- Bảng person_search_tokens: tạo như mục 8 ở trên, rồi gọi POST /maintenance/rebuild-search-index
+-- Bảng person_links: tạo như mục 9 ở trên, chạy `python migrate_db.py` (chuyển vợ/chồng + sinh anh chị em),
+--     kiểm tra xong thì DROP TABLE relationships;
+-- ALTER TABLE messages ADD INDEX idx_messages_family_created (family_id, created_at, id), DROP INDEX idx_family;
+-- Bảng message_search_tokens: tạo như mục 10 ở trên, rồi gọi POST /maintenance/rebuild-chat-search-index
+-- Bảng chat_read_state: tạo như mục 11 ở trên (dòng của mỗi user tự tạo khi client hỏi số tin chưa đọc)
+
+
 -- ================================================
 -- Tạo thư mục uploads (placeholder table)
 -- ================================================
@@ -170,6 +304,10 @@ SHOW TABLES;
 -- DESCRIBE persons;
 -- DESCRIBE relationships;
 -- DESCRIBE messages;
+-- DESCRIBE tree_changes;
+-- DESCRIBE person_lineage;
+-- DESCRIBE person_search_tokens;
+-- DESCRIBE person_links;
 
 
 -- ================================================
@@ -178,6 +316,12 @@ SHOW TABLES;
 
 -- Uncomment để xóa tất cả các bảng (theo thứ tự dependency)
 -- SET FOREIGN_KEY_CHECKS = 0;
+-- DROP TABLE IF EXISTS chat_read_state;
+-- DROP TABLE IF EXISTS message_search_tokens;
+-- DROP TABLE IF EXISTS person_links;
+-- DROP TABLE IF EXISTS person_search_tokens;
+-- DROP TABLE IF EXISTS person_lineage;
+-- DROP TABLE IF EXISTS tree_changes;
 -- DROP TABLE IF EXISTS messages;
 -- DROP TABLE IF EXISTS relationships;
 -- DROP TABLE IF EXISTS persons;